@@ -1,17 +1,161 @@
 import logging
 import os
 import subprocess
-from typing import NamedTuple, Sequence
+import time
+from threading import Lock
+from typing import NamedTuple, Protocol, Sequence
+
+from .metrics import histogram
 
 logger = logging.getLogger(__name__)
 
+# Calls slower than this log a warning, at most once per SLOW_LOG_INTERVAL
+SLOW_CALL_MS = float(os.environ.get("HHD_ADJ_ACPI_SLOW_MS", 20))
+SLOW_LOG_INTERVAL = 60
+# Buckets per power of two, values are kept within ~6%
+SUB_BUCKETS = 16
+
+ACPI_DURATION = histogram(
+    "adjustor_acpi_call_duration_seconds",
+    "Time spent executing ACPI calls.",
+    "seconds",
+    buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 1),
+)
+
 
 class Command(NamedTuple):
     method: str
     args: Sequence[bytes]
 
 
+class Backend(Protocol):
+    """Replaces acpi_call, e.g., with a firmware emulator. `write()` receives
+    the command as written to /proc/acpi/call and `read()` returns what reading
+    the file would."""
+
+    def write(self, cmd: str) -> None: ...
+
+    def read(self) -> str: ...
+
+
+_backend: Backend | None = None
+
+
+def set_backend(backend: Backend | None):
+    global _backend
+    if backend:
+        logger.warning(f"Routing ACPI calls to '{type(backend).__name__}'.")
+    _backend = backend
+
+
+class LatencyHistogram:
+    """HDR-style histogram of call latencies in nanoseconds. Buckets are log
+    linear (SUB_BUCKETS per power of two), so any latency is recorded with
+    constant relative precision and fixed memory."""
+
+    def __init__(self) -> None:
+        self.counts: dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    @staticmethod
+    def _index(ns: int):
+        shift = max(ns.bit_length() - 5, 0)
+        return shift * SUB_BUCKETS + (ns >> shift)
+
+    @staticmethod
+    def _upper(idx: int):
+        if idx < 2 * SUB_BUCKETS:
+            return idx
+        shift = idx // SUB_BUCKETS - 1
+        return ((idx - shift * SUB_BUCKETS + 1) << shift) - 1
+
+    def record(self, ns: int):
+        idx = self._index(ns)
+        self.counts[idx] = self.counts.get(idx, 0) + 1
+        self.count += 1
+        self.total += ns
+        self.min = ns if self.min is None else min(self.min, ns)
+        self.max = max(self.max, ns)
+
+    def percentile(self, q: float):
+        if not self.count:
+            return None
+        target = q * self.count
+        acc = 0
+        for idx in sorted(self.counts):
+            acc += self.counts[idx]
+            if acc >= target:
+                return min(self._upper(idx), self.max)
+        return self.max
+
+    def summary(self):
+        """Returns the call count and latencies in milliseconds."""
+        ms = lambda v: v / 1e6 if v is not None else None
+        return {
+            "count": self.count,
+            "mean": ms(self.total / self.count) if self.count else None,
+            "min": ms(self.min),
+            "p50": ms(self.percentile(0.5)),
+            "p99": ms(self.percentile(0.99)),
+            "max": ms(self.max),
+        }
+
+
+_stats_lock = Lock()
+_stats: dict[str, LatencyHistogram] = {}
+_slow_logged: dict[str, tuple[float, int]] = {}
+
+
+def _record_call(method: str, cmd: str, ns: int):
+    with _stats_lock:
+        hist = _stats.get(method, None)
+        if hist is None:
+            hist = LatencyHistogram()
+            _stats[method] = hist
+        hist.record(ns)
+
+        slow = ns / 1e6 >= SLOW_CALL_MS
+        if slow:
+            curr = time.perf_counter()
+            last, suppressed = _slow_logged.get(method, (None, 0))
+            if last is not None and curr - last < SLOW_LOG_INTERVAL:
+                _slow_logged[method] = (last, suppressed + 1)
+                slow = False
+            else:
+                _slow_logged[method] = (curr, 0)
+    ACPI_DURATION.observe(ns / 1e9, method=method)
+
+    if slow:
+        logger.warning(
+            f"Slow ACPI call ({ns / 1e6:.1f}ms"
+            + (f", {suppressed} more since last warning" if suppressed else "")
+            + f"):\n'{cmd}'"
+        )
+
+
+def get_call_stats():
+    """Returns the latency summary of each ACPI method called so far."""
+    with _stats_lock:
+        return {m: h.summary() for m, h in _stats.items()}
+
+
+def log_call_stats():
+    stats = get_call_stats()
+    if not stats:
+        return
+    info = "\n".join(
+        f" - {m:>16s}: {s['count']:5d} calls, p50 {s['p50']:7.2f}ms, p99 {s['p99']:7.2f}ms, max {s['max']:7.2f}ms"
+        for m, s in stats.items()
+    )
+    logger.info(f"ACPI call latencies:\n{info}")
+
+
 def initialize():
+    if _backend:
+        return True
     try:
         o = subprocess.run(["modprobe", "acpi_call"], capture_output=True)
         logger.info(f"'acpi_call' modprobe output:\n{(o.stdout + o.stderr).decode()}".strip())
@@ -22,6 +166,8 @@ def initialize():
 
 
 def check_perms():
+    if _backend:
+        return True
     try:
         with open("/proc/acpi/call", "wb") as f:
             return f.writable()
@@ -42,8 +188,18 @@ def call(method: str, args: Sequence[bytes | int], risky: bool = True):
     log(f"Executing ACPI call:\n'{cmd}'")
 
     try:
+        if _backend:
+            start = time.perf_counter_ns()
+            _backend.write(cmd)
+            _record_call(method, cmd, time.perf_counter_ns() - start)
+            return True
+
         with open("/proc/acpi/call", "wb") as f:
+            # The method runs in the kernel during the write
+            start = time.perf_counter_ns()
             f.write(cmd.encode())
+            f.flush()
+            _record_call(method, cmd, time.perf_counter_ns() - start)
         return True
     except Exception as e:
         logger.error(f"ACPI Call failed with error:\n{e}")
@@ -51,8 +207,11 @@ def call(method: str, args: Sequence[bytes | int], risky: bool = True):
 
 
 def read():
-    with open("/proc/acpi/call", "rb") as f:
-        d = f.read().decode().strip()
+    if _backend:
+        d = _backend.read().strip()
+    else:
+        with open("/proc/acpi/call", "rb") as f:
+            d = f.read().decode().strip()
 
     if d == "not called\0":
         return None
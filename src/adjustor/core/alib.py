@@ -1,4 +1,6 @@
 from .acpi import call
+from .metrics import counter, gauge, histogram
+from .trace import tracer
 import logging
 from typing import NamedTuple, Literal
 
@@ -24,6 +26,12 @@ D = DeviceParams
 
 logger = logging.getLogger(__name__)
 
+ALIB_CALLS = counter("adjustor_alib_calls", "ALIB commands sent to the SMU.")
+ALIB_DURATION = histogram(
+    "adjustor_alib_duration_seconds", "Time spent executing ALIB commands.", "seconds"
+)
+SMU_VALUES = gauge("adjustor_smu_value", "Values last applied to the SMU through ALIB.")
+
 
 def alib(
     params: dict[str, int],
@@ -72,4 +80,10 @@ def alib(
 
     b_length = int.to_bytes(length, length=2, byteorder="little", signed=False)
     logger.info(info)
-    return call(r"\_SB.ALIB", [0x0C, b_length + data])
+    with ALIB_DURATION.time(), tracer.span("alib"):
+        ret = call(r"\_SB.ALIB", [0x0C, b_length + data])
+    ALIB_CALLS.inc(result="ok" if ret else "error")
+    if ret:
+        for name, val in params.items():
+            SMU_VALUES.set(val, param=name)
+    return ret
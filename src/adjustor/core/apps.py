@@ -0,0 +1,230 @@
+import fnmatch
+import logging
+import os
+import re
+from threading import Lock
+from typing import Any, Callable, NamedTuple, Sequence
+
+from .proc import ProcWatcher, list_pids, read_proc
+
+logger = logging.getLogger(__name__)
+
+# Shorthand profile keys and the config keys they set for each TDP driver.
+# A None value is replaced by the value of the shorthand.
+DRIVER_KEYS: dict[str, dict[str, list[tuple[str, Any]]]] = {
+    "smu": {
+        "tdp": [("tdp.qam.tdp", None)],
+        "boost": [("tdp.qam.boost", None)],
+        "fan": [("tdp.qam.fan.mode", None)],
+    },
+    "lenovo": {
+        "tdp": [("tdp.lenovo.tdp.mode", "custom"), ("tdp.lenovo.tdp.custom.tdp", None)],
+        "boost": [
+            ("tdp.lenovo.tdp.mode", "custom"),
+            ("tdp.lenovo.tdp.custom.boost", None),
+        ],
+        "fan": [("tdp.lenovo.fan.mode", None)],
+    },
+    "asus": {
+        "tdp": [("tdp.asus.tdp_v2.mode", "custom"), ("tdp.asus.tdp_v2.custom.tdp", None)],
+        "boost": [
+            ("tdp.asus.tdp_v2.mode", "custom"),
+            ("tdp.asus.tdp_v2.custom.boost", None),
+        ],
+        "fan": [("tdp.asus.fan.mode", None)],
+    },
+}
+ENERGY_KEYS: dict[str, list[tuple[str, Any]]] = {
+    "epp": [
+        ("tdp.amd_energy.mode.mode", "manual"),
+        ("tdp.amd_energy.mode.manual.cpu_pref", None),
+    ],
+    "sched": [
+        ("tdp.amd_energy.mode.mode", "manual"),
+        ("tdp.amd_energy.mode.manual.sched", None),
+    ],
+}
+# Fan curve prefix and the manual mode used when the profile sets no `fan` mode.
+# The curve is a mapping of temperature to speed (%), e.g., {40: 30, 70: 60}.
+FAN_CURVE_KEYS: dict[str, tuple[str, str]] = {
+    "smu": ("tdp.qam.fan", "manual_edge"),
+    "lenovo": ("tdp.lenovo.fan", "manual"),
+    "asus": ("tdp.asus.fan", "manual"),
+}
+MATCH_KEYS = ("name", "exe", "cmdline")
+
+
+class AppProfile(NamedTuple):
+    name: str
+    exe: str | None
+    cmdline: str | None
+    values: dict[str, Any]
+
+
+def _glob(pat: str | None):
+    return re.compile(fnmatch.translate(pat)) if pat else None
+
+
+def _any(pats: Sequence[str]):
+    if not pats:
+        return None
+    return re.compile("|".join(f"(?:{fnmatch.translate(p)})" for p in pats))
+
+
+def expand_profile(raw: dict[str, Any], driver: str | None) -> dict[str, Any]:
+    """Converts the shorthand keys of a profile to config keys. Keys under
+    `set` are used as is."""
+    out = {}
+    keys = {**DRIVER_KEYS.get(driver or "", {}), **ENERGY_KEYS}
+    for k, v in raw.items():
+        if k in MATCH_KEYS:
+            continue
+        elif k == "set":
+            out.update(v)
+        elif k == "gpu":
+            lo, hi = v
+            out["tdp.amd_energy.gpu_freq.mode"] = "range"
+            out["tdp.amd_energy.gpu_freq.range.min"] = int(lo)
+            out["tdp.amd_energy.gpu_freq.range.max"] = int(hi)
+        elif k == "fan_curve" and driver in FAN_CURVE_KEYS:
+            prefix, mode = FAN_CURVE_KEYS[driver]  # type: ignore
+            mode = str(raw.get("fan", mode))
+            out[f"{prefix}.mode"] = mode
+            for temp, speed in v.items():
+                out[f"{prefix}.{mode}.st{int(temp)}"] = int(speed)
+        elif k in keys:
+            for ck, cv in keys[k]:
+                out[ck] = v if cv is None else cv
+        else:
+            logger.warning(f"Unknown key '{k}' in app profile '{raw.get('name')}'.")
+    return out
+
+
+def load_profiles(fn: str, driver: str | None) -> list[AppProfile]:
+    import yaml
+
+    with open(fn, "r") as f:
+        raw = yaml.safe_load(f) or []
+
+    out = []
+    for i, p in enumerate(raw):
+        name = str(p.get("name", f"profile{i}"))
+        if not p.get("exe") and not p.get("cmdline"):
+            logger.error(f"App profile '{name}' has no 'exe' or 'cmdline', skipping.")
+            continue
+        out.append(
+            AppProfile(name, p.get("exe"), p.get("cmdline"), expand_profile(p, driver))
+        )
+    return out
+
+
+class AppMatcher:
+    """Matches processes against the profiles. Patterns are globs over the
+    executable path and the command line (arguments separated by spaces),
+    both must match if provided. All patterns are also combined into a single
+    regex per field, so processes that match no profile (nearly all of them)
+    are rejected with two regex calls."""
+
+    def __init__(self, profiles: Sequence[AppProfile]) -> None:
+        self.profiles = [(p, _glob(p.exe), _glob(p.cmdline)) for p in profiles]
+        self.any_exe = _any([p.exe for p in profiles if p.exe])
+        self.any_cmdline = _any([p.cmdline for p in profiles if p.cmdline])
+
+    def match(self, exe: str, cmdline: str) -> AppProfile | None:
+        if not (self.any_exe and self.any_exe.match(exe)) and not (
+            self.any_cmdline and self.any_cmdline.match(cmdline)
+        ):
+            return None
+        for p, exe_re, cmd_re in self.profiles:
+            if exe_re and not exe_re.match(exe):
+                continue
+            if cmd_re and not cmd_re.match(cmdline):
+                continue
+            return p
+        return None
+
+
+class AppTracker:
+    """Tracks the running processes that match a profile, using process
+    events. /proc is only scanned on start and when process events were
+    lost. The active profile is the one of the most recently started matching
+    process."""
+
+    def __init__(self, profiles: Sequence[AppProfile], wake: Callable[[], None]):
+        self.matcher = AppMatcher(profiles)
+        self.wake = wake
+        self.lock = Lock()
+        self.running: dict[int, AppProfile] = {}
+        self.watcher = ProcWatcher(self._on_exec, self._on_exit, self._resync)
+
+    def _match(self, pid: int):
+        info = read_proc(pid)
+        if not info:
+            return None
+        return self.matcher.match(*info)
+
+    def _on_exec(self, pid: int):
+        prof = self._match(pid)
+        with self.lock:
+            # Processes can exec into something else
+            old = self.running.pop(pid, None)
+            if prof:
+                self.running[pid] = prof
+        if prof or old:
+            self.wake()
+
+    def _on_exit(self, pid: int):
+        with self.lock:
+            old = self.running.pop(pid, None)
+        if old:
+            self.wake()
+
+    def _resync(self):
+        found = {}
+        for pid in list_pids():
+            prof = self._match(pid)
+            if prof:
+                found[pid] = prof
+        with self.lock:
+            old = self.running
+            # Keep the start order of the processes that still match, the rest
+            # started while events were lost
+            self.running = {
+                pid: prof for pid, prof in old.items() if found.get(pid) is prof
+            }
+            for pid, prof in found.items():
+                if pid not in self.running:
+                    self.running[pid] = prof
+            changed = list(old.items()) != list(self.running.items())
+        if changed:
+            self.wake()
+
+    def active(self) -> AppProfile | None:
+        with self.lock:
+            if not self.running:
+                return None
+            return next(reversed(self.running.values()))
+
+    def start(self):
+        # Subscribe first so processes started during the scan are not missed
+        self.watcher.start()
+        found = {}
+        for pid in list_pids():
+            prof = self._match(pid)
+            if prof:
+                found[pid] = prof
+        if found:
+            with self.lock:
+                # Drop the processes that exited during the scan
+                found = {
+                    pid: prof
+                    for pid, prof in found.items()
+                    if os.path.exists(f"/proc/{pid}")
+                }
+                self.running = {**found, **self.running}
+            self.wake()
+
+    def close(self):
+        self.watcher.close()
+        with self.lock:
+            self.running = {}
@@ -0,0 +1,327 @@
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from threading import Event, Thread
+from typing import NamedTuple
+
+from .alib import DeviceParams, alib
+from .detect import find_device, get_cpu_model, get_product_name
+from .fan.utils import HWMON_DIR, find_tctl_temp, get_hwmon, read_temp
+from .platform import get_platform_choices, get_platform_profile, set_platform_profile
+from .power import PowerSampler, find_power_source
+
+logger = logging.getLogger(__name__)
+
+CHUNK = 1 << 16
+SAMPLE_RATE = 4
+SETTLE = 10
+DURATION = 30
+
+
+class BenchPoint(NamedTuple):
+    tdp: int
+    profile: str | None
+    # MiB/s hashed
+    throughput: float
+    # Watts
+    power: float | None
+    power_p95: float | None
+    # MiB per joule
+    efficiency: float | None
+    tctl: float | None
+    tctl_max: float | None
+    fan_rpm: float | None
+
+
+class Workload:
+    """Hashes a buffer with SHA-256 on a number of threads. hashlib releases
+    the GIL for large buffers, so threads run in parallel."""
+
+    def __init__(self, threads: int) -> None:
+        self.threads = threads
+        self.buf = os.urandom(CHUNK)
+        self.counts = [0] * threads
+        self.should_exit = Event()
+        self.ts = []
+
+    def _run(self, idx: int):
+        h = hashlib.sha256()
+        while not self.should_exit.is_set():
+            h.update(self.buf)
+            self.counts[idx] += 1
+
+    def start(self):
+        self.should_exit.clear()
+        self.ts = [Thread(target=self._run, args=(i,)) for i in range(self.threads)]
+        for t in self.ts:
+            t.start()
+
+    def done(self):
+        """Returns the MiB hashed since start."""
+        return sum(self.counts) * CHUNK / (1 << 20)
+
+    def reset(self):
+        self.counts = [0] * self.threads
+
+    def stop(self):
+        self.should_exit.set()
+        for t in self.ts:
+            t.join()
+        self.ts = []
+
+
+def find_fan_inputs():
+    out = []
+    for hwmon in get_hwmon():
+        for fn in os.listdir(f"{HWMON_DIR}/{hwmon}"):
+            if fn.startswith("fan") and fn.endswith("_input"):
+                out.append(f"{HWMON_DIR}/{hwmon}/{fn}")
+    return out
+
+
+def get_limits(tdp: int, dev: dict[str, DeviceParams], boost: bool):
+    from adjustor.drivers.smu import SmuQamPlugin
+
+    # Same limits as the QAM slider
+    preset = SmuQamPlugin(dev, None, None).get_preset(tdp)
+    slow, fast = preset.boost if boost and preset.boost else preset.no_boost
+    vals = {
+        "skin_limit": tdp,
+        "stapm_limit": tdp,
+        "slow_limit": slow,
+        "fast_limit": fast,
+    }
+    return {k: v for k, v in vals.items() if k in dev}
+
+
+def run_point(
+    tdp: int,
+    profile: str | None,
+    work: Workload,
+    sampler: PowerSampler | None,
+    tctl_fn: str | None,
+    fan_fns: list[str],
+    settle: float,
+    duration: float,
+):
+    time.sleep(settle)
+
+    temps = []
+    rpms = []
+    work.reset()
+    start = time.perf_counter()
+    while (curr := time.perf_counter()) - start < duration:
+        if tctl_fn:
+            temps.append(read_temp(tctl_fn))
+        rpm = []
+        for fn in fan_fns:
+            try:
+                with open(fn) as f:
+                    rpm.append(int(f.read()))
+            except Exception:
+                pass
+        if rpm:
+            rpms.append(sum(rpm) / len(rpm))
+        time.sleep(min(1, max(duration - (curr - start), 0)))
+    throughput = work.done() / (time.perf_counter() - start)
+
+    stats = sampler.stats() if sampler else None
+    power = stats["mean"] if stats else None
+    return BenchPoint(
+        tdp=tdp,
+        profile=profile,
+        throughput=throughput,
+        power=power,
+        power_p95=stats["p95"] if stats else None,
+        efficiency=throughput / power if power else None,
+        tctl=sum(temps) / len(temps) if temps else None,
+        tctl_max=max(temps) if temps else None,
+        fan_rpm=sum(rpms) / len(rpms) if rpms else None,
+    )
+
+
+def run_bench(
+    dev: dict[str, DeviceParams],
+    cpu,
+    tdps: list[int],
+    profiles: list[str | None],
+    threads: int,
+    settle: float = SETTLE,
+    duration: float = DURATION,
+    boost: bool = False,
+):
+    """Applies each TDP point through ALIB, as the SMU driver does, and
+    measures a CPU-bound workload under it. Handheld Daemon should be stopped,
+    as it would reapply its own limits."""
+    from adjustor.fuse.utils import find_igpu
+
+    source = find_power_source(find_igpu())
+    sampler = None
+    if source:
+        # Window covers the whole measurement
+        sampler = PowerSampler(source, SAMPLE_RATE, window=duration)
+        sampler.start()
+    else:
+        logger.error("No power sensor found, efficiency will not be measured.")
+
+    tctl_fn = find_tctl_temp()
+    fan_fns = find_fan_inputs()
+    old_pp = get_platform_profile() if any(profiles) else None
+
+    work = Workload(threads)
+    points = []
+    work.start()
+    try:
+        for profile in profiles:
+            if profile:
+                set_platform_profile(profile)
+            for tdp in tdps:
+                vals = get_limits(tdp, dev, boost)
+                if not alib(vals, cpu, limit="device", dev=dev):
+                    logger.error(f"Could not apply {tdp}W, skipping.")
+                    continue
+                p = run_point(
+                    tdp, profile, work, sampler, tctl_fn, fan_fns, settle, duration
+                )
+                logger.info(
+                    f"{tdp:2d}W {profile or '':>12s}: {p.throughput:8.1f}MiB/s"
+                    + (
+                        f", {p.power:5.1f}W, {p.efficiency:6.2f}MiB/J"
+                        if p.power and p.efficiency
+                        else ""
+                    )
+                    + (f", Tctl {p.tctl:.1f}C" if p.tctl else "")
+                    + (f", fan {p.fan_rpm:.0f}rpm" if p.fan_rpm else "")
+                )
+                points.append(p)
+    finally:
+        work.stop()
+        if sampler:
+            sampler.close()
+        if old_pp:
+            set_platform_profile(old_pp)
+        # Return to the default TDP of the device
+        default = dev.get("skin_limit", dev.get("stapm_limit", None))
+        if default and default.default:
+            alib(get_limits(default.default, dev, False), cpu, limit="device", dev=dev)
+    return points
+
+
+def best_profiles(points: list[BenchPoint]):
+    """Returns the most efficient platform profile for each TDP."""
+    best = {}
+    for p in points:
+        if p.efficiency is None:
+            continue
+        curr = best.get(p.tdp, None)
+        if curr is None or p.efficiency > curr.efficiency:
+            best[p.tdp] = p
+    return {tdp: p.profile for tdp, p in sorted(best.items())}
+
+
+def write_results(points: list[BenchPoint], fn: str, meta: dict):
+    out = {**meta, "points": [p._asdict() for p in points]}
+    out["best_profile"] = best_profiles(points)
+
+    if fn.endswith(".csv"):
+        with open(fn, "w", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(BenchPoint._fields)
+            for p in points:
+                w.writerow(p)
+        # The rest goes to a sidecar, to keep the CSV a plain table
+        del out["points"]
+        fn = fn[: -len(".csv")] + ".json"
+
+    with open(fn, "w") as f:
+        json.dump(out, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m adjustor.core.bench",
+        description="Measures work per joule across the TDP range of the device.",
+    )
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--min", type=int, help="Lowest TDP (default: device min).")
+    parser.add_argument("--max", type=int, help="Highest TDP (default: device max).")
+    parser.add_argument("--step", type=int, default=1)
+    parser.add_argument(
+        "--settle", type=float, default=SETTLE, help="Seconds before measuring."
+    )
+    parser.add_argument(
+        "--duration", type=float, default=DURATION, help="Seconds per point."
+    )
+    parser.add_argument(
+        "--profiles",
+        default=None,
+        help="Comma separated platform profiles to sweep, or 'all'.",
+    )
+    parser.add_argument("--boost", action="store_true")
+    parser.add_argument(
+        "-o", "--output", default="bench.json", help="Output file (.json or .csv)."
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    match = find_device()
+    if not match:
+        sys.exit(1)
+    dev, cpu = match
+
+    lims = dev.get("skin_limit", dev.get("stapm_limit", None))
+    lo = args.min if args.min is not None else (lims.smin if lims else None)
+    hi = args.max if args.max is not None else (lims.smax if lims else None)
+    if lo is None or hi is None:
+        logger.error("Device has no TDP range, provide --min and --max.")
+        sys.exit(1)
+
+    profiles: list[str | None] = [None]
+    if args.profiles:
+        choices = get_platform_choices() or []
+        if args.profiles == "all":
+            profiles = list(choices)
+        else:
+            profiles = [p for p in args.profiles.split(",") if p in choices]
+        if not profiles:
+            logger.error(f"No valid platform profiles, choices: {choices}")
+            sys.exit(1)
+
+    from .acpi import check_perms, initialize
+
+    initialize()
+    if not check_perms():
+        sys.exit(1)
+
+    points = run_bench(
+        dev,
+        cpu,
+        list(range(lo, hi + 1, args.step)),
+        profiles,
+        args.threads,
+        args.settle,
+        args.duration,
+        args.boost,
+    )
+    write_results(
+        points,
+        args.output,
+        {
+            "device": get_product_name(),
+            "cpu": get_cpu_model(),
+            "threads": args.threads,
+            "duration": args.duration,
+            "boost": args.boost,
+        },
+    )
+    logger.info(f"Wrote {len(points)} points to '{args.output}'.")
+
+
+if __name__ == "__main__":
+    main()
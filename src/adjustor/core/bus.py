@@ -0,0 +1,47 @@
+import logging
+from threading import Lock, Thread
+
+logger = logging.getLogger(__name__)
+
+_lock = Lock()
+_loop = None
+_thread = None
+_buses = {}
+
+
+def _run_loop(loop):
+    try:
+        loop.run()
+    except Exception as e:
+        logger.error(f"D-Bus loop exited with error:\n{e}")
+
+
+def get_bus(session: bool = False):
+    """Returns a private D-Bus connection that is serviced by a shared GLib
+    loop thread. Signal handlers registered on it run on that thread, so they
+    should only store state for the plugins to pick up during update().
+
+    The session bus is used for testing against a local stand-in."""
+    global _loop, _thread
+
+    import dbus
+    import dbus.mainloop.glib
+    from gi.repository import GLib
+
+    with _lock:
+        if session in _buses:
+            return _buses[session]
+
+        if not _loop:
+            dbus.mainloop.glib.threads_init()
+            _loop = GLib.MainLoop()
+            _thread = Thread(target=_run_loop, args=(_loop,), daemon=True)
+            _thread.start()
+
+        ml = dbus.mainloop.glib.DBusGMainLoop()
+        if session:
+            bus = dbus.SessionBus(mainloop=ml, private=True)
+        else:
+            bus = dbus.SystemBus(mainloop=ml, private=True)
+        _buses[session] = bus
+        return bus
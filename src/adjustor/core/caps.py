@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import shutil
+from threading import Lock
+from typing import Any, Callable, Sequence
+
+logger = logging.getLogger(__name__)
+
+CACHE_FN = "/var/cache/adjustor/caps.json"
+CACHE_VERSION = 2
+DMI_PATH = "/sys/class/dmi/id"
+CMDLINE_FN = "/proc/cmdline"
+# Boost, EPP and the nonlinear frequency depend on the amd_pstate mode
+AMD_PSTATE_FN = "/sys/devices/system/cpu/amd_pstate/status"
+# Platform profile choices depend on the driver that bound (e.g., asus-wmi
+# or amd_pmf)
+PLATFORM_PROFILE_DIR = "/sys/class/platform-profile"
+PLATFORM_PROFILE_MODULES = ("amd_pmf", "asus_wmi", "ideapad_laptop", "hp_wmi")
+DMI_IDS = (
+    "sys_vendor",
+    "product_name",
+    "product_version",
+    "board_vendor",
+    "board_name",
+    "bios_version",
+    "bios_date",
+)
+
+_lock = Lock()
+_caps = None
+
+
+def _read(fn: str):
+    try:
+        with open(fn) as f:
+            return f.read().strip()
+    except Exception:
+        return ""
+
+
+def get_platform_profile_drivers():
+    try:
+        return sorted(
+            _read(os.path.join(PLATFORM_PROFILE_DIR, d, "name"))
+            for d in os.listdir(PLATFORM_PROFILE_DIR)
+        )
+    except Exception:
+        # Older kernels have no class, use the loaded modules
+        return [
+            m for m in PLATFORM_PROFILE_MODULES if os.path.isdir(f"/sys/module/{m}")
+        ]
+
+
+def get_cache_key():
+    key: dict[str, Any] = {"kernel": os.uname().release}
+    for name in DMI_IDS:
+        key[name] = _read(os.path.join(DMI_PATH, name))
+    key["cmdline"] = _read(CMDLINE_FN)
+    key["amd_pstate"] = _read(AMD_PSTATE_FN)
+    key["platform_profile"] = get_platform_profile_drivers()
+    return key
+
+
+def _stat_deps(deps: Sequence[str]):
+    out = {}
+    for fn in deps:
+        try:
+            out[fn] = os.stat(fn).st_mtime_ns
+        except Exception:
+            out[fn] = None
+    return out
+
+
+class CapabilityCache:
+    """Persists the results of hardware probes across boots. The cache is
+    keyed by kernel version and command line, BIOS version, DMI ids, the
+    amd_pstate mode and the platform profile drivers, and is discarded as a
+    whole if any of them changes. Entries may also depend on the modification
+    time of files or directories (e.g., the directories in PATH).
+
+    Probes that return None are not cached, so devices that appear late in
+    boot are picked up on the next call. Paths that change between boots,
+    such as hwmon numbering, should not be cached."""
+
+    def __init__(self, fn: str | None = None) -> None:
+        self.fn = fn or os.environ.get("HHD_ADJ_CACHE", CACHE_FN)
+        self.key = get_cache_key()
+        self.lock = Lock()
+        # Serializes writes of the cache file, without blocking lookups
+        self.save_lock = Lock()
+        self.entries: dict[str, Any] = self._load()
+        self.failed = False
+
+    def _load(self):
+        try:
+            with open(self.fn, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Could not load capability cache '{self.fn}':\n{e}")
+            return {}
+
+        if (
+            not isinstance(data, dict)
+            or data.get("version", None) != CACHE_VERSION
+            or data.get("key", None) != self.key
+            or not isinstance(data.get("entries", None), dict)
+        ):
+            logger.info("Hardware or kernel changed, discarding capability cache.")
+            return {}
+        return data["entries"]
+
+    def save(self):
+        with self.lock:
+            entries = dict(self.entries)
+        tmp = self.fn + ".tmp"
+        with self.save_lock:
+            try:
+                os.makedirs(os.path.dirname(self.fn), exist_ok=True)
+                with open(tmp, "w") as f:
+                    json.dump(
+                        {"version": CACHE_VERSION, "key": self.key, "entries": entries},
+                        f,
+                    )
+                os.replace(tmp, self.fn)
+            except Exception as e:
+                if not self.failed:
+                    logger.warning(
+                        f"Could not save capability cache '{self.fn}':\n{e}"
+                    )
+                    self.failed = True
+
+    def get(
+        self,
+        name: str,
+        probe: Callable[[], Any],
+        load: Callable[[Any], Any] | None = None,
+        deps: Sequence[str] = (),
+    ):
+        with self.lock:
+            ent = self.entries.get(name, None)
+            if (
+                isinstance(ent, dict)
+                and "value" in ent
+                and ent.get("deps", None) == _stat_deps(deps)
+            ):
+                try:
+                    return load(ent["value"]) if load else ent["value"]
+                except Exception as e:
+                    logger.warning(f"Invalid capability cache entry '{name}':\n{e}")
+
+        # Probes may be slow, so other lookups are not blocked while they run
+        stat = _stat_deps(deps)
+        val = probe()
+        with self.lock:
+            if val is None:
+                self.entries.pop(name, None)
+                return None
+            self.entries[name] = {"value": val, "deps": stat}
+        self.save()
+        return val
+
+    def which(self, names: Sequence[str]) -> dict[str, str]:
+        """Cached `shutil.which` for the provided executables. Revalidated when
+        a directory in PATH changes."""
+        path = [p for p in os.environ.get("PATH", os.defpath).split(os.pathsep) if p]
+        found = self.get(
+            "which:" + ",".join(sorted(names)),
+            lambda: {n: exe for n in names if (exe := shutil.which(n))},
+            deps=path,
+        )
+        return found or {}
+
+
+def get_caps():
+    global _caps
+    with _lock:
+        if not _caps:
+            _caps = CapabilityCache()
+        return _caps
@@ -0,0 +1,102 @@
+import logging
+
+from .const import CPU_DATA, DEV_DATA
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_FN = "/sys/devices/virtual/dmi/id/product_name"
+CPUINFO_FN = "/proc/cpuinfo"
+
+# Time adjustor modules may spend importing on their own (hhd and other
+# dependencies excluded), as hhd imports the entrypoint during boot
+IMPORT_BUDGET = 0.05
+
+
+def get_product_name():
+    try:
+        with open(PRODUCT_FN) as f:
+            return f.read().strip()
+    except Exception as e:
+        logger.error(f"Could not read product name:\n{e}")
+        return ""
+
+
+def get_cpu_model():
+    """Returns the first `model name` of cpuinfo. The kernel generates the file
+    on the fly, so stopping at the first processor skips the rest of it."""
+    try:
+        with open(CPUINFO_FN) as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except Exception as e:
+        logger.error(f"Could not read cpu model:\n{e}")
+    return ""
+
+
+def find_cpu(model: str):
+    """Looks up the CPU in `CPU_DATA` by the longest word prefix of its model
+    name (e.g., 'AMD Ryzen Z1 Extreme' over 'AMD Ryzen Z1')."""
+    words = model.split()
+    for i in range(len(words), 0, -1):
+        name = " ".join(words[:i])
+        if name in CPU_DATA:
+            return name, CPU_DATA[name]
+    return None
+
+
+def find_device():
+    """Returns the device and CPU limits of this device, by product name or
+    by CPU, as autodetect does."""
+    prod = get_product_name()
+    if prod in DEV_DATA:
+        dev, cpu, _ = DEV_DATA[prod]
+        return dev, cpu
+    model = get_cpu_model()
+    if match := find_cpu(model):
+        return match[1]
+    logger.error(f"Device '{prod}' with CPU '{model}' is not supported.")
+    return None
+
+
+def check_import_time(module: str = "adjustor.hhd", budget: float = IMPORT_BUDGET):
+    """Imports `module` in a new interpreter with `-X importtime`, and checks
+    that no driver module is imported and that adjustor modules take less than
+    `budget` seconds. Returns the import times of adjustor modules (seconds),
+    raises AssertionError on failure."""
+    import subprocess
+    import sys
+
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    assert res.returncode == 0, f"Could not import '{module}':\n{res.stderr}"
+
+    times = {}
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        name = fields[-1].strip()
+        if name.split(".")[0] == "adjustor" and fields[0].strip().isdigit():
+            times[name] = int(fields[0]) / 1e6
+
+    drivers = [m for m in times if m.startswith("adjustor.drivers")]
+    assert not drivers, f"Drivers imported by '{module}': {', '.join(drivers)}"
+    total = sum(times.values())
+    assert total < budget, (
+        f"Importing '{module}' took {total*1000:.1f}ms, over the "
+        f"{budget*1000:.0f}ms budget."
+    )
+    return times
+
+
+if __name__ == "__main__":
+    import sys
+
+    times = check_import_time(*sys.argv[1:2])
+    for name, t in sorted(times.items(), key=lambda x: -x[1])[:10]:
+        print(f"{t*1000:6.2f}ms {name}")
+    print(f"{sum(times.values())*1000:6.2f}ms total")
@@ -0,0 +1,358 @@
+import logging
+import os
+import random
+import time
+from threading import Lock
+
+from .lenovo import (
+    FAN_POINTS,
+    MIN_CURVE,
+    TDP_FEATURES,
+    FanTable,
+    LenovoState,
+    decode_fan_table,
+    encode_fan_table,
+    get_fan_curve,
+    set_fan_curve,
+)
+
+logger = logging.getLogger(__name__)
+
+NOT_CALLED = "not called\0"
+
+TDP_MODES = (0x01, 0x02, 0x03, 0xFF)
+STEADY_TDP = 0x0102FF00
+FAST_TDP = 0x0103FF00
+SLOW_TDP = 0x0101FF00
+CHARGE_LIMIT = 0x03010001
+FULL_FAN_SPEED = 0x04020000
+# Values the firmware uses in each preset (steady, fast, slow), approximate
+PRESETS = {
+    0x01: (8, 12, 10),
+    0x02: (15, 20, 17),
+    0x03: (20, 30, 25),
+}
+
+
+def _fmt_int(v: int):
+    return f"0x{v:x}\0"
+
+
+def _fmt_bytes(b: bytes):
+    return "{" + ", ".join(f"0x{v:02x}" for v in b) + "}\0"
+
+
+def parse_cmd(cmd: str):
+    """Splits an acpi_call command into its method and arguments."""
+    method, *raw = cmd.split()
+    args = []
+    for a in raw:
+        if a.startswith("b"):
+            args.append(bytes.fromhex(a[1:]))
+        else:
+            args.append(int(a, 0))
+    return method, args
+
+
+class LenovoEmulator:
+    """Emulates acpi_call on a Legion Go, to be installed with
+    `acpi.set_backend()`. Keeps the firmware state of the GZFD methods
+    (TDP mode, custom TDPs, fan curve per mode, power lights, charge limit)
+    and records ALIB commands.
+
+    Faults can be injected per call: `latency` (seconds, or per method),
+    `drop` (the write fails) and `not_called` (the write succeeds but there is
+    no return value)."""
+
+    def __init__(
+        self,
+        latency: float | dict[str, float] = 0,
+        jitter: float = 0,
+        drop: float = 0,
+        not_called: float = 0,
+        seed: int | None = None,
+    ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.drop = drop
+        self.not_called = not_called
+        self.rng = random.Random(seed)
+        self.lock = Lock()
+        self.result = NOT_CALLED
+
+        self.tdp_mode = 0x02
+        self.custom = {STEADY_TDP: 20, FAST_TDP: 30, SLOW_TDP: 25}
+        self.features = {CHARGE_LIMIT: 0, FULL_FAN_SPEED: 0}
+        self.fan_curves = {m: list(MIN_CURVE) for m in TDP_MODES}
+        self.power_light_v1 = 1
+        # Keyed by 0x04 (awake) and 0x24 (suspended)
+        self.power_light = {0x04: 0x02, 0x24: 0x03}
+        self.alib: dict[int, int] = {}
+        self.calls: dict[str, int] = {}
+        self.faults = 0
+
+    def get_feature(self, id: int):
+        if id in self.custom:
+            if self.tdp_mode == 0xFF:
+                return self.custom[id]
+            steady, fast, slow = PRESETS[self.tdp_mode]
+            return {STEADY_TDP: steady, FAST_TDP: fast, SLOW_TDP: slow}[id]
+        return self.features.get(id, None)
+
+    def press_mode_button(self):
+        """Cycles the TDP mode, as Legion L + Y does."""
+        with self.lock:
+            i = TDP_MODES.index(self.tdp_mode)
+            self.tdp_mode = TDP_MODES[(i + 1) % len(TDP_MODES)]
+            return self.tdp_mode
+
+    def _delay(self, method: str):
+        if isinstance(self.latency, dict):
+            base = self.latency.get(method, 0)
+        else:
+            base = self.latency
+        delay = base + (self.rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _wmaa(self, op: int, args: list):
+        match op:
+            case 0x2C:
+                if args[0] not in TDP_MODES:
+                    return _fmt_int(0)
+                self.tdp_mode = args[0]
+                return _fmt_int(0)
+            case 0x2D:
+                return _fmt_int(self.tdp_mode)
+        return None
+
+    def _wmab(self, op: int, args: list):
+        match op:
+            case 0x05:
+                curve = self.fan_curves[self.tdp_mode]
+                return _fmt_bytes(
+                    int.to_bytes(FAN_POINTS, 4, "little")
+                    + b"".join(int.to_bytes(v, 4, "little") for v in curve)
+                )
+            case 0x06:
+                table = decode_fan_table(args[0])
+                self.fan_curves[self.tdp_mode] = list(table.speeds)
+                return _fmt_int(0)
+        return None
+
+    def _wmae(self, op: int, args: list):
+        id = int.from_bytes(args[0][:4], "little")
+        match op:
+            case 0x11:
+                v = self.get_feature(id)
+                return _fmt_int(v) if v is not None else None
+            case 0x12:
+                v = int.from_bytes(args[0][4:8], "little")
+                if id in self.custom:
+                    self.custom[id] = v
+                elif id in self.features:
+                    self.features[id] = v
+                else:
+                    return None
+                return _fmt_int(0)
+        return None
+
+    def _wmaf(self, op: int, args: list):
+        match op:
+            case 0x01:
+                if args[0] == 0x03:
+                    return _fmt_bytes(bytes([self.power_light_v1, 0]))
+                if args[0] in self.power_light:
+                    return _fmt_bytes(bytes([0, self.power_light[args[0]]]))
+            case 0x02:
+                sel, a, b = args[0][:3]
+                if sel == 0x03:
+                    self.power_light_v1 = a
+                    return _fmt_int(0)
+                if sel in self.power_light:
+                    self.power_light[sel] = b
+                    return _fmt_int(0)
+        return None
+
+    def _alib(self, args: list):
+        if args[0] != 0x0C:
+            return None
+        buf = args[1]
+        length = int.from_bytes(buf[:2], "little")
+        for i in range(2, min(length, len(buf)), 5):
+            self.alib[buf[i]] = int.from_bytes(buf[i + 1 : i + 5], "little")
+        return _fmt_int(0)
+
+    def write(self, cmd: str):
+        method, args = parse_cmd(cmd)
+        self._delay(method)
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.result = NOT_CALLED
+            if self.drop and self.rng.random() < self.drop:
+                self.faults += 1
+                raise OSError(f"Emulated failure of '{method}'.")
+
+            name = method.split(".")[-1]
+            if name == "ALIB":
+                res = self._alib(args)
+            else:
+                handler = {
+                    "WMAA": self._wmaa,
+                    "WMAB": self._wmab,
+                    "WMAE": self._wmae,
+                    "WMAF": self._wmaf,
+                }.get(name, None)
+                if not handler:
+                    raise OSError(f"Method '{method}' not found.")
+                res = handler(args[1], args[2:])
+
+            if self.not_called and self.rng.random() < self.not_called:
+                self.faults += 1
+                res = None
+            self.result = res or NOT_CALLED
+
+    def read(self):
+        with self.lock:
+            # acpi_call clears the result once it is read
+            res = self.result
+            self.result = NOT_CALLED
+            return res
+
+
+def parse_spec(spec: str):
+    """Parses emulator options such as 'lenovo:latency=20,drop=0.05', where
+    latency and jitter are in milliseconds."""
+    name, _, opts = spec.partition(":")
+    kwargs = {}
+    for opt in filter(None, opts.split(",")):
+        k, _, v = opt.partition("=")
+        if k in ("latency", "jitter"):
+            kwargs[k] = float(v) / 1000
+        elif k in ("drop", "not_called"):
+            kwargs[k] = float(v)
+        elif k == "seed":
+            kwargs[k] = int(v)
+        else:
+            raise ValueError(f"Unknown emulator option '{k}'.")
+    return name, kwargs
+
+
+def install_from_env():
+    """Installs the emulator set in HHD_ADJ_EMULATE, if any. Returns its
+    name."""
+    spec = os.environ.get("HHD_ADJ_EMULATE", None)
+    if not spec:
+        return None
+
+    from .acpi import set_backend
+
+    name, kwargs = parse_spec(spec)
+    if name != "lenovo":
+        logger.error(f"Unknown ACPI emulator '{name}'.")
+        return None
+    set_backend(LenovoEmulator(**kwargs))
+    return name
+
+
+def stress(ops: int = 1000, seed: int = 0, **faults):
+    """Runs random writes through LenovoState, as the Lenovo plugin does, and
+    compares what it reports with the emulated firmware after each one."""
+    from .acpi import set_backend
+
+    emu = LenovoEmulator(seed=seed, **faults)
+    set_backend(emu)
+    rng = random.Random(seed)
+    state = LenovoState(power_light_v2=True)
+
+    failed = 0
+    diverged = 0
+    start = time.perf_counter()
+    try:
+        for _ in range(ops):
+            match rng.randrange(5):
+                case 0:
+                    key, val = "tdp_mode", rng.choice(
+                        ["quiet", "balanced", "performance", "custom"]
+                    )
+                case 1:
+                    key, val = "steady_tdp", rng.randint(5, 30)
+                case 2:
+                    key, val = "fan_curve", [
+                        min(100, v + rng.randrange(0, 20, 2)) for v in MIN_CURVE
+                    ]
+                case 3:
+                    key, val = "power_light", rng.random() < 0.5
+                case _:
+                    emu.press_mode_button()
+                    # The plugin gets an ACPI event for this
+                    state.on_event("tdp")
+                    key, val = "tdp_mode", None
+
+            if val is not None and not state.set(key, val):
+                failed += 1
+
+            truth = {
+                "tdp_mode": {0x01: "quiet", 0x02: "balanced", 0x03: "performance"}.get(
+                    emu.tdp_mode, "custom"
+                ),
+                "steady_tdp": emu.get_feature(STEADY_TDP),
+                "fan_curve": emu.fan_curves[emu.tdp_mode],
+                "power_light": emu.power_light[0x04] == 0x02,
+            }
+            for k in (key, *TDP_FEATURES):
+                if k in truth and state.get(k) != truth[k]:
+                    diverged += 1
+                    # Recover, as the plugin would on the next event
+                    state.invalidate(k)
+                    break
+    finally:
+        set_backend(None)
+
+    dur = time.perf_counter() - start
+    return {
+        "ops": ops,
+        "ops_per_sec": ops / dur if dur else None,
+        "calls": sum(emu.calls.values()),
+        "faults": emu.faults,
+        "failed": failed,
+        "diverged": diverged,
+    }
+
+
+def fuzz_fan_curve(rounds: int = 500, seed: int = 0):
+    """Writes random valid fan curves through WMAB, as the plugin does, and
+    checks that each one reads back unchanged. Raises AssertionError on the
+    first mismatch."""
+    from .acpi import set_backend
+
+    emu = LenovoEmulator(seed=seed)
+    set_backend(emu)
+    rng = random.Random(seed)
+    try:
+        for _ in range(rounds):
+            curve = sorted(rng.randint(0, 100) for _ in range(FAN_POINTS))
+            table = FanTable(tuple(curve))
+            buf = encode_fan_table(table)
+            # Speeds are u16 after the fan id, sensor id and u32 count
+            speeds = [
+                int.from_bytes(buf[6 + 2 * i : 8 + 2 * i], "little")
+                for i in range(FAN_POINTS)
+            ]
+            assert speeds == curve, f"Encoded {curve} as {buf.hex()}."
+            assert decode_fan_table(buf) == table, table
+            assert set_fan_curve(curve), curve
+            got = get_fan_curve()
+            assert got == curve, f"Wrote {curve}, read back {got}."
+    finally:
+        set_backend(None)
+    return rounds
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.WARNING)
+    _, kwargs = parse_spec(sys.argv[1] if len(sys.argv) > 1 else "lenovo")
+    print(f"Fan curve round trips: {fuzz_fan_curve()}")
+    print(stress(**kwargs))
@@ -21,9 +21,14 @@ from .utils import (
     read_temp,
     write_fan_speed,
 )
+from ..metrics import gauge
 
 logger = logging.getLogger(__name__)
 
+FAN_PWM = gauge("adjustor_fan_pwm", "Fan PWM value set by the fan curve.")
+FAN_RPM = gauge("adjustor_fan_rpm", "Measured fan speed.")
+TEMP = gauge("adjustor_temperature_celsius", "APU temperature.", "celsius")
+
 
 class FanInfo(TypedDict):
     tctl: str
@@ -158,6 +163,12 @@ def fan_worker(
                     state_tmp, info, fan_curve, junction.is_set()
                 )
                 state.update(state_tmp)
+
+            FAN_PWM.set(state_tmp["v_target_pwm"])
+            for i, rpm in enumerate(state_tmp["v_rpm"]):
+                FAN_RPM.set(rpm, fan=i)
+            TEMP.set(state_tmp["t_junction"], sensor="tctl")
+            TEMP.set(state_tmp["t_edge"], sensor="edge")
             time.sleep(SETPOINT_UPDATE_T if in_setpoint else UPDATE_T)
     except Exception as e:
         logger.error(f"Fan worker failed:\n{e}")
@@ -1,7 +1,8 @@
 from .acpi import call, read
-from typing import Sequence, Literal
+from typing import NamedTuple, Sequence, Literal
 
 import logging
+import struct
 
 logger = logging.getLogger(__name__)
 
@@ -10,8 +11,60 @@ MIN_CURVE = [44, 48, 55, 60, 71, 79, 87, 87, 100, 100]
 TdpMode = Literal["quiet", "balanced", "performance", "custom"]
 
 
+# WMAB fan table, as written with method 0x06:
+# fan id, sensor id, speed count, speeds, pad, temperature count, temperatures, pad
+FAN_TABLE = struct.Struct("<BBI10HxI10Hx")
+FAN_POINTS = 10
+FAN_TEMPS = (10, 20, 30, 40, 50, 60, 70, 80, 90, 100)
+
+
+class FanTable(NamedTuple):
+    speeds: tuple[int, ...]
+    temps: tuple[int, ...] = FAN_TEMPS
+    fan_id: int = 0
+    sensor_id: int = 0
+
+
+def encode_fan_table(table: FanTable) -> bytes:
+    if len(table.speeds) != FAN_POINTS or len(table.temps) != FAN_POINTS:
+        raise ValueError(
+            f"Fan table needs {FAN_POINTS} points, got {len(table.speeds)} speeds and {len(table.temps)} temperatures."
+        )
+    return FAN_TABLE.pack(
+        table.fan_id,
+        table.sensor_id,
+        FAN_POINTS,
+        *table.speeds,
+        FAN_POINTS,
+        *table.temps,
+    )
+
+
+def decode_fan_table(buf: bytes) -> FanTable:
+    vals = FAN_TABLE.unpack(buf)
+    fan_id, sensor_id, n_speeds = vals[:3]
+    speeds = vals[3 : 3 + FAN_POINTS]
+    n_temps = vals[3 + FAN_POINTS]
+    temps = vals[4 + FAN_POINTS :]
+    if n_speeds != FAN_POINTS or n_temps != FAN_POINTS:
+        raise ValueError(f"Invalid fan table counts: {n_speeds}, {n_temps}.")
+    return FanTable(tuple(speeds), tuple(temps), fan_id, sensor_id)
+
+
+def decode_fan_curve(buf: bytes) -> list[int] | None:
+    """Decodes the reply of WMAB method 0x05, which is a 32 bit point count
+    followed by a 32 bit value per point. The count is not checked, as the
+    plugin always writes 10 points."""
+    if len(buf) < 4 * (FAN_POINTS + 1):
+        return None
+    return [
+        int.from_bytes(buf[i : i + 4], byteorder="little")
+        for i in range(4, 4 * (FAN_POINTS + 1), 4)
+    ]
+
+
 def get_fan_curve():
-    logger.info("Retrieving fan curve.")
+    logger.debug("Retrieving fan curve.")
     o = call(r"\_SB.GZFD.WMAB", [0, 0x05, bytes([0, 0, 0, 0])], risky=False)
     if not o:
         return None
@@ -19,12 +72,11 @@ def get_fan_curve():
     if not isinstance(o, bytes):
         return None
 
-    return [o[i] for i in range(4, 44, 4)]
+    return decode_fan_curve(o)
 
 
 def set_fan_curve(arr: Sequence[int], lim: Sequence[int] | None = None):
-    logger.info(f"Setting fan curve to:\n{arr}")
-    if len(arr) != 10:
+    if len(arr) != FAN_POINTS:
         logger.error(f"Invalid fan curve length: {len(arr)}. Should be 10.")
         return False
     if any(not isinstance(d, int) for d in arr):
@@ -39,69 +91,23 @@ def set_fan_curve(arr: Sequence[int], lim: Sequence[int] | None = None):
                 )
                 return False
 
-    return call(
+    # Rewriting the same table makes the fan stutter
+    if get_fan_curve() == list(arr):
+        logger.info(f"Fan curve already set to:\n{arr}")
+        return True
+
+    logger.info(f"Setting fan curve to:\n{arr}")
+    if not call(
         r"\_SB.GZFD.WMAB",
-        [
-            0,
-            0x06,
-            bytes(
-                [
-                    0x00,
-                    0x00,
-                    0x0A,
-                    0x00,
-                    0x00,
-                    0x00,
-                    arr[0],
-                    0x00,
-                    arr[1],
-                    0x00,
-                    arr[2],
-                    0x00,
-                    arr[3],
-                    0x00,
-                    arr[4],
-                    0x00,
-                    arr[5],
-                    0x00,
-                    arr[6],
-                    0x00,
-                    arr[7],
-                    0x00,
-                    arr[8],
-                    0x00,
-                    arr[9],
-                    0x00,
-                    0x00,
-                    0x0A,
-                    0x00,
-                    0x00,
-                    0x00,
-                    0x0A,
-                    0x00,
-                    0x14,
-                    0x00,
-                    0x1E,
-                    0x00,
-                    0x28,
-                    0x00,
-                    0x32,
-                    0x00,
-                    0x3C,
-                    0x00,
-                    0x46,
-                    0x00,
-                    0x50,
-                    0x00,
-                    0x5A,
-                    0x00,
-                    0x64,
-                    0x00,
-                    0x00,
-                ]
-            ),
-        ],
-    )
+        [0, 0x06, encode_fan_table(FanTable(tuple(arr)))],
+    ):
+        return False
+
+    curr = get_fan_curve()
+    if curr is not None and curr != list(arr):
+        logger.error(f"Fan curve read back as:\n{curr}\nafter writing:\n{arr}")
+        return False
+    return True
 
 
 def set_power_light_v1(enabled: bool):
@@ -264,3 +270,92 @@ def get_full_fan_speed():
 def set_full_fan_speed(enable: bool):
     logger.info(f"Setting full fan mode to {enable}.")
     return set_feature(0x04020000, int(enable))
+
+
+# Features that change when the TDP mode changes (e.g., through the power button)
+TDP_FEATURES = ("tdp_mode", "steady_tdp", "fast_tdp", "slow_tdp", "fan_curve")
+
+
+class LenovoState:
+    """Caches the WMI features of the Legion Go. Each read is an ACPI call that
+    takes milliseconds and holds the ACPI interpreter lock, so features are
+    served from memory and only stale ones are read, when they are accessed.
+    `refresh()` reads a set of features in one pass.
+
+    Writes through `set()` and the "tdp" ACPI event mark the affected features
+    stale. A successful TDP mode write also stores the written mode, so
+    switching modes does not read it back."""
+
+    def __init__(self, power_light_v2: bool = True) -> None:
+        self.getters = {
+            "tdp_mode": get_tdp_mode,
+            "steady_tdp": get_steady_tdp,
+            "fast_tdp": get_fast_tdp,
+            "slow_tdp": get_slow_tdp,
+            "charge_limit": get_charge_limit,
+            "full_fan_speed": get_full_fan_speed,
+            "fan_curve": get_fan_curve,
+        }
+        if power_light_v2:
+            self.getters["power_light"] = lambda: get_power_light(suspend=False)
+            self.getters["power_light_sleep"] = lambda: get_power_light(suspend=True)
+        else:
+            self.getters["power_light"] = get_power_light_v1
+
+        self.setters = {
+            "tdp_mode": set_tdp_mode,
+            "steady_tdp": set_steady_tdp,
+            "fast_tdp": set_fast_tdp,
+            "slow_tdp": set_slow_tdp,
+            "charge_limit": set_charge_limit,
+            "full_fan_speed": set_full_fan_speed,
+            "fan_curve": set_fan_curve,
+        }
+        if power_light_v2:
+            self.setters["power_light"] = lambda v: set_power_light(v, suspend=False)
+            self.setters["power_light_sleep"] = lambda v: set_power_light(
+                v, suspend=True
+            )
+        else:
+            self.setters["power_light"] = set_power_light_v1
+
+        self.values = {}
+        self.stale = set(self.getters)
+
+    def refresh(self, keys: Sequence[str] | None = None):
+        """Reads the provided features, or all of them, in one pass."""
+        keys = list(keys) if keys is not None else list(self.getters)
+        for k in keys:
+            try:
+                self.values[k] = self.getters[k]()
+            except Exception as e:
+                logger.error(f"Failed to read Lenovo feature '{k}':\n{e}")
+                self.values[k] = None
+            self.stale.discard(k)
+
+    def get(self, key: str):
+        if key in self.stale:
+            # Other stale features are read when they are needed, as a mode
+            # switch marks the TDPs and fan curve stale but few are read back
+            self.refresh([key])
+        return self.values.get(key, None)
+
+    def set(self, key: str, *args):
+        ret = self.setters[key](*args)
+        if key == "tdp_mode":
+            # The firmware switches the TDPs and the fan curve with the mode
+            self.invalidate(*TDP_FEATURES)
+            if ret:
+                self.values[key] = args[0]
+                self.stale.discard(key)
+        else:
+            self.invalidate(key)
+        return ret
+
+    def invalidate(self, *keys: str):
+        """Marks the provided features, or all of them, as stale."""
+        self.stale.update(keys or self.getters)
+
+    def on_event(self, event: str | None):
+        if event == "tdp":
+            self.invalidate(*TDP_FEATURES)
@@ -0,0 +1,291 @@
+import logging
+import os
+import socket
+import time
+from bisect import bisect_left
+from threading import Lock, Thread
+from typing import Sequence
+
+logger = logging.getLogger(__name__)
+
+METRICS_SOCKET = "/run/hhd-tdp/metrics.sock"
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _labels(labels: dict[str, str | int | float]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(v: str):
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(labels: Labels, extra: Labels = ()):
+    labels = labels + extra
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _fmt_val(v: float):
+    if v == float("inf"):
+        return "+Inf"
+    if isinstance(v, int) or v.is_integer():
+        return str(int(v))
+    return repr(v)
+
+
+class Metric:
+    type = "unknown"
+
+    def __init__(self, name: str, help: str, unit: str | None = None) -> None:
+        self.name = name
+        self.help = help
+        self.unit = unit
+        self.lock = Lock()
+        self.values = {}
+
+    def render(self) -> list[str]:
+        out = [f"# TYPE {self.name} {self.type}"]
+        if self.unit:
+            out.append(f"# UNIT {self.name} {self.unit}")
+        out.append(f"# HELP {self.name} {_escape(self.help)}")
+        with self.lock:
+            out.extend(self._samples())
+        return out
+
+    def _samples(self) -> list[str]:
+        return [
+            f"{self.name}{_fmt_labels(l)} {_fmt_val(v)}" for l, v in self.values.items()
+        ]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def _samples(self):
+        return [
+            f"{self.name}_total{_fmt_labels(l)} {_fmt_val(v)}"
+            for l, v in self.values.items()
+        ]
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[_labels(labels)] = value
+
+    def clear(self):
+        with self.lock:
+            self.values = {}
+
+
+class StateSet(Metric):
+    """For values that are strings (e.g., the platform profile). Every state
+    seen so far is exported, with the current one set to 1."""
+
+    type = "stateset"
+
+    def __init__(self, name: str, help: str) -> None:
+        super().__init__(name, help)
+        self.current = None
+
+    def set(self, state: str):
+        with self.lock:
+            self.values[state] = 1
+            self.current = state
+
+    def clear(self):
+        with self.lock:
+            self.current = None
+
+    def _samples(self):
+        return [
+            f"{self.name}{_fmt_labels(((self.name, s),))} {int(s == self.current)}"
+            for s in self.values
+        ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        unit: str | None = None,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, unit)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        with self.lock:
+            counts, total = self.values.get(key, (None, 0))
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+            counts[bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def _samples(self):
+        out = []
+        for l, (counts, total) in self.values.items():
+            acc = 0
+            for le, c in zip((*self.buckets, float("inf")), counts):
+                acc += c
+                out.append(
+                    f"{self.name}_bucket{_fmt_labels(l, (('le', _fmt_val(le)),))} {acc}"
+                )
+            out.append(f"{self.name}_sum{_fmt_labels(l)} {_fmt_val(total)}")
+            out.append(f"{self.name}_count{_fmt_labels(l)} {acc}")
+        return out
+
+
+class _Timer:
+    def __init__(self, hist: Histogram, labels) -> None:
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.hist.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.metrics: dict[str, Metric] = {}
+
+    def _get(self, cls, name: str, help: str, **kwargs):
+        with self.lock:
+            m = self.metrics.get(name, None)
+            if m is None:
+                m = cls(name, help, **kwargs)
+                self.metrics[name] = m
+            assert isinstance(m, cls), f"Metric '{name}' is not a {cls.__name__}."
+            return m
+
+    def counter(self, name: str, help: str, unit: str | None = None) -> Counter:
+        return self._get(Counter, name, help, unit=unit)
+
+    def gauge(self, name: str, help: str, unit: str | None = None) -> Gauge:
+        return self._get(Gauge, name, help, unit=unit)
+
+    def stateset(self, name: str, help: str) -> StateSet:
+        return self._get(StateSet, name, help)
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        unit: str | None = None,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._get(Histogram, name, help, unit=unit, buckets=buckets)
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for m in metrics:
+            lines.extend(m.render())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+stateset = REGISTRY.stateset
+histogram = REGISTRY.histogram
+
+
+class MetricsServer:
+    """Writes the metrics in OpenMetrics text format to every client that
+    connects to the unix socket at `path` and closes the connection.
+
+    The thread blocks in `accept()`; `close()` shuts the socket down to wake
+    it."""
+
+    def __init__(self, path: str = METRICS_SOCKET, registry: Registry = REGISTRY):
+        self.path = path
+        self.registry = registry
+        self.sock = None
+        self.t = None
+        self.closing = False
+
+    def start(self):
+        if self.t:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        self.sock.listen(4)
+        self.closing = False
+        logger.info(f"Serving metrics on socket:\n'{self.path}'")
+        self.t = Thread(target=self._run, daemon=True)
+        self.t.start()
+
+    def _run(self):
+        assert self.sock
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError as e:
+                if not self.closing:
+                    logger.error(f"Metrics server failed:\n{e}")
+                return
+            try:
+                conn.settimeout(1)
+                conn.sendall(self.registry.render().encode())
+            except Exception as e:
+                logger.warning(f"Failed to send metrics:\n{e}")
+            finally:
+                conn.close()
+
+    def close(self):
+        if not self.sock:
+            return
+        self.closing = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        if self.t:
+            self.t.join()
+            self.t = None
+        self.sock.close()
+        self.sock = None
+        try:
+            os.remove(self.path)
+        except Exception:
+            pass
+
+
+def start_metrics_server(path: str = METRICS_SOCKET):
+    server = MetricsServer(path)
+    try:
+        server.start()
+    except Exception as e:
+        logger.error(f"Could not start metrics server:\n{e}")
+        server.close()
+        return None
+    return server
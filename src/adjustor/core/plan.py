@@ -0,0 +1,435 @@
+import argparse
+import logging
+import os
+import sys
+import time
+from functools import partial
+from typing import Any, Callable, Literal, NamedTuple, Sequence
+
+from .alib import AlibParams, DeviceParams, Limit, alib
+from .metrics import counter
+from .platform import get_platform_profile, set_platform_profile
+from .trace import tracer
+
+logger = logging.getLogger(__name__)
+
+# Order in which state is applied. The platform profile goes first, as the
+# firmware may reset the TDP limits with it. The governor goes before EPP, as
+# EPP is only writable under powersave, and boost before the frequency range,
+# as the maximum frequency depends on it.
+ORDER = (
+    "platform_profile",
+    "tdp",
+    "fan_curve",
+    "governor",
+    "epp",
+    "boost",
+    "frequency_scaling",
+    "gpu",
+)
+# Keys that have to be written again when the key is written
+RESETS = {
+    "platform_profile": ("tdp",),
+    "boost": ("frequency_scaling",),
+}
+# Energy policies and the EPP, boost and nonlinear minimum frequency they use
+ENERGY_POLICIES = {
+    "power": ("power", False, False),
+    "balanced": ("balance_power", True, False),
+    "performance": ("balance_power", True, True),
+}
+
+# Estimated cost per write in seconds, ACPI calls use their measured median
+# once they have been called
+ACPI_COST = 0.005
+SYSFS_COST = 0.0002
+
+PLAN_STEPS = counter("adjustor_plan_steps", "Hardware writes planned.")
+PLAN_SKIPPED = counter(
+    "adjustor_plan_skipped", "Writes skipped, as the hardware had the value already."
+)
+
+
+class Step(NamedTuple):
+    key: str
+    kind: Literal["acpi", "sysfs"]
+    target: str
+    value: Any
+    writes: int
+    # Seconds
+    cost: float
+    apply: Callable[[], Any]
+
+
+def energy_values(policy: str):
+    """Returns the EPP, boost and frequency scaling of an energy policy."""
+    epp, boost, nonlinear = ENERGY_POLICIES.get(policy, ENERGY_POLICIES["power"])
+    return {"epp": epp, "boost": boost, "frequency_scaling": nonlinear}
+
+
+def _acpi_cost(method: str, calls: int = 1):
+    from .acpi import get_call_stats
+
+    stats = get_call_stats().get(method, None)
+    if stats and stats["p50"] is not None:
+        return calls * stats["p50"] / 1000
+    return calls * ACPI_COST
+
+
+def _scaling_target(nonlinear: bool):
+    from adjustor.fuse.gpu import (
+        CPU_FREQ_DRIVER_MAX_FN,
+        CPU_FREQ_DRIVER_MIN_FN,
+        CPU_FREQ_NONLINEAR_MIN_FN,
+        read_from_cpu0,
+    )
+
+    min_fn = CPU_FREQ_NONLINEAR_MIN_FN if nonlinear else CPU_FREQ_DRIVER_MIN_FN
+    return read_from_cpu0(min_fn), read_from_cpu0(CPU_FREQ_DRIVER_MAX_FN)
+
+
+def _read_gpu():
+    from adjustor.fuse.gpu import get_gpu_clock
+
+    clock = get_gpu_clock()
+    if not clock:
+        return None
+    level, freqs = clock
+    if level == "auto":
+        return "auto"
+    return freqs
+
+
+def _set_gpu(value):
+    from adjustor.fuse.gpu import set_gpu_auto, set_gpu_manual
+
+    if value == "auto":
+        return set_gpu_auto()
+    return set_gpu_manual(*value)
+
+
+def _set_pp(pp: str, delay: float):
+    ok = set_platform_profile(pp)
+    if delay:
+        time.sleep(delay)
+    return ok
+
+
+class Planner:
+    """Turns a desired hardware state into the ordered list of writes that
+    reaches it from the current state. Keys are the ones in `ORDER`:
+     - platform_profile: profile name
+     - tdp: ALIB values, e.g., {"stapm_limit": 15}
+     - fan_curve: Legion Go fan curve, 10 points
+     - governor, epp: cpufreq values
+     - boost, frequency_scaling: whether boost and the nonlinear minimum
+       frequency are used
+     - gpu: "auto" or a (min, max) clock range
+
+    The current state is read from the hardware for keys the caller does not
+    provide. Values that can not be read (e.g., ALIB) are always written."""
+
+    def __init__(
+        self,
+        cpu: dict[str, AlibParams] | None = None,
+        dev: dict[str, DeviceParams] | None = None,
+        limit: Limit = "device",
+        pp_delay: float = 0,
+    ) -> None:
+        self.cpu = cpu
+        self.dev = dev
+        self.limit: Limit = limit
+        self.pp_delay = pp_delay
+
+    def read(self, keys: Sequence[str]) -> dict[str, Any]:
+        from adjustor.fuse.gpu import (
+            EPP_FN,
+            GOVERNOR_FN,
+            get_cpu_boost,
+            get_frequency_scaling,
+            read_from_cpu0,
+        )
+
+        from .lenovo import get_fan_curve
+
+        readers: dict[str, Callable[[], Any]] = {
+            "platform_profile": get_platform_profile,
+            "fan_curve": get_fan_curve,
+            "governor": partial(read_from_cpu0, GOVERNOR_FN),
+            "epp": partial(read_from_cpu0, EPP_FN),
+            "boost": get_cpu_boost,
+            "frequency_scaling": get_frequency_scaling,
+            "gpu": _read_gpu,
+        }
+        out = {}
+        for k in keys:
+            if k not in readers:
+                continue
+            try:
+                out[k] = readers[k]()
+            except Exception as e:
+                logger.debug(f"Could not read '{k}' for planning:\n{e}")
+        return out
+
+    def _step(self, key: str, value: Any) -> Step:
+        from adjustor.fuse.gpu import (
+            CPU_BOOST_PATH,
+            CPU_FREQ_MAX_FN,
+            CPU_FREQ_MIN_FN,
+            EPP_FN,
+            GOVERNOR_FN,
+            GPU_FREQUENCY_PATH,
+            GPU_LEVEL_PATH,
+            set_cpu_boost,
+            set_epp_mode,
+            set_frequency_scaling,
+            set_per_cpu,
+            set_powersave_governor,
+        )
+
+        ncpu = os.cpu_count() or 1
+        match key:
+            case "platform_profile":
+                return Step(
+                    key,
+                    "sysfs",
+                    "/sys/firmware/acpi/platform_profile",
+                    value,
+                    1,
+                    SYSFS_COST + self.pp_delay,
+                    partial(_set_pp, value, self.pp_delay),
+                )
+            case "tdp":
+                assert self.cpu is not None, "Planning TDP requires the CPU spec."
+                return Step(
+                    key,
+                    "acpi",
+                    r"\_SB.ALIB",
+                    value,
+                    1,
+                    _acpi_cost(r"\_SB.ALIB"),
+                    partial(
+                        alib, value, self.cpu, limit=self.limit, dev=self.dev or {}
+                    ),
+                )
+            case "fan_curve":
+                from .lenovo import set_fan_curve
+
+                # Written and read back
+                return Step(
+                    key,
+                    "acpi",
+                    r"\_SB.GZFD.WMAB",
+                    value,
+                    1,
+                    _acpi_cost(r"\_SB.GZFD.WMAB", 3),
+                    partial(set_fan_curve, value),
+                )
+            case "governor":
+                return Step(
+                    key,
+                    "sysfs",
+                    GOVERNOR_FN,
+                    value,
+                    ncpu,
+                    ncpu * SYSFS_COST,
+                    (
+                        set_powersave_governor
+                        if value == "powersave"
+                        else partial(set_per_cpu, GOVERNOR_FN, value)
+                    ),
+                )
+            case "epp":
+                return Step(
+                    key,
+                    "sysfs",
+                    EPP_FN,
+                    value,
+                    ncpu,
+                    ncpu * SYSFS_COST,
+                    partial(set_epp_mode, value),
+                )
+            case "boost":
+                return Step(
+                    key,
+                    "sysfs",
+                    CPU_BOOST_PATH,
+                    value,
+                    1,
+                    SYSFS_COST,
+                    partial(set_cpu_boost, value),
+                )
+            case "frequency_scaling":
+                return Step(
+                    key,
+                    "sysfs",
+                    f"{CPU_FREQ_MIN_FN}, {CPU_FREQ_MAX_FN}",
+                    value,
+                    2 * ncpu,
+                    2 * ncpu * SYSFS_COST,
+                    partial(set_frequency_scaling, value),
+                )
+            case "gpu":
+                writes = 1 if value == "auto" else 4
+                return Step(
+                    key,
+                    "sysfs",
+                    (
+                        GPU_LEVEL_PATH
+                        if value == "auto"
+                        else f"{GPU_LEVEL_PATH}, {GPU_FREQUENCY_PATH}"
+                    ),
+                    value,
+                    writes,
+                    writes * SYSFS_COST,
+                    partial(_set_gpu, value),
+                )
+        raise KeyError(f"Unknown state key '{key}'.")
+
+    def _matches(self, key: str, want: Any, have: Any):
+        if have is None:
+            return False
+        if key == "frequency_scaling":
+            try:
+                return tuple(have) == _scaling_target(want)
+            except Exception:
+                return False
+        if key == "gpu" and want != "auto":
+            return tuple(have) == tuple(want)
+        return have == want
+
+    def plan(
+        self, desired: dict[str, Any], current: dict[str, Any] | None = None
+    ) -> list[Step]:
+        unknown = [k for k in desired if k not in ORDER]
+        if unknown:
+            raise KeyError(f"Unknown state keys: {unknown}")
+
+        current = dict(current or {})
+        missing = [k for k in desired if k not in current]
+        if missing:
+            current.update(self.read(missing))
+
+        todo = set()
+        for key in ORDER:
+            if key not in desired:
+                continue
+            if key not in todo and self._matches(key, desired[key], current.get(key)):
+                PLAN_SKIPPED.inc(key=key)
+                continue
+            todo.add(key)
+            # Written after this key, as ORDER has them later
+            todo.update(k for k in RESETS.get(key, ()) if k in desired)
+
+        steps = [self._step(k, desired[k]) for k in ORDER if k in todo]
+        for s in steps:
+            PLAN_STEPS.inc(key=s.key)
+        return steps
+
+
+def execute(steps: Sequence[Step]):
+    """Applies the steps in order, each in a trace span named after its key.
+    A failed step does not stop the rest, the keys that failed are
+    returned."""
+    failed = []
+    for s in steps:
+        try:
+            with tracer.span(s.key, target=s.target):
+                if s.apply() is False:
+                    failed.append(s.key)
+        except Exception as e:
+            logger.error(f"Failed applying '{s.key}':\n{e}")
+            failed.append(s.key)
+    return failed
+
+
+def format_plan(steps: Sequence[Step]):
+    if not steps:
+        return "Nothing to write, the hardware matches the desired state."
+    lines = [
+        f"{i:2d}. {s.kind:5s} {s.target} = {s.value} ({s.writes} write{'s' if s.writes != 1 else ''}, ~{s.cost*1000:.1f}ms)"
+        for i, s in enumerate(steps, 1)
+    ]
+    writes = sum(s.writes for s in steps)
+    cost = sum(s.cost for s in steps)
+    lines.append(f"Total: {len(steps)} steps, {writes} writes, ~{cost*1000:.1f}ms.")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m adjustor.core.plan",
+        description="Plans the hardware writes for a desired state and applies them.",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Only print the plan.")
+    parser.add_argument("--tdp", type=int, help="TDP in W, with the QAM limits.")
+    parser.add_argument("--boost", choices=("on", "off"), help="TDP boost.")
+    parser.add_argument("--platform-profile")
+    parser.add_argument(
+        "--energy",
+        choices=tuple(ENERGY_POLICIES),
+        help="Energy policy, sets EPP, CPU boost and frequency scaling.",
+    )
+    parser.add_argument("--epp")
+    parser.add_argument("--governor")
+    parser.add_argument("--cpu-boost", choices=("on", "off"))
+    parser.add_argument("--gpu", help="'auto', or a clock range as 'min,max'.")
+    parser.add_argument(
+        "--fan-curve", help="Legion Go fan curve, 10 comma separated speeds."
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if not args.dry_run else logging.WARNING)
+
+    desired: dict[str, Any] = {}
+    if args.platform_profile:
+        desired["platform_profile"] = args.platform_profile
+    if args.energy:
+        desired["governor"] = "powersave"
+        desired.update(energy_values(args.energy))
+    if args.governor:
+        desired["governor"] = args.governor
+    if args.epp:
+        desired["epp"] = args.epp
+    if args.cpu_boost:
+        desired["boost"] = args.cpu_boost == "on"
+    if args.gpu:
+        desired["gpu"] = (
+            "auto" if args.gpu == "auto" else tuple(int(v) for v in args.gpu.split(","))
+        )
+    if args.fan_curve:
+        desired["fan_curve"] = [int(v) for v in args.fan_curve.split(",")]
+
+    cpu = dev = None
+    if args.tdp is not None:
+        from .bench import get_limits
+        from .detect import find_device
+
+        match = find_device()
+        if not match:
+            sys.exit(1)
+        dev, cpu = match
+        desired["tdp"] = get_limits(args.tdp, dev, args.boost == "on")
+
+    if not desired:
+        parser.error("No state provided.")
+
+    steps = Planner(cpu, dev).plan(desired)
+    print(format_plan(steps))
+    if args.dry_run or not steps:
+        return
+
+    from .acpi import check_perms, initialize
+
+    if any(s.kind == "acpi" for s in steps):
+        initialize()
+        if not check_perms():
+            sys.exit(1)
+    failed = execute(steps)
+    if failed:
+        logger.error(f"Failed to apply: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
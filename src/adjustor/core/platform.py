@@ -1,7 +1,12 @@
 import logging
 
+from .metrics import counter, stateset
+
 logger = logging.getLogger(__name__)
 
+SYSFS_WRITES = counter("adjustor_sysfs_writes", "Writes to sysfs attributes.")
+PLATFORM_PROFILE = stateset("adjustor_platform_profile", "Applied platform profile.")
+
 
 def get_platform_choices():
     try:
@@ -19,6 +24,8 @@ def set_platform_profile(prof: str):
         logger.info(f"Setting platform profile to '{prof}'")
         with open("/sys/firmware/acpi/platform_profile", "w") as f:
             f.write(prof)
+        SYSFS_WRITES.inc(attr="platform_profile")
+        PLATFORM_PROFILE.set(prof)
         return True
     except Exception as e:
         logger.error(f"Could not set platform profile with error:\n{e}")
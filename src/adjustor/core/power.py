@@ -0,0 +1,296 @@
+import logging
+import math
+import os
+import time
+from collections import deque
+from threading import Event, Lock, Thread
+from typing import Callable, Literal, NamedTuple, Sequence
+
+from .metrics import gauge
+
+logger = logging.getLogger(__name__)
+
+POWER_FILES = ("power1_average", "power1_input")
+# Also used by AMD CPUs
+RAPL_PATH = "/sys/class/powercap/intel-rapl:0"
+RAPL_ENERGY = "energy_uj"
+RAPL_RANGE = "max_energy_range_uj"
+
+SAMPLE_RATE = 1
+WINDOW = 30
+# Sustained power above limit * (1 + TOLERANCE) + MARGIN is a divergence
+TOLERANCE = 0.15
+MARGIN = 2
+
+POWER = gauge("adjustor_power_watts", "Measured APU package power.", "watts")
+POWER_LIMIT = gauge("adjustor_power_limit_watts", "Applied sustained power limit.", "watts")
+POWER_DIVERGED = gauge(
+    "adjustor_power_diverged", "Whether measured power exceeds the applied limit."
+)
+
+Source = tuple[Literal["power", "energy"], str]
+
+
+def find_power_source(hwmon: str | None = None) -> Source | None:
+    if hwmon:
+        for fn in POWER_FILES:
+            path = os.path.join(hwmon, fn)
+            if os.path.exists(path):
+                return "power", path
+
+    path = os.path.join(RAPL_PATH, RAPL_ENERGY)
+    if os.path.exists(path):
+        return "energy", path
+    return None
+
+
+class PowerSampler:
+    """Samples APU package power on a thread, either from the amdgpu hwmon
+    power attribute or by differentiating the RAPL energy counter. Files are
+    kept open and read with pread, so a sample is a single syscall.
+
+    After `set_limit()`, the mean over a full window is compared against the
+    limit. Firmware may drop the limits (e.g., after suspend or plugging in
+    AC), so sustained power above the limit calls `on_diverge` once, until
+    the limit is set again."""
+
+    def __init__(
+        self,
+        source: Source,
+        rate: float = SAMPLE_RATE,
+        window: float = WINDOW,
+        tolerance: float = TOLERANCE,
+        on_diverge: Callable[[float, float], None] | None = None,
+    ) -> None:
+        self.kind, self.path = source
+        self.period = 1 / rate
+        self.size = max(1, int(window * rate))
+        self.tolerance = tolerance
+        self.on_diverge = on_diverge
+
+        self.lock = Lock()
+        self.samples: deque[float] = deque(maxlen=self.size)
+        self.limit: float | None = None
+        self.since_limit = 0
+        self.diverged = False
+
+        self.fd = None
+        self.energy_range = None
+        self.last_energy = None
+        self.should_exit = Event()
+        self.t = None
+
+    def _read_int(self):
+        assert self.fd is not None
+        return int(os.pread(self.fd, 32, 0))
+
+    def read(self) -> float | None:
+        """Returns the current power in watts. For energy counters, the first
+        read only primes the counter."""
+        if self.kind == "power":
+            # Microwatts
+            return self._read_int() / 1e6
+
+        curr = (time.perf_counter(), self._read_int())
+        last = self.last_energy
+        self.last_energy = curr
+        if not last or curr[0] <= last[0]:
+            return None
+        delta = curr[1] - last[1]
+        if delta < 0:
+            if not self.energy_range:
+                return None
+            # Counter wrapped around
+            delta += self.energy_range
+        return delta / 1e6 / (curr[0] - last[0])
+
+    def add(self, watts: float):
+        check = None
+        with self.lock:
+            self.samples.append(watts)
+            self.since_limit += 1
+            if self.limit and not self.diverged and self.since_limit >= self.size:
+                mean = sum(self.samples) / len(self.samples)
+                if mean > self.limit * (1 + self.tolerance) + MARGIN:
+                    self.diverged = True
+                    check = (mean, self.limit)
+        POWER.set(watts)
+
+        if check:
+            POWER_DIVERGED.set(1)
+            logger.warning(
+                f"Measured power {check[0]:.1f}W exceeds the applied limit of {check[1]:.1f}W."
+            )
+            if self.on_diverge:
+                self.on_diverge(*check)
+
+    def set_limit(self, watts: float | None):
+        with self.lock:
+            self.limit = watts
+            # Wait for a full window under the new limit
+            self.since_limit = 0
+            self.diverged = False
+        POWER_DIVERGED.set(0)
+        if watts:
+            POWER_LIMIT.set(watts)
+        else:
+            POWER_LIMIT.clear()
+
+    def stats(self):
+        with self.lock:
+            s = sorted(self.samples)
+        if not s:
+            return None
+        return {
+            "mean": sum(s) / len(s),
+            "p50": s[(len(s) - 1) // 2],
+            "p95": s[min(len(s) - 1, int(len(s) * 0.95))],
+            "max": s[-1],
+            "n": len(s),
+        }
+
+    def _run(self):
+        try:
+            while not self.should_exit.is_set():
+                watts = self.read()
+                if watts is not None:
+                    self.add(watts)
+                self.should_exit.wait(self.period)
+        except Exception as e:
+            logger.error(f"Power sampler failed:\n{e}")
+
+    def start(self):
+        if self.t:
+            return
+        self.fd = os.open(self.path, os.O_RDONLY)
+        if self.kind == "energy":
+            try:
+                with open(os.path.join(os.path.dirname(self.path), RAPL_RANGE)) as f:
+                    self.energy_range = int(f.read())
+            except Exception:
+                pass
+        logger.info(f"Sampling package power from:\n'{self.path}'")
+        self.should_exit.clear()
+        self.t = Thread(target=self._run, daemon=True)
+        self.t.start()
+
+    def close(self):
+        if self.t:
+            self.should_exit.set()
+            self.t.join()
+            self.t = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self.last_energy = None
+
+
+class PIGovernor:
+    """PI controller that picks the sustained power limit that makes measured
+    power track a target. Units honor the nominal limit differently, so the
+    limit settles wherever the unit actually draws the target. The integral
+    stops accumulating while the output is saturated."""
+
+    def __init__(
+        self, lo: float, hi: float, kp: float = 0.4, ki: float = 0.08
+    ) -> None:
+        self.lo = lo
+        self.hi = hi
+        self.kp = kp
+        self.ki = ki
+        self.integral = 0.0
+
+    def reset(self):
+        self.integral = 0.0
+
+    def set_bounds(self, lo: float, hi: float):
+        if (lo, hi) == (self.lo, self.hi):
+            return
+        self.lo = lo
+        self.hi = hi
+        # The integral was accumulated against the old bounds
+        self.reset()
+
+    def step(self, target: float, measured: float, dt: float):
+        err = target - measured
+        integral = self.integral + err * dt
+        out = target + self.kp * err + self.ki * integral
+        if self.lo <= out <= self.hi:
+            self.integral = integral
+        return min(max(out, self.lo), self.hi)
+
+
+class Plant(NamedTuple):
+    """Unit that draws `gain * limit + offset` watts in steady state and
+    approaches it with a first-order lag of `tau` seconds."""
+
+    gain: float
+    offset: float
+    tau: float = 3
+
+
+# Units that undershoot, track, and overshoot the nominal limit
+PLANTS = (Plant(0.8, 0.5), Plant(1, 0), Plant(1.1, 2.5, tau=6))
+
+
+def simulate(
+    plant: Plant,
+    targets: Sequence[tuple[int, float]],
+    gov: PIGovernor | None = None,
+    period: float = 5,
+    dt: float = 0.1,
+):
+    """Steps a PIGovernor (5-30W by default) against `plant`, holding each
+    target for the given number of periods. The governor sees the mean power
+    over each period, as it does with PowerSampler. Returns (target,
+    measured, limit) per period."""
+    gov = gov or PIGovernor(5, 30)
+    power = plant.offset
+    limit = gov.hi
+    alpha = 1 - math.exp(-dt / plant.tau)
+    n = int(round(period / dt))
+    out = []
+    for periods, target in targets:
+        for _ in range(periods):
+            acc = 0
+            for _ in range(n):
+                power += alpha * (plant.gain * limit + plant.offset - power)
+                acc += power
+            measured = acc / n
+            limit = gov.step(target, measured, period)
+            assert gov.lo <= limit <= gov.hi, f"Limit {limit} out of bounds."
+            out.append((target, measured, limit))
+    return out
+
+
+def check_governor(tolerance: float = 0.5):
+    """Checks that the governor settles on a reachable target for every
+    plant, and that holding an unreachable target does not wind up the
+    integral. Raises AssertionError on failure."""
+    for plant in PLANTS:
+        res = simulate(plant, [(30, 15)])
+        err = abs(res[-1][1] - 15)
+        assert err < tolerance, f"{plant}: settled {err:.2f}W off target."
+
+        # No plant draws 60W at 30W, so the output stays saturated
+        gov = PIGovernor(5, 30)
+        res = simulate(plant, [(30, 60)], gov)
+        assert all(l == gov.hi for _, _, l in res), plant
+        assert gov.integral == 0, f"{plant}: integral wound up to {gov.integral}."
+
+        res = simulate(plant, [(20, 12)], gov)
+        err = abs(res[-1][1] - 12)
+        assert err < tolerance, f"{plant}: settled {err:.2f}W off after saturation."
+    return len(PLANTS)
+
+
+if __name__ == "__main__":
+    print(f"Governor checks passed for {check_governor()} plants.")
+    for plant in PLANTS:
+        res = simulate(plant, [(10, 15), (10, 60), (10, 12)])
+        print(plant)
+        for i, (target, measured, limit) in enumerate(res):
+            print(
+                f"  {i:2d}: target {target:4.1f}W, "
+                f"measured {measured:5.2f}W @ {limit:4.1f}W"
+            )
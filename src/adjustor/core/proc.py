@@ -0,0 +1,164 @@
+import errno
+import logging
+import os
+import select
+import socket
+import struct
+from threading import Event, Thread
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+NETLINK_CONNECTOR = 11
+CN_IDX_PROC = 1
+CN_VAL_PROC = 1
+PROC_CN_MCAST_LISTEN = 1
+PROC_CN_MCAST_IGNORE = 2
+NLMSG_DONE = 3
+
+PROC_EVENT_EXEC = 0x00000002
+PROC_EVENT_EXIT = 0x80000000
+
+NLMSG_HDR = struct.Struct("=IHHII")
+CN_MSG = struct.Struct("=IIIIHH")
+# what, cpu, timestamp_ns
+PROC_EVENT = struct.Struct("=IIQ")
+# pid, tgid
+PROC_PIDS = struct.Struct("=ii")
+
+RECV_SIZE = 4096
+POLL_TIMEOUT = 0.5
+
+OnExec = Callable[[int], None]
+OnExit = Callable[[int], None]
+OnOverflow = Callable[[], None]
+
+
+def _cn_msg(op: int):
+    payload = struct.pack("=I", op)
+    cn = CN_MSG.pack(CN_IDX_PROC, CN_VAL_PROC, 0, 0, len(payload), 0) + payload
+    return NLMSG_HDR.pack(NLMSG_HDR.size + len(cn), NLMSG_DONE, 0, 0, os.getpid()) + cn
+
+
+def parse_proc_events(data: bytes):
+    """Yields (what, tgid) for the exec and exit events of a netlink datagram.
+    Only process leaders are reported, thread events are skipped."""
+    ofs = 0
+    while ofs + NLMSG_HDR.size <= len(data):
+        length, _, _, _, _ = NLMSG_HDR.unpack_from(data, ofs)
+        if length < NLMSG_HDR.size:
+            break
+        cn = ofs + NLMSG_HDR.size
+        ev = cn + CN_MSG.size
+        if ev + PROC_EVENT.size + PROC_PIDS.size <= ofs + length:
+            idx, val, _, _, _, _ = CN_MSG.unpack_from(data, cn)
+            what, _, _ = PROC_EVENT.unpack_from(data, ev)
+            if idx == CN_IDX_PROC and val == CN_VAL_PROC and what in (
+                PROC_EVENT_EXEC,
+                PROC_EVENT_EXIT,
+            ):
+                pid, tgid = PROC_PIDS.unpack_from(data, ev + PROC_EVENT.size)
+                if pid == tgid:
+                    yield what, tgid
+        # Messages are aligned to 4 bytes
+        ofs += (length + 3) & ~3
+
+
+def read_proc(pid: int) -> tuple[str, str] | None:
+    """Returns the executable path and the command line (space separated) of
+    a process, or None if it exited or is a kernel thread."""
+    try:
+        exe = os.readlink(f"/proc/{pid}/exe")
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            cmdline = f.read().rstrip(b"\0").replace(b"\0", b" ")
+        return exe, cmdline.decode(errors="replace")
+    except Exception:
+        return None
+
+
+def list_pids():
+    return [int(p) for p in os.listdir("/proc") if p.isdigit()]
+
+
+class ProcWatcher:
+    """Reports process starts and exits through the kernel proc connector, so
+    processes do not have to be found by polling /proc. Requires root
+    (CAP_NET_ADMIN).
+
+    `on_exec` is called with the pid of every process that calls exec and
+    `on_exit` with the pid of every process that exits, from the watcher
+    thread. If the socket overflows, events are lost and `on_overflow` is
+    called so the caller can rescan /proc."""
+
+    def __init__(
+        self,
+        on_exec: OnExec,
+        on_exit: OnExit,
+        on_overflow: OnOverflow | None = None,
+    ) -> None:
+        self.on_exec = on_exec
+        self.on_exit = on_exit
+        self.on_overflow = on_overflow
+        self.sock = None
+        self.should_exit = Event()
+        self.t = None
+
+    def _open(self):
+        sock = socket.socket(
+            socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_CONNECTOR
+        )
+        try:
+            sock.bind((0, CN_IDX_PROC))
+            sock.send(_cn_msg(PROC_CN_MCAST_LISTEN))
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def _run(self):
+        assert self.sock
+        try:
+            while not self.should_exit.is_set():
+                r, _, _ = select.select([self.sock], [], [], POLL_TIMEOUT)
+                if not r:
+                    continue
+                try:
+                    data = self.sock.recv(RECV_SIZE)
+                except BlockingIOError:
+                    continue
+                except OSError as e:
+                    # ENOBUFS, events were dropped under load
+                    logger.warning(f"Process events were lost:\n{e}")
+                    if e.errno == errno.ENOBUFS and self.on_overflow:
+                        self.on_overflow()
+                    continue
+
+                for what, pid in parse_proc_events(data):
+                    if what == PROC_EVENT_EXEC:
+                        self.on_exec(pid)
+                    else:
+                        self.on_exit(pid)
+        except Exception as e:
+            logger.error(f"Process watcher failed:\n{e}")
+
+    def start(self):
+        if self.t:
+            return
+        self.sock = self._open()
+        logger.info("Watching process events through the proc connector.")
+        self.should_exit.clear()
+        self.t = Thread(target=self._run, daemon=True)
+        self.t.start()
+
+    def close(self):
+        if self.t:
+            self.should_exit.set()
+            self.t.join()
+            self.t = None
+        if self.sock:
+            try:
+                self.sock.send(_cn_msg(PROC_CN_MCAST_IGNORE))
+            except Exception:
+                pass
+            self.sock.close()
+            self.sock = None
@@ -0,0 +1,193 @@
+import logging
+import time
+from threading import Lock
+from typing import Any, Callable, NamedTuple, Sequence
+
+from .metrics import counter, histogram
+from .schedule import Wake, get_scheduler
+
+logger = logging.getLogger(__name__)
+
+# Delays after the wakeup event at which the state is verified. The first
+# pass restores the state as soon as possible, the last one catches firmware
+# that resets values a few seconds after resume.
+RESUME_PASSES = (0.2, 4)
+
+RESUME_DURATION = histogram(
+    "adjustor_resume_duration_seconds",
+    "Time from the wakeup event until the applied state was restored.",
+    "seconds",
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8),
+)
+RESUME_REPLAYS = counter(
+    "adjustor_resume_replays", "Values replayed after resume, because they were lost."
+)
+
+Replay = Callable[[], bool | None]
+Read = Callable[[], Any]
+
+
+class Entry(NamedTuple):
+    value: Any
+    replay: Replay
+    read: Read | None
+    resets: Sequence[str]
+
+
+class Snapshot:
+    """Keeps the last applied hardware state of a plugin, so that it can be
+    restored after resume without re-running the whole apply path.
+
+    Each entry holds the applied value, a function that applies it again and
+    optionally a function that reads it back from the hardware. On resume,
+    entries whose value reads back differently are replayed. Entries that can
+    not be read back (e.g., ALIB) are replayed on every pass. Replaying an
+    entry also replays the entries in its `resets` (e.g., the platform profile
+    resets the fan curve on Asus). Each entry is replayed before the entries
+    in its `resets`, and in the order it was first recorded otherwise."""
+
+    def __init__(self, name: str, passes: Sequence[float] = RESUME_PASSES) -> None:
+        self.name = name
+        self.key = f"{name}_resume"
+        self.passes = passes
+        self.lock = Lock()
+        self.entries: dict[str, Entry] = {}
+        self.sched = get_scheduler()
+        self.wake = None
+        self.pending: list[float] = []
+        self.t_wake = None
+        self.timed = False
+
+    def record(
+        self,
+        key: str,
+        value: Any,
+        replay: Replay,
+        read: Read | None = None,
+        resets: Sequence[str] = (),
+    ):
+        with self.lock:
+            self.entries[key] = Entry(value, replay, read, resets)
+
+    def capture(self, key: str, replay: Replay, read: Read, resets: Sequence[str] = ()):
+        """Records the value the hardware reports right after it was applied."""
+        try:
+            value = read()
+        except Exception as e:
+            logger.warning(f"Could not read back '{key}' for resume:\n{e}")
+            self.forget(key)
+            return
+        self.record(key, value, replay, read, resets)
+
+    def forget(self, key: str):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+
+    def wakeup(self, wake: Wake | None):
+        self.wake = wake
+        self.t_wake = time.perf_counter()
+        self.timed = False
+        self.pending = list(self.passes)
+        self._next(0)
+
+    def _next(self, elapsed: float):
+        if self.pending:
+            self.sched.schedule(self.key, max(self.pending.pop(0) - elapsed, 0), self.wake)
+
+    def due(self):
+        """Returns whether a verification pass is due and queues the next one."""
+        if not self.sched.pop(self.key):
+            return False
+        if self.t_wake is not None:
+            self._next(time.perf_counter() - self.t_wake)
+        return True
+
+    def lost(self) -> list[str]:
+        with self.lock:
+            entries = list(self.entries.items())
+
+        out = []
+        for key, e in entries:
+            if e.read is None:
+                out.append(key)
+                continue
+            try:
+                if e.read() != e.value:
+                    out.append(key)
+            except Exception:
+                out.append(key)
+        return out
+
+    def _order(self, todo: set[str]):
+        """Orders the entries in `todo` so that each one comes before the
+        entries in its `resets`, keeping the recording order otherwise."""
+        rank = {k: i for i, k in enumerate(self.entries)}
+        before: dict[str, list[str]] = {}
+        for k in todo:
+            for r in self.entries[k].resets:
+                before.setdefault(r, []).append(k)
+
+        out = []
+        seen = set()
+
+        def visit(k: str):
+            if k in seen:
+                return
+            seen.add(k)
+            for b in sorted(before.get(k, ()), key=rank.__getitem__):
+                visit(b)
+            out.append((k, self.entries[k]))
+
+        for k in self.entries:
+            if k in todo:
+                visit(k)
+        return out
+
+    def replay(self, keys: Sequence[str]):
+        with self.lock:
+            todo = set()
+            stack = list(keys)
+            while stack:
+                k = stack.pop()
+                if k in todo or k not in self.entries:
+                    continue
+                todo.add(k)
+                stack.extend(self.entries[k].resets)
+            entries = self._order(todo)
+
+        ok = True
+        for key, e in entries:
+            try:
+                ok &= e.replay() is not False
+            except Exception as ex:
+                logger.error(f"Failed replaying '{key}' after resume:\n{ex}")
+                ok = False
+            RESUME_REPLAYS.inc(plugin=self.name, key=key)
+
+        if self.t_wake is not None and not self.timed:
+            # Only the first pass counts towards the resume time
+            dur = time.perf_counter() - self.t_wake
+            self.timed = True
+            RESUME_DURATION.observe(dur, plugin=self.name)
+            logger.info(
+                f"Restored {len(entries)} values ({', '.join(k for k, _ in entries)}) {dur*1000:.0f}ms after wakeup."
+            )
+        else:
+            reset = [k for k, e in entries if e.read is not None]
+            if reset:
+                logger.warning(
+                    f"Firmware reset {', '.join(reset)} after resume, replayed."
+                )
+        return ok
+
+    def restore(self):
+        return self.replay(self.lost())
+
+    def close(self):
+        self.sched.cancel(self.key)
+        self.pending = []
+        self.t_wake = None
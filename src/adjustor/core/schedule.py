@@ -0,0 +1,141 @@
+import heapq
+import logging
+import time
+from threading import Condition, Lock, Thread
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+Wake = Callable[[], None]
+
+# Event name used only to wake hhd. It is namespaced so that it can not
+# collide with the names of real ACPI events (see events.EVENT_MATCHES).
+WAKE_EVENT = "adjustor_wake"
+
+_lock = Lock()
+_scheduler = None
+
+
+class Scheduler:
+    """Deadline scheduler for the debounced applies of the plugins.
+
+    Plugins schedule a key with a delay instead of storing a timestamp and
+    comparing it on every update(). Rescheduling a key replaces its deadline.
+    A single thread sleeps until the earliest deadline, marks the key as due
+    and wakes hhd, so update() runs when something is actually due. Plugins
+    then consume due keys with pop().
+
+    The scheduler is shared by all plugins, so it is never closed by one of
+    them. Plugins cancel their own keys on close instead, and the thread exits
+    once no deadlines are left."""
+
+    def __init__(self) -> None:
+        self.cond = Condition()
+        self.heap: list[tuple[float, int, str]] = []
+        self.deadlines: dict[str, float] = {}
+        self.wakes: dict[str, Wake | None] = {}
+        self.ready: set[str] = set()
+        self.seq = 0
+        self.should_exit = False
+        self.t = None
+
+    def schedule(self, key: str, delay: float, wake: Wake | None = None):
+        deadline = time.perf_counter() + delay
+        with self.cond:
+            self.deadlines[key] = deadline
+            self.wakes[key] = wake
+            self.ready.discard(key)
+            self.seq += 1
+            heapq.heappush(self.heap, (deadline, self.seq, key))
+            self.cond.notify()
+
+            if not self.t:
+                self.should_exit = False
+                self.t = Thread(target=self._run, daemon=True)
+                self.t.start()
+
+    def cancel(self, *keys: str):
+        with self.cond:
+            for key in keys:
+                self.deadlines.pop(key, None)
+                self.wakes.pop(key, None)
+                self.ready.discard(key)
+            self.cond.notify()
+
+    def pending(self, key: str):
+        with self.cond:
+            return key in self.deadlines or key in self.ready
+
+    def due(self, key: str):
+        with self.cond:
+            return key in self.ready
+
+    def pop(self, key: str):
+        """Returns whether the key is due and clears it."""
+        with self.cond:
+            if key not in self.ready:
+                return False
+            self.ready.remove(key)
+            return True
+
+    def _run(self):
+        while True:
+            wakes = []
+            with self.cond:
+                if self.should_exit or not self.deadlines:
+                    # Restarted by schedule()
+                    self.heap = []
+                    self.t = None
+                    return
+
+                curr = time.perf_counter()
+                while self.heap and self.heap[0][0] <= curr:
+                    deadline, _, key = heapq.heappop(self.heap)
+                    # Skip entries that were rescheduled or cancelled
+                    if self.deadlines.get(key, None) != deadline:
+                        continue
+                    del self.deadlines[key]
+                    self.ready.add(key)
+                    wake = self.wakes.pop(key, None)
+                    if wake and wake not in wakes:
+                        wakes.append(wake)
+
+                if not wakes:
+                    if self.deadlines:
+                        self.cond.wait(self.heap[0][0] - curr)
+                    continue
+
+            for wake in wakes:
+                try:
+                    wake()
+                except Exception as e:
+                    logger.error(f"Failed to wake up plugins:\n{e}")
+
+    def close(self):
+        with self.cond:
+            self.should_exit = True
+            self.cond.notify()
+        if self.t:
+            self.t.join()
+            self.t = None
+
+
+def get_scheduler():
+    global _scheduler
+    with _lock:
+        if not _scheduler:
+            _scheduler = Scheduler()
+        return _scheduler
+
+
+def wake_hhd(emit) -> Wake:
+    """Returns a wake callback that makes hhd run the plugin loop.
+
+    hhd has no wake call for plugins, but any emitted event wakes its loop,
+    which then runs notify() and update() of every plugin. The event is an
+    acpi event, the type hhd already forwards from events.py: the plugins of
+    hhd and adjustor that read acpi events compare the event name with the
+    ones they handle (e.g., 'tdp', 'ac', 'dc', 'hibernate-thermal'), so
+    WAKE_EVENT is ignored by all of them. events.py checks that no ACPI event
+    maps to it."""
+    return lambda: emit and emit({"type": "acpi", "event": WAKE_EVENT})  # type: ignore
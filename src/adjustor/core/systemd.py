@@ -0,0 +1,129 @@
+import logging
+from typing import Callable, Sequence
+
+from .bus import get_bus
+
+logger = logging.getLogger(__name__)
+
+SYSTEMD_NAME = "org.freedesktop.systemd1"
+SYSTEMD_PATH = "/org/freedesktop/systemd1"
+MANAGER_IFACE = "org.freedesktop.systemd1.Manager"
+UNIT_IFACE = "org.freedesktop.systemd1.Unit"
+
+PPD_UNITS = [
+    "power-profiles-daemon.service",
+    "tuned.service",
+    "tuned-ppd.service",
+]
+
+
+class ServiceMonitor:
+    """Watches a fixed set of systemd units and caches whether any of them
+    is running. Units are resolved once through LoadUnit, after which the
+    state is kept current by PropertiesChanged and unit file reloads (e.g.,
+    masking), so reading `running` is free."""
+
+    def __init__(
+        self,
+        units: Sequence[str] = PPD_UNITS,
+        on_change: Callable[[bool], None] | None = None,
+        bus=None,
+    ) -> None:
+        import dbus
+
+        self.bus = bus or get_bus()
+        self.on_change = on_change
+        self.states: dict[str, tuple[str, str]] = {}
+        self.matches = []
+
+        self.manager = dbus.Interface(
+            self.bus.get_object(SYSTEMD_NAME, SYSTEMD_PATH), MANAGER_IFACE
+        )
+        # Systemd only emits unit signals to subscribed clients
+        self.manager.Subscribe()
+
+        self.units = {str(self.manager.LoadUnit(u)): u for u in units}
+        for path in self.units:
+            self._refresh(path)
+            self.matches.append(
+                self.bus.add_signal_receiver(
+                    self._on_props,
+                    signal_name="PropertiesChanged",
+                    dbus_interface=dbus.PROPERTIES_IFACE,
+                    bus_name=SYSTEMD_NAME,
+                    path=path,
+                    path_keyword="path",
+                )
+            )
+        for signal in ("UnitFilesChanged", "Reloading"):
+            self.matches.append(
+                self.bus.add_signal_receiver(
+                    self._on_reload,
+                    signal_name=signal,
+                    dbus_interface=MANAGER_IFACE,
+                    bus_name=SYSTEMD_NAME,
+                    path=SYSTEMD_PATH,
+                )
+            )
+
+        self.running = self._is_running()
+        if self.running:
+            logger.info(f"Found running services:\n{self.get_running()}")
+
+    def _refresh(self, path: str):
+        import dbus
+
+        try:
+            props = self.bus.get_object(SYSTEMD_NAME, path).GetAll(
+                UNIT_IFACE, dbus_interface=dbus.PROPERTIES_IFACE
+            )
+            self.states[path] = (str(props["LoadState"]), str(props["ActiveState"]))
+        except Exception as e:
+            logger.warning(f"Could not read state of '{self.units[path]}':\n{e}")
+            self.states[path] = ("not-found", "inactive")
+
+    def _is_running(self):
+        return bool(self.get_running())
+
+    def get_running(self):
+        return [
+            self.units[path]
+            for path, (load, active) in self.states.items()
+            if load not in ("masked", "not-found") and active != "inactive"
+        ]
+
+    def _update(self):
+        running = self._is_running()
+        if running == self.running:
+            return
+        self.running = running
+        logger.info(
+            f"Service state changed, running: {self.get_running() or 'none'}"
+        )
+        if self.on_change:
+            self.on_change(running)
+
+    def _on_props(self, iface, changed, invalidated, path=None):
+        if iface != UNIT_IFACE or path not in self.units:
+            return
+        load, active = self.states.get(path, ("not-found", "inactive"))
+        self.states[path] = (
+            str(changed.get("LoadState", load)),
+            str(changed.get("ActiveState", active)),
+        )
+        self._update()
+
+    def _on_reload(self, *args):
+        # Masking or removing a unit does not always produce PropertiesChanged
+        for path in self.units:
+            self._refresh(path)
+        self._update()
+
+    def close(self):
+        for m in self.matches:
+            m.remove()
+        self.matches = []
+        try:
+            self.manager.Unsubscribe()
+        except Exception:
+            pass
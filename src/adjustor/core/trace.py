@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from itertools import count
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+TRACE_SIZE = 4096
+
+
+class Tracer:
+    """Records spans of the TDP apply path into a ring buffer. Spans share a
+    trace id that is carried along with the TDP value (in events, and through
+    `handoff()`/`take()` between plugins), so a single slider change can be
+    followed from the FUSE socket to the ALIB call.
+
+    Disabled unless HHD_ADJ_TRACE is set, in which case the buffer is written
+    as Chrome trace JSON to that path when adjustor closes."""
+
+    def __init__(self, size: int = TRACE_SIZE) -> None:
+        self.path = os.environ.get("HHD_ADJ_TRACE", None)
+        self.enabled = bool(self.path)
+        self.events = deque(maxlen=size)
+        self.lock = Lock()
+        self.local = threading.local()
+        self.pending = {}
+        self.ids = count(1)
+        self.t0 = time.perf_counter()
+
+    def new_trace(self):
+        return next(self.ids) if self.enabled else None
+
+    def current(self):
+        return getattr(self.local, "trace", None)
+
+    def record(
+        self, name: str, start: float, end: float, trace: int | None = None, **args
+    ):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.events.append(
+                (name, start, end, trace, threading.get_ident(), args)
+            )
+
+    @contextmanager
+    def span(self, name: str, trace: int | None = None, **args):
+        if not self.enabled:
+            yield None
+            return
+
+        prev = self.current()
+        trace = trace or prev
+        self.local.trace = trace
+        start = time.perf_counter()
+        try:
+            yield trace
+        finally:
+            self.local.trace = prev
+            self.record(name, start, time.perf_counter(), trace, **args)
+
+    def handoff(self, key: str, trace: int | None):
+        if self.enabled and trace:
+            with self.lock:
+                self.pending[key] = trace
+
+    def take(self, key: str):
+        if not self.enabled:
+            return None
+        with self.lock:
+            return self.pending.pop(key, None)
+
+    def summary(self):
+        """Returns the count, p50 and p99 duration (ms) of each span name."""
+        with self.lock:
+            events = list(self.events)
+        durs = {}
+        for name, start, end, _, _, _ in events:
+            durs.setdefault(name, []).append((end - start) * 1000)
+
+        out = {}
+        for name, d in durs.items():
+            d.sort()
+            out[name] = {
+                "count": len(d),
+                "p50": d[(len(d) - 1) // 2],
+                "p99": d[min(len(d) - 1, int(len(d) * 0.99))],
+            }
+        return out
+
+    def to_chrome(self):
+        with self.lock:
+            events = list(self.events)
+        pid = os.getpid()
+        return {
+            "traceEvents": [
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": (start - self.t0) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"trace": trace, **args},
+                }
+                for name, start, end, trace, tid, args in events
+            ],
+            "displayTimeUnit": "ms",
+        }
+
+    def export(self, path: str | None = None):
+        path = path or self.path
+        if not self.enabled or not path:
+            return
+        try:
+            with open(path, "w") as f:
+                json.dump(self.to_chrome(), f)
+            info = "\n".join(
+                f" - {name:>16s}: {s['count']:4d} spans, p50 {s['p50']:8.2f}ms, p99 {s['p99']:8.2f}ms"
+                for name, s in self.summary().items()
+            )
+            logger.info(f"Wrote TDP trace to '{path}'. Stages:\n{info}")
+        except Exception as e:
+            logger.error(f"Failed to write trace to '{path}':\n{e}")
+
+
+tracer = Tracer()
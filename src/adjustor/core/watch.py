@@ -0,0 +1,70 @@
+from typing import Any, Sequence
+
+from hhd.plugins.conf import Config
+
+
+class ConfigWatch:
+    """Tracks a few config subtrees and reports which of their keys changed
+    since the last call.
+
+    Keys are changed by the user through hhd and by other plugins, and hhd
+    has no change notifications, so each subtree is read once per call. An
+    idle call costs one read and one dict comparison per subtree; keys are
+    only walked when a subtree changed."""
+
+    def __init__(self, paths: Sequence[str]) -> None:
+        self.paths = paths
+        self.values: dict[str, dict[str, Any]] = {}
+
+    def changed(self, conf: Config) -> dict[tuple[str, str], Any]:
+        out = {}
+        for path in self.paths:
+            new = conf[path].to(dict)
+            old = self.values.get(path, None)
+            if new == old:
+                continue
+            for k, v in new.items():
+                if not old or k not in old or old[k] != v:
+                    out[(path, k)] = v
+            self.values[path] = new
+        return out
+
+    def reset(self):
+        self.values = {}
+
+
+def bench(n: int = 20000, keys: int = 10):
+    """Times `changed()` on two subtrees of `keys` keys each, while idle and
+    with one key changing per call. Returns microseconds per call."""
+    import time
+
+    tree = {f"key{i}": i for i in range(keys)}
+    conf = Config({"tdp": {"smu": {"std": dict(tree), "adv": dict(tree)}}})
+    watch = ConfigWatch(("tdp.smu.std", "tdp.smu.adv"))
+    watch.changed(conf)
+
+    start = time.perf_counter()
+    for _ in range(n):
+        watch.changed(conf)
+    idle = (time.perf_counter() - start) / n * 1e6
+
+    start = time.perf_counter()
+    for i in range(n):
+        conf["tdp.smu.std.key0"] = i
+        watch.changed(conf)
+    change = (time.perf_counter() - start) / n * 1e6
+
+    # Setting the key is not part of changed()
+    start = time.perf_counter()
+    for i in range(n):
+        conf["tdp.smu.std.key0"] = i
+    change -= (time.perf_counter() - start) / n * 1e6
+    return {"idle": idle, "change": change}
+
+
+if __name__ == "__main__":
+    res = bench()
+    print(
+        f"ConfigWatch.changed(): {res['idle']:.1f}us idle, "
+        f"{res['change']:.1f}us with a change"
+    )
@@ -4,15 +4,26 @@ import subprocess
 import sys
 from threading import Thread
 from typing import Literal
-import shutil
-import time
 import signal
+from functools import partial
 
 from hhd.plugins import Context, HHDPlugin, load_relative_yaml
 from hhd.plugins.conf import Config
 
+from adjustor.core.caps import get_caps
+from adjustor.core.plan import Planner, energy_values, execute
+from adjustor.core.resume import Snapshot
+from adjustor.core.schedule import get_scheduler, wake_hhd
+from adjustor.core.systemd import ServiceMonitor
 from adjustor.fuse.gpu import (
-    get_igpu_status,
+    EPP_FN,
+    GOVERNOR_FN,
+    get_cpu_boost,
+    get_epp_avail,
+    get_frequency_scaling,
+    get_gpu_clock,
+    get_gpu_freq_range,
+    read_from_cpu0,
     set_cpu_boost,
     set_epp_mode,
     set_gpu_auto,
@@ -54,6 +65,55 @@ def _open_ppd_server(emit):
     return proc, t
 
 
+class PpdService:
+    """Serves the PPD D-Bus interface from within hhd, using the shared D-Bus
+    loop thread. Profile changes from clients are emitted directly."""
+
+    def __init__(self, emit) -> None:
+        import dbus.service
+
+        from adjustor.core.bus import get_bus
+
+        from .ppd import create_interface, iface
+
+        self.bus = get_bus()
+        self.bus_names = []
+        self.objs = []
+        # Both the current and the legacy name are served, as clients use either
+        for legacy in (False, True):
+            self.bus_names.append(
+                dbus.service.BusName(iface(legacy), self.bus, do_not_queue=True)
+            )
+            self.objs.append(
+                create_interface(legacy)(
+                    self.bus, on_profile=lambda p: emit({"type": "ppd", "status": p})
+                )
+            )
+
+    def _set_profile(self, profile: str):
+        for obj in self.objs:
+            obj.set_profile(profile)
+
+    def set_profile(self, profile: str):
+        from gi.repository import GLib
+
+        # Signals are sent from the D-Bus thread
+        GLib.idle_add(self._set_profile, profile)
+
+    def close(self):
+        for obj in self.objs:
+            obj.remove_from_connection()
+        for name in self.bus_names:
+            self.bus.release_name(name.get_name())
+        self.objs = []
+        self.bus_names = []
+
+
+def _open_ppd_service(emit):
+    logger.info("Launching PPD service.")
+    return PpdService(emit)
+
+
 class AmdGPUPlugin(HHDPlugin):
 
     def __init__(
@@ -74,9 +134,13 @@ class AmdGPUPlugin(HHDPlugin):
 
         self.proc = None
         self.t = None
+        self.ppd = None
+        self.services = None
 
-        self.queue = None
-        self.queue_gpu = None
+        self.sched = get_scheduler()
+        self.wake = None
+        self.snapshot = Snapshot("amd")
+        self.planner = Planner()
         self.sched_proc = None
         self.old_ppd = False
         self.old_freq = None
@@ -96,8 +160,12 @@ class AmdGPUPlugin(HHDPlugin):
             self.core_available = False
             return {}
 
-        status = get_igpu_status()
-        if not status:
+        # Only the GPU frequency range is fixed for the device and cached.
+        # Boost and EPP depend on the amd_pstate mode, which can change
+        # without a reboot, so they are read each time.
+        caps = get_caps()
+        freqs = caps.get("gpu_freq_range", get_gpu_freq_range, load=tuple)
+        if not freqs:
             self.core_available = False
             if not self.logged_error:
                 logger.error(
@@ -112,33 +180,12 @@ class AmdGPUPlugin(HHDPlugin):
             self.initialized = False
             return {"hhd": {"settings": sets["core"]}}
 
-        self.ppd_conflict = False
-        try:
-            out = subprocess.check_output(
-                [
-                    "systemctl",
-                    "list-units",
-                    "-t",
-                    "service",
-                    "--full",
-                    # "--all",
-                    "--plain",
-                    "--no-legend",
-                ]
-            )
-            for line in out.decode().splitlines():
-                line = line.lower()
-                if "masked" in line:
-                    continue
-                if "not-found" in line:
-                    continue
-                if "inactive" in line:
-                    continue
-                if "power-profiles-daemon" in line or "tuned" in line:
-                    self.ppd_conflict = True
-                    break
-        except Exception as e:
-            logger.error(f"Failed to check for PPD conflict:\n{e}")
+        if not self.services:
+            try:
+                self.services = ServiceMonitor(on_change=self._on_services)
+            except Exception as e:
+                logger.error(f"Failed to check for PPD conflict:\n{e}")
+        self.ppd_conflict = bool(self.services and self.services.running)
 
         if self.ppd_conflict and os.environ.get("HHD_PPD_MASK", None):
             logger.warning(
@@ -175,16 +222,26 @@ class AmdGPUPlugin(HHDPlugin):
             "children"
         ]["max"]
 
-        manual_freq["default"] = ((status.freq_min + status.freq_max) // 200) * 100
-        upper_freq["default"] = status.freq_max
-        min_freq["default"] = status.freq_min
-        max_freq["default"] = status.freq_max
+        freq_min, freq_max = freqs
+        manual_freq["default"] = ((freq_min + freq_max) // 200) * 100
+        upper_freq["default"] = freq_max
+        min_freq["default"] = freq_min
+        max_freq["default"] = freq_max
         for freq in (manual_freq, min_freq, max_freq, upper_freq):
-            freq["min"] = status.freq_min
-            freq["max"] = status.freq_max
-        self.min_freq = status.freq_min
+            freq["min"] = freq_min
+            freq["max"] = freq_max
+        self.min_freq = freq_min
 
-        self.supports_boost = status.cpu_boost is not None
+        try:
+            cpu_boost = get_cpu_boost()
+        except Exception:
+            cpu_boost = None
+        try:
+            epp_avail = get_epp_avail()
+        except Exception:
+            epp_avail = None
+
+        self.supports_boost = cpu_boost is not None
         if self.supports_boost:
             if not self.logged_boost:
                 logger.info(f"CPU Boost toggling is supported.")
@@ -201,13 +258,13 @@ class AmdGPUPlugin(HHDPlugin):
                 "cpu_min_freq"
             ]
 
-        self.supports_epp = status.epp_avail is not None
+        self.supports_epp = epp_avail is not None
         if self.supports_epp:
             epp = sets["enabled"]["children"]["mode"]["modes"]["manual"]["children"][
                 "cpu_pref"
             ]
             epp["options"] = {
-                k: v for k, v in epp["options"].items() if k in status.epp_avail
+                k: v for k, v in epp["options"].items() if k in epp_avail
             }
         else:
             del sets["enabled"]["children"]["mode"]["modes"]["manual"]["children"][
@@ -216,16 +273,20 @@ class AmdGPUPlugin(HHDPlugin):
 
         self.avail_scheds = {}
         avail_pretty = {}
-        kernel_supports = os.path.isfile("/sys/kernel/sched_ext/state")
+        kernel_supports = caps.get(
+            "sched_ext", lambda: os.path.isfile("/sys/kernel/sched_ext/state")
+        )
         if kernel_supports:
-            for sched, pretty in sets["enabled"]["children"]["mode"]["modes"]["manual"][
+            options = sets["enabled"]["children"]["mode"]["modes"]["manual"][
                 "children"
-            ]["sched"]["options"].items():
+            ]["sched"]["options"]
+            exes = caps.which([s for s in options if s != "disabled"])
+            for sched, pretty in options.items():
                 if sched == "disabled":
                     avail_pretty[sched] = pretty
                     continue
 
-                exe = shutil.which(sched)
+                exe = exes.get(sched, None)
                 if exe:
                     self.avail_scheds[sched] = exe
                     avail_pretty[sched] = pretty
@@ -251,11 +312,39 @@ class AmdGPUPlugin(HHDPlugin):
         context: Context,
     ):
         self.emit = emit
+        self.wake = wake_hhd(emit)
+
+    def _on_services(self, running: bool):
+        # Runs on the D-Bus thread, have hhd rebuild the settings
+        if running != self.ppd_conflict:
+            self.emit({"type": "settings"})
+
+    def _record_boost(self, enable: bool):
+        self.snapshot.capture("boost", partial(set_cpu_boost, enable), get_cpu_boost)
+
+    def _record_epp(self, epp: str):
+        self.snapshot.capture(
+            "governor", set_powersave_governor, partial(read_from_cpu0, GOVERNOR_FN)
+        )
+        self.snapshot.capture(
+            "epp", partial(set_epp_mode, epp), partial(read_from_cpu0, EPP_FN)  # type: ignore
+        )
+
+    def _record_scaling(self, nonlinear: bool):
+        self.snapshot.capture(
+            "frequency_scaling",
+            partial(set_frequency_scaling, nonlinear),
+            get_frequency_scaling,
+        )
 
     def notify(self, events):
         for event in events:
+            if event["type"] == "special" and event.get("event", None) == "wakeup":
+                self.snapshot.wakeup(self.wake)
             if event["type"] == "energy":
                 self.target = event["status"]
+                if self.ppd:
+                    self.ppd.set_profile(self.target)
                 try:
                     if self.proc and self.proc.stdin:
                         self.proc.stdin.write(f"{self.target}\n".encode())
@@ -281,56 +370,66 @@ class AmdGPUPlugin(HHDPlugin):
         if not self.initialized:
             return
 
+        if self.snapshot.due():
+            self.snapshot.restore()
+
         new_ppd = conf["hhd.settings.amd_energy_ppd"].to(bool)
         if new_ppd != self.old_ppd:
             self.old_ppd = new_ppd
             if new_ppd:
-                try:
-                    self.proc, self.t = _open_ppd_server(self.emit)
-                    # Fixup target in case it came before
-                    if self.proc.stdin and self.target:
-                        self.proc.stdin.write(f"{self.target}\n".encode())
-                        self.proc.stdin.flush()
-                except Exception as e:
-                    logger.error(f"Failed to open PPD server:\n{e}")
-                    self.close_ppd()
+                if not os.environ.get("HHD_PPD_SUBPROCESS", None):
+                    try:
+                        self.ppd = _open_ppd_service(self.emit)
+                        if self.target:
+                            self.ppd.set_profile(self.target)
+                    except Exception as e:
+                        logger.warning(
+                            f"Failed to start PPD service, using a separate process:\n{e}"
+                        )
+                        self.ppd = None
+                if not self.ppd:
+                    try:
+                        self.proc, self.t = _open_ppd_server(self.emit)
+                        # Fixup target in case it came before
+                        if self.proc.stdin and self.target:
+                            self.proc.stdin.write(f"{self.target}\n".encode())
+                            self.proc.stdin.flush()
+                    except Exception as e:
+                        logger.error(f"Failed to open PPD server:\n{e}")
+                        self.close_ppd()
             else:
                 self.close_ppd()
 
-        curr = time.perf_counter()
         if conf["tdp.amd_energy.mode.mode"].to(str) == "auto":
             if self.target != self.old_target:
                 self.old_target = self.target
-                self.queue = curr + APPLY_DELAY
+                self.sched.schedule("amd_energy", APPLY_DELAY, self.wake)
 
-            if self.queue is not None and curr >= self.queue:
-                self.queue = None
+            if self.sched.pop("amd_energy"):
                 logger.info(
                     f"Handling energy settings for power profile '{self.target}'."
                 )
+                vals = energy_values(self.target)
+                desired = {"frequency_scaling": vals["frequency_scaling"]}
+                if self.supports_epp:
+                    desired["governor"] = "powersave"
+                    desired["epp"] = vals["epp"]
+                if self.supports_boost:
+                    desired["boost"] = vals["boost"]
                 try:
-                    match self.target:
-                        case "balanced":
-                            if self.supports_epp:
-                                set_powersave_governor()
-                                set_epp_mode("balance_power")
-                            if self.supports_boost:
-                                set_cpu_boost(True)
-                            set_frequency_scaling(nonlinear=False)
-                        case "performance":
-                            if self.supports_epp:
-                                set_powersave_governor()
-                                set_epp_mode("balance_power")
-                            if self.supports_boost:
-                                set_cpu_boost(True)
-                            set_frequency_scaling(nonlinear=True)
-                        case _:  # power
-                            if self.supports_epp:
-                                set_powersave_governor()
-                                set_epp_mode("power")
-                            if self.supports_boost:
-                                set_cpu_boost(False)
-                            set_frequency_scaling(nonlinear=False)
+                    # Values the CPU already has are not written again
+                    failed = execute(self.planner.plan(desired))
+                    if failed:
+                        logger.error(
+                            f"Failed to set energy mode for: {', '.join(failed)}"
+                        )
+                    # Only values that were applied are restored on resume
+                    if self.supports_epp and not {"governor", "epp"} & set(failed):
+                        self._record_epp(vals["epp"])
+                    if self.supports_boost and "boost" not in failed:
+                        self._record_boost(vals["boost"])
+                    if "frequency_scaling" not in failed:
+                        self._record_scaling(vals["frequency_scaling"])
                 except Exception as e:
                     logger.error(f"Failed to set energy mode:\n{e}")
 
@@ -348,15 +447,18 @@ class AmdGPUPlugin(HHDPlugin):
                     self.old_boost = new_boost
                     try:
                         set_cpu_boost(new_boost == "enabled")
+                        self._record_boost(new_boost == "enabled")
                         # Set frequency scaling again, as max frequency
                         # changes depending on whether boost is supported
                         if self.supports_nonlinear:
-                            set_frequency_scaling(
-                                nonlinear=conf[
-                                    "tdp.amd_energy.mode.manual.cpu_min_freq"
-                                ].to(str)
+                            nonlinear = (
+                                conf["tdp.amd_energy.mode.manual.cpu_min_freq"].to(
+                                    str
+                                )
                                 == "nonlinear"
                             )
+                            set_frequency_scaling(nonlinear=nonlinear)
+                            self._record_scaling(nonlinear)
                     except Exception as e:
                         logger.error(f"Failed to set CPU boost:\n{e}")
 
@@ -366,8 +468,13 @@ class AmdGPUPlugin(HHDPlugin):
                     self.old_epp = new_epp
                     try:
                         # Set governor to powersave as well
-                        set_powersave_governor()
-                        set_epp_mode(new_epp)  # type: ignore
+                        failed = execute(
+                            self.planner.plan(
+                                {"governor": "powersave", "epp": new_epp}
+                            )
+                        )
+                        if not failed:
+                            self._record_epp(new_epp)
                     except Exception as e:
                         logger.error(f"Failed to set EPP mode:\n{e}")
 
@@ -377,6 +484,7 @@ class AmdGPUPlugin(HHDPlugin):
                     self.old_min_freq = new_min_freq
                     try:
                         set_frequency_scaling(nonlinear=new_min_freq == "nonlinear")
+                        self._record_scaling(new_min_freq == "nonlinear")
                     except Exception as e:
                         logger.error(f"Failed to set minimum CPU frequency:\n{e}")
 
@@ -422,19 +530,26 @@ class AmdGPUPlugin(HHDPlugin):
 
         if new_freq != self.old_freq:
             self.old_freq = new_freq
-            self.queue_gpu = curr + APPLY_DELAY
+            self.sched.schedule("amd_gpu", APPLY_DELAY, self.wake)
 
-        if self.queue_gpu is not None and curr >= self.queue_gpu:
-            self.queue_gpu = None
+        if self.sched.pop("amd_gpu"):
             try:
-                if new_freq:
-                    set_gpu_manual(*new_freq)
-                else:
-                    set_gpu_auto()
+                if not execute(self.planner.plan({"gpu": new_freq or "auto"})):
+                    if new_freq:
+                        replay = partial(set_gpu_manual, *new_freq)
+                    else:
+                        replay = set_gpu_auto
+                    self.snapshot.capture("gpu", replay, get_gpu_clock)
             except Exception as e:
                 logger.error(f"Failed to set GPU mode:\n{e}")
 
     def close_ppd(self):
+        if self.ppd is not None:
+            try:
+                self.ppd.close()
+            except Exception as e:
+                logger.error(f"Failed to close PPD service:\n{e}")
+            self.ppd = None
         if self.proc is not None:
             self.proc.send_signal(signal.SIGINT)
             self.proc.wait()
@@ -451,5 +566,10 @@ class AmdGPUPlugin(HHDPlugin):
             self.sched_proc = None
 
     def close(self):
+        self.sched.cancel("amd_energy", "amd_gpu")
+        self.snapshot.close()
         self.close_ppd()
         self.close_sched()
+        if self.services:
+            self.services.close()
+            self.services = None
@@ -21,6 +21,7 @@ SUPPORTED_PROFILES = {
     "performance": "performance",
 }
 SUPPORTED_PROFILES_REVERSE = {v: k for k, v in SUPPORTED_PROFILES.items()}
+HOLD_PROFILES = ("power-saver", "performance")
 
 
 def load_introspect(legacy=False):
@@ -45,13 +46,22 @@ def gpath(legacy: bool):
     return LEGACY_PATH if legacy else BASE_PATH
 
 
+def print_profile(profile: str):
+    print(profile, flush=True)
+
+
 def create_interface(legacy: bool):
     class HhdPpd(dbus.service.Object):
 
-        def __init__(self, conn=None):
-            self.profile_holds = []
+        def __init__(self, conn=None, on_profile=print_profile):
+            self.profile_holds = {}
+            self.hold_cookie = 0
+            self.hold_base = None
             self.actions = []
             self.profile = "power-saver"  # next(iter(SUPPORTED_PROFILES))
+            self.on_profile = on_profile
+            self.on_close = None
+            self.buf = b""
 
             super().__init__(conn, gpath(legacy), None)
 
@@ -78,7 +88,7 @@ def create_interface(legacy: bool):
                 return {
                     "Actions": ["trickle_charge"],
                     "ActiveProfile": self.profile,
-                    "ActiveProfileHolds": dbus.Array(self.profile_holds, signature="u"),
+                    "ActiveProfileHolds": self.get_holds(),
                     "PerformanceDegraded": "",
                     "PerformanceInhibited": "",
                     "Profiles": [
@@ -104,6 +114,11 @@ def create_interface(legacy: bool):
         @dbus.service.method(dbus.PROPERTIES_IFACE, in_signature="ssv")
         def Set(self, interface_name, property_name, new_value):
             # validate the property name and value, update internal state…
+            if property_name == "ActiveProfile" and new_value != self.profile:
+                # User changes cancel all holds
+                for cookie in list(self.profile_holds):
+                    self.release_hold(cookie, notify=True, apply=False)
+                self.hold_base = None
             self.PropertiesChanged(interface_name, {property_name: new_value}, [])
 
         @dbus.service.signal(dbus.PROPERTIES_IFACE, signature="sa{sv}as")
@@ -118,44 +133,206 @@ def create_interface(legacy: bool):
                     continue
                 if v not in SUPPORTED_PROFILES:
                     continue
-                np = SUPPORTED_PROFILES[v]
-                if np == self.profile:
+                if v == self.profile:
                     continue
-                print(np, flush=True)
+                self.on_profile(SUPPORTED_PROFILES[v])
+
+        @dbus.service.method(
+            iface(legacy),
+            in_signature="sss",
+            out_signature="u",
+            sender_keyword="sender",
+        )
+        def HoldProfile(
+            self, profile: str, reason: str, application_id: str, sender=None
+        ):
+            if profile not in HOLD_PROFILES:
+                raise dbus.exceptions.DBusException(
+                    "org.freedesktop.DBus.Error.InvalidArgs",
+                    "Only profiles 'power-saver' and 'performance' can be held.",
+                )
+
+            if not self.profile_holds:
+                self.hold_base = self.profile
+            self.hold_cookie += 1
+            cookie = self.hold_cookie
+
+            watch = None
+            if sender and self.connection:
+                # Release the hold when the holder disconnects
+                watch = self.connection.watch_name_owner(
+                    sender,
+                    lambda owner: owner or self.release_hold(cookie),
+                )
 
-        @dbus.service.method(iface(legacy), in_signature="sss", out_signature="u")
-        def HoldProfile(self, profile: str, reason: str, application_id: str):
-            # TODO
-            return 1
+            self.profile_holds[cookie] = {
+                "ApplicationId": str(application_id),
+                "Profile": str(profile),
+                "Reason": str(reason),
+                "watch": watch,
+            }
+            self.apply_holds()
+            return cookie
 
         @dbus.service.method(iface(legacy), in_signature="u", out_signature="")
         def ReleaseProfile(self, handle: int):
-            # TODO
-            self.ProfileReleased(handle)
+            if handle not in self.profile_holds:
+                raise dbus.exceptions.DBusException(
+                    "org.freedesktop.DBus.Error.InvalidArgs",
+                    f"No hold with cookie {handle}.",
+                )
+            self.release_hold(handle)
 
         @dbus.service.signal(iface(legacy), signature="u")
         def ProfileReleased(self, handle: int):
-            # TODO
             return handle
 
-        def update_profile(self):
-            for line in sys.stdin:
-                if not line:
-                    break
-                profile = line.strip()
-                if profile not in SUPPORTED_PROFILES_REVERSE:
-                    continue
-
-                self.profile = profile
+        def get_holds(self):
+            return dbus.Array(
+                [
+                    dbus.Dictionary(
+                        {k: v for k, v in h.items() if k != "watch"}, signature="sv"
+                    )
+                    for h in self.profile_holds.values()
+                ],
+                signature="a{sv}",
+            )
+
+        def release_hold(self, cookie: int, notify: bool = False, apply: bool = True):
+            hold = self.profile_holds.pop(cookie, None)
+            if not hold:
+                return
+            if hold["watch"]:
+                hold["watch"].cancel()
+            if notify:
+                self.ProfileReleased(cookie)
+            if apply:
+                self.apply_holds()
+            else:
                 self.PropertiesChanged(
-                    iface(legacy), {"ActiveProfile": self.profile}, []
+                    iface(legacy), {"ActiveProfileHolds": self.get_holds()}, []
                 )
+
+        def apply_holds(self):
+            """Switches to the held profile, with 'power-saver' taking
+            precedence, or back to the previous one once all holds are gone."""
+            if self.profile_holds:
+                held = [h["Profile"] for h in self.profile_holds.values()]
+                target = "power-saver" if "power-saver" in held else "performance"
+            else:
+                target = self.hold_base
+                self.hold_base = None
+
+            self.PropertiesChanged(
+                iface(legacy), {"ActiveProfileHolds": self.get_holds()}, []
+            )
+            if target and target != self.profile:
+                # hhd replies with the new profile, same as with Set
+                self.on_profile(SUPPORTED_PROFILES[target])
+
+        def set_profile(self, profile: str):
+            """Sets the profile from hhd (e.g., 'power') and notifies clients."""
+            if profile not in SUPPORTED_PROFILES_REVERSE:
+                return
+
+            self.profile = SUPPORTED_PROFILES_REVERSE[profile]
+            self.PropertiesChanged(iface(legacy), {"ActiveProfile": self.profile}, [])
+
+        def update_profile(self, fd: int, condition):
+            """Reads profiles sent by hhd. Runs only when stdin is readable."""
+            try:
+                data = os.read(fd, 4096)
+            except BlockingIOError:
+                return True
+
+            if not data:
+                # hhd closed the pipe, nothing more to serve
+                if self.on_close:
+                    self.on_close()
+                return False
+
+            self.buf += data
+            *lines, self.buf = self.buf.split(b"\n")
+            for line in lines:
+                self.set_profile(line.decode().strip())
             return True
 
     return HhdPpd
 
 
-if __name__ == "__main__":
+def count_idle_wakeups(idle: float = 5):
+    """Serves the interface on the session bus with a profile hold active and
+    a profile sent through the stdin pipe, then counts the GLib main loop
+    wakeups over `idle` seconds of inactivity. Run under `dbus-run-session`.
+    Returns the count, which should be zero."""
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    ctx = GLib.MainContext.default()
+
+    def run_until(cond, timeout: float = 2):
+        done = []
+        GLib.timeout_add(int(timeout * 1000), lambda: done.append(1))
+        while not cond() and not done:
+            ctx.iteration(True)
+        assert cond(), "Timed out."
+
+    bus = dbus.SessionBus()
+    name = dbus.service.BusName(iface(False), bus, do_not_queue=True)
+    profiles = []
+    obj = create_interface(False)(bus, on_profile=profiles.append)
+    r, w = os.pipe()
+    os.set_blocking(r, False)
+    GLib.io_add_watch(
+        r, GLib.PRIORITY_DEFAULT, GLib.IO_IN | GLib.IO_HUP, obj.update_profile
+    )
+
+    # A separate connection holds the profile, as a client would
+    client = dbus.SessionBus(private=True)
+    proxy = client.get_object(iface(False), gpath(False))
+    cookies = []
+    proxy.HoldProfile(
+        "performance",
+        "wakeup check",
+        "adjustor",
+        dbus_interface=iface(False),
+        reply_handler=cookies.append,
+        error_handler=lambda e: cookies.append(e),
+    )
+    run_until(lambda: cookies)
+    assert isinstance(cookies[0], int), cookies[0]
+    assert profiles == ["performance"], profiles
+
+    # Profile from hhd, through the pipe
+    os.write(w, b"performance\n")
+    run_until(lambda: obj.profile == "performance")
+    assert obj.profile_holds, "The hold was released."
+
+    while ctx.pending():
+        ctx.iteration(False)
+    stop = []
+    GLib.timeout_add(int(idle * 1000), lambda: stop.append(1))
+    wakeups = 0
+    while not stop:
+        ctx.iteration(True)
+        wakeups += 1
+    # The last wakeup is the timer that ends the count
+    wakeups -= 1
+
+    # The hold goes away with the connection of its holder
+    client.close()
+    run_until(lambda: not obj.profile_holds)
+
+    os.close(w)
+    os.close(r)
+    obj.remove_from_connection()
+    del name
+    return wakeups
+
+
+if __name__ == "__main__" and sys.argv[1:] == ["--check-wakeups"]:
+    wakeups = count_idle_wakeups()
+    print(f"Idle wakeups with a profile hold active: {wakeups}")
+    sys.exit(1 if wakeups else 0)
+elif __name__ == "__main__":
     mainloop = None
     try:
         dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
@@ -169,8 +346,14 @@ if __name__ == "__main__":
         name = dbus.service.BusName(iface(legacy), session_bus)
         object = create_interface(legacy)(session_bus)
 
-        GLib.timeout_add(100, object.update_profile)
         mainloop = GLib.MainLoop()
+        object.on_close = mainloop.quit
+        GLib.io_add_watch(
+            sys.stdin.fileno(),
+            GLib.PRIORITY_DEFAULT,
+            GLib.IO_IN | GLib.IO_HUP,
+            object.update_profile,
+        )
         mainloop.run()
     except KeyboardInterrupt:
         if mainloop:
@@ -1,18 +1,25 @@
 import logging
 import os
 import time
-from typing import Sequence
+from functools import partial
+from threading import Condition, Lock, RLock, Thread
+from typing import Callable, Sequence
 
 from hhd.plugins import Config, Context, Event, HHDPlugin, load_relative_yaml
 
-from adjustor.core.platform import set_platform_profile
+from adjustor.core.metrics import counter, gauge
+from adjustor.core.platform import get_platform_profile, set_platform_profile
+from adjustor.core.resume import Snapshot
+from adjustor.core.schedule import get_scheduler, wake_hhd
 from adjustor.i18n import _
 
 logger = logging.getLogger(__name__)
 
+SYSFS_WRITES = counter("adjustor_sysfs_writes", "Writes to sysfs attributes.")
+TDP_VALUES = gauge("adjustor_tdp_watts", "TDP values last applied through asus-wmi.", "watts")
+
 APPLY_DELAY = 0.7
 TDP_DELAY = 0.1
-SLEEP_DELAY = 4
 MIN_TDP = 7
 MAX_TDP = 30
 # FIXME: add AC/DC values
@@ -70,11 +77,93 @@ def set_tdp(pretty: str, fn: str, val: int):
     try:
         with open(fn, "w") as f:
             f.write(f"{val}\n")
-        return True
+        SYSFS_WRITES.inc(attr=os.path.basename(fn))
+        TDP_VALUES.set(val, limit=pretty)
     except Exception as e:
         logger.error(f"Failed writing value with error:\n{e}")
         return False
 
+    # Older kernels have write-only attributes, skip verification then
+    try:
+        with open(fn, "r") as f:
+            curr = int(f.read().strip())
+    except Exception:
+        return True
+    if curr != val:
+        logger.error(f"Value of tdp '{pretty}' is {curr} after writing {val}.")
+        return False
+    return True
+
+
+def get_tdp(fn: str):
+    with open(fn, "r") as f:
+        return int(f.read().strip())
+
+
+class ApplyWorker:
+    """Runs the hardware writes of the plugin on a separate thread, so update()
+    never blocks on them. Writes are spaced by TDP_DELAY, measured from the
+    previous write instead of sleeping unconditionally.
+
+    Jobs are lists of steps, submitted under a key. A job replaces a pending job
+    with the same key and pending jobs run in the order of `order`, e.g., TDP
+    (which changes the platform profile) before the fan curve."""
+
+    def __init__(
+        self,
+        order: Sequence[str],
+        on_done: Callable[[str, bool], None] | None = None,
+    ) -> None:
+        self.order = order
+        self.on_done = on_done
+        self.cond = Condition()
+        self.jobs: dict[str, list[Callable[[], bool | None]]] = {}
+        self.should_exit = False
+        self.next_write = 0
+        self.t = None
+
+    def submit(self, key: str, steps: list[Callable[[], bool | None]]):
+        with self.cond:
+            self.jobs[key] = steps
+            self.cond.notify()
+        if not self.t:
+            self.should_exit = False
+            self.t = Thread(target=self._run)
+            self.t.start()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.jobs and not self.should_exit:
+                    self.cond.wait()
+                if self.should_exit:
+                    return
+                jobs = [(k, self.jobs.pop(k)) for k in self.order if k in self.jobs]
+
+            for key, steps in jobs:
+                ok = True
+                for step in steps:
+                    delay = self.next_write - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    try:
+                        ok &= step() is not False
+                    except Exception as e:
+                        logger.error(f"Failed applying '{key}' with error:\n{e}")
+                        ok = False
+                    self.next_write = time.perf_counter() + TDP_DELAY
+                if self.on_done:
+                    self.on_done(key, ok)
+
+    def close(self):
+        with self.cond:
+            self.should_exit = True
+            self.jobs = {}
+            self.cond.notify()
+        if self.t:
+            self.t.join()
+            self.t = None
+
 
 def find_fan_curve_dir():
     for dir in os.listdir(FAN_CURVE_ENDPOINT):
@@ -86,47 +175,105 @@ def find_fan_curve_dir():
     return None
 
 
-def set_fan_curve(points: list[int], curve: list[int]):
-    point_str = ",".join([f"{p:> 4d} C" for p in points])
-    curve_str = ",".join([f"{p:> 4d} /" for p in curve])
-    logger.info(f"Setting the following fan curve:\n{point_str}\n{curve_str} 255")
-
-    dir = find_fan_curve_dir()
-    if not dir:
-        logger.error(f"Could not find hwmon with name:\n'{FAN_CURVE_NAME}'")
-        return False
-
-    for fan in (1, 2):
-        for i, (temp, speed) in enumerate(zip(points, curve)):
-            with open(os.path.join(dir, f"pwm{fan}_auto_point{i+1}_temp"), "w") as f:
-                f.write(f"{temp}")
-            with open(os.path.join(dir, f"pwm{fan}_auto_point{i+1}_pwm"), "w") as f:
-                f.write(f"{speed}")
+class FanCurve:
+    """Handle to the asus_custom_fan_curve hwmon. Attribute files are opened
+    once, and only the points that differ from the last written curve are
+    written before enabling it.
 
-    for fan in (1, 2):
-        with open(os.path.join(dir, f"pwm{fan}_enable"), "w") as f:
-            f.write(f"1")
-        if fan == 1:
-            time.sleep(TDP_DELAY)
+    Asus firmware reverts the curve when the platform profile changes, so
+    invalidate() has to be called when it does. Writes run on the apply
+    worker while invalidate() may be called from hhd, so both hold a lock."""
 
-    return True
+    def __init__(self, dir: str) -> None:
+        self.dir = dir
+        self.lock = RLock()
+        self.fds: dict[str, int] = {}
+        self.written: dict[str, str] = {}
+        self.enabled = False
 
+    def _write(self, attr: str, val: str):
+        fd = self.fds.get(attr, None)
+        if fd is None:
+            fd = os.open(os.path.join(self.dir, attr), os.O_WRONLY)
+            self.fds[attr] = fd
+        os.pwrite(fd, val.encode(), 0)
+
+    def _enable(self, val: str):
+        for fan in (1, 2):
+            self._write(f"pwm{fan}_enable", val)
+            if fan == 1:
+                time.sleep(TDP_DELAY)
+
+    def set_curve(self, points: list[int], curve: list[int]):
+        point_str = ",".join([f"{p:> 4d} C" for p in points])
+        curve_str = ",".join([f"{p:> 4d} /" for p in curve])
+
+        attrs = []
+        for fan in (1, 2):
+            for i, (temp, speed) in enumerate(zip(points, curve)):
+                for attr, val in (
+                    (f"pwm{fan}_auto_point{i+1}_temp", str(temp)),
+                    (f"pwm{fan}_auto_point{i+1}_pwm", str(speed)),
+                ):
+                    attrs.append((attr, val))
+
+        with self.lock:
+            changed = [(a, v) for a, v in attrs if self.written.get(a, None) != v]
+            if not changed and self.enabled:
+                logger.info(f"Fan curve already set:\n{point_str}\n{curve_str} 255")
+                return True
 
-def disable_fan_curve():
-    logger.info(f"Disabling custom fan curve.")
+            logger.info(
+                f"Setting the following fan curve ({len(changed)} changed attributes):\n{point_str}\n{curve_str} 255"
+            )
+            try:
+                for attr, val in changed:
+                    self._write(attr, val)
+                    self.written[attr] = val
+                self._enable("1")
+                self.enabled = True
+            except Exception:
+                self.close()
+                raise
+        return True
 
-    dir = find_fan_curve_dir()
-    if not dir:
-        logger.error(f"Could not find hwmon with name:\n'{FAN_CURVE_NAME}'")
-        return False
+    def disable(self):
+        logger.info(f"Disabling custom fan curve.")
+        with self.lock:
+            try:
+                self._enable("2")
+                self.enabled = False
+            except Exception:
+                self.close()
+                raise
+        return True
 
-    for fan in (1, 2):
-        with open(os.path.join(dir, f"pwm{fan}_enable"), "w") as f:
-            f.write(f"2")
-        if fan == 1:
-            time.sleep(TDP_DELAY)
+    def read_curve(self, points: list[int]):
+        """Returns the curve of the first fan as currently reported by the
+        firmware, or None if the custom curve is disabled."""
+        with open(os.path.join(self.dir, "pwm1_enable"), "r") as f:
+            if f.read().strip() != "1":
+                return None
+        curve = []
+        for i in range(len(points)):
+            with open(os.path.join(self.dir, f"pwm1_auto_point{i+1}_pwm"), "r") as f:
+                curve.append(int(f.read().strip()))
+        return curve
+
+    def invalidate(self):
+        with self.lock:
+            self.written = {}
+            self.enabled = False
 
-    return True
+    def close(self):
+        with self.lock:
+            for fd in self.fds.values():
+                try:
+                    os.close(fd)
+                except Exception:
+                    pass
+            self.fds = {}
+            self.invalidate()
 
 
 class AsusDriverPlugin(HHDPlugin):
@@ -145,16 +292,21 @@ class AsusDriverPlugin(HHDPlugin):
         self.extreme_standby = None
         self.extreme_supported = None
 
-        self.queue_fan = None
-        self.queue_tdp = None
-        self.queue_charge_limit = None
-        self.queue_extreme = time.perf_counter() + EXTREME_STARTUP_DELAY
+        self.sched = get_scheduler()
+        self.wake = None
         self.new_tdp = None
         self.new_mode = None
         self.old_target = None
         self.pp = None
         self.sys_tdp = False
         self.allyx = allyx
+        self.fan = None
+        self.snapshot = Snapshot("asus")
+        self.emit = None
+        # Keys whose last apply failed, written by the worker thread
+        self.failed: set[str] = set()
+        self.failed_lock = Lock()
+        self.worker = ApplyWorker(("resume", "tdp", "fan"), on_done=self._on_applied)
 
     def settings(self):
         if not self.enabled:
@@ -206,6 +358,71 @@ class AsusDriverPlugin(HHDPlugin):
         context: Context,
     ):
         self.emit = emit
+        self.wake = wake_hhd(emit)
+
+    def _queue(self, key: str, delay: float):
+        self.sched.schedule(key, delay, self.wake)
+
+    def _get_fan(self):
+        if self.fan is None:
+            dir = find_fan_curve_dir()
+            if not dir:
+                logger.error(f"Could not find hwmon with name:\n'{FAN_CURVE_NAME}'")
+                return None
+            self.fan = FanCurve(dir)
+        return self.fan
+
+    def _set_platform_profile(self, prof: str):
+        ok = set_platform_profile(prof)
+        # Firmware restores the default fan curve
+        if self.fan:
+            self.fan.invalidate()
+        return ok
+
+    def _set_fan_curve(self, curve: list[int]):
+        fan = self._get_fan()
+        return bool(fan) and fan.set_curve(POINTS, curve)
+
+    def _read_fan_curve(self):
+        fan = self._get_fan()
+        return fan.read_curve(POINTS) if fan else None
+
+    def _disable_fan_curve(self):
+        self.snapshot.forget("fan")
+        fan = self._get_fan()
+        return bool(fan) and fan.disable()
+
+    def _step(self, key: str, value, fn, read=None, resets=()):
+        """Wraps a write so that the value is recorded for resume once it
+        succeeds."""
+
+        def step():
+            ok = fn()
+            if ok is not False:
+                self.snapshot.record(key, value, fn, read, resets)
+            return ok
+
+        return step
+
+    def _forget_ppt(self):
+        # Presets do not use custom limits
+        for key in ("ppt_fast", "ppt_slow", "ppt_steady"):
+            self.snapshot.forget(key)
+
+    def _on_applied(self, key: str, ok: bool):
+        # Runs on the worker thread, the status is shown in update()
+        if ok:
+            logger.info(f"Finished applying '{key}'.")
+        else:
+            logger.error(f"Applying '{key}' did not complete successfully.")
+        with self.failed_lock:
+            changed = (key in self.failed) == ok
+            if ok:
+                self.failed.discard(key)
+            else:
+                self.failed.add(key)
+        if changed and self.wake:
+            self.wake()
 
     def update(self, conf: Config):
         self.enabled = conf["hhd.settings.tdp_enable"].to(bool)
@@ -223,17 +440,17 @@ class AsusDriverPlugin(HHDPlugin):
             self.old_conf = conf["tdp.asus"]
             return
 
-        curr = time.perf_counter()
+        if self.snapshot.due():
+            self.worker.submit("resume", [self.snapshot.restore])
 
         # Charge limit
         lim = conf["tdp.asus.charge_limit"].to(str)
         if (self.startup and lim != "disabled") or (
             lim != self.old_conf["charge_limit"].to(str)
         ):
-            self.queue_charge_limit = curr + APPLY_DELAY
+            self._queue("asus_charge_limit", APPLY_DELAY)
 
-        if self.queue_charge_limit and self.queue_charge_limit < curr:
-            self.queue_charge_limit = None
+        if self.sched.pop("asus_charge_limit"):
             match lim:
                 case "p65":
                     set_charge_limit(65)
@@ -294,14 +511,27 @@ class AsusDriverPlugin(HHDPlugin):
         if tdp_reset and mode != "custom":
             match mode:
                 case "quiet":
-                    set_platform_profile("quiet")
+                    pp = "quiet"
                     new_target = "power"
                 case "balanced":
-                    set_platform_profile("balanced")
+                    pp = "balanced"
                     new_target = "balanced"
                 case _:  # "performance":
-                    set_platform_profile("performance")
+                    pp = "performance"
                     new_target = "performance"
+            self.worker.submit(
+                "tdp",
+                [
+                    self._forget_ppt,
+                    self._step(
+                        "platform_profile",
+                        pp,
+                        partial(self._set_platform_profile, pp),
+                        get_platform_profile,
+                        resets=("fan",),
+                    ),
+                ],
+            )
 
         # In custom mode, re-apply settings with debounce
         tdp_set = False
@@ -343,46 +573,56 @@ class AsusDriverPlugin(HHDPlugin):
             # If yes, queue an update
             # Debounce
             if self.startup or steady_updated or boost_updated:
-                self.queue_tdp = curr + APPLY_DELAY
+                self._queue("asus_tdp", APPLY_DELAY)
 
-            tdp_set = self.queue_tdp and self.queue_tdp < curr
+            tdp_set = self.sched.pop("asus_tdp")
             if tdp_set:
                 if steady < 5:
                     steady = 5
                 if steady < (15 if self.allyx else 13):
-                    set_platform_profile("quiet")
+                    pp = "quiet"
                     new_target = "power"
                 elif steady < (22 if self.allyx else 20):
-                    set_platform_profile("balanced")
+                    pp = "balanced"
                     new_target = "balanced"
                 else:
-                    set_platform_profile("performance")
+                    pp = "performance"
                     new_target = "performance"
 
-                self.queue_tdp = None
                 if boost:
                     # TODO: Use different boost values depending on whether plugged in
-                    time.sleep(TDP_DELAY)
-                    set_tdp(
-                        "fast",
-                        FTDP_FN,
-                        min(max(steady, MAX_TDP_BOOST), int(steady * 35 / 25)),
-                    )
-                    time.sleep(TDP_DELAY)
-                    set_tdp(
-                        "slow",
-                        STDP_FN,
-                        min(max(steady, MAX_TDP_BOOST), int(steady * 30 / 25)),
-                    )
-                    time.sleep(TDP_DELAY)
-                    set_tdp("steady", CTDP_FN, steady)
+                    fast = min(max(steady, MAX_TDP_BOOST), int(steady * 35 / 25))
+                    slow = min(max(steady, MAX_TDP_BOOST), int(steady * 30 / 25))
                 else:
-                    time.sleep(TDP_DELAY)
-                    set_tdp("fast", FTDP_FN, steady)
-                    time.sleep(TDP_DELAY)
-                    set_tdp("slow", STDP_FN, steady)
-                    time.sleep(TDP_DELAY)
-                    set_tdp("steady", CTDP_FN, steady)
+                    fast = steady
+                    slow = steady
+
+                self.worker.submit(
+                    "tdp",
+                    [
+                        self._step(
+                            "platform_profile",
+                            pp,
+                            partial(self._set_platform_profile, pp),
+                            get_platform_profile,
+                            # The profile resets the limits and the fan curve
+                            resets=("ppt_fast", "ppt_slow", "ppt_steady", "fan"),
+                        ),
+                        *[
+                            self._step(
+                                f"ppt_{pretty}",
+                                val,
+                                partial(set_tdp, pretty, fn, val),
+                                partial(get_tdp, fn),
+                            )
+                            for pretty, fn, val in (
+                                ("fast", FTDP_FN, fast),
+                                ("slow", STDP_FN, slow),
+                                ("steady", CTDP_FN, steady),
+                            )
+                        ],
+                    ],
+                )
 
         if new_target and new_target != self.old_target:
             self.old_target = new_target
@@ -418,45 +658,50 @@ class AsusDriverPlugin(HHDPlugin):
         # Check if fan curve has changed
         # Use debounce logic on these changes
         if ((tdp_reset and mode != "custom") or tdp_set) and manual_fan_curve:
-            self.queue_fan = curr + APPLY_DELAY
+            self._queue("asus_fan", APPLY_DELAY)
 
         for i in POINTS:
             if conf[f"tdp.asus.fan.manual.st{i}"].to(int) != self.old_conf[
                 f"fan.manual.st{i}"
             ].to(int):
-                self.queue_fan = curr + APPLY_DELAY
+                self._queue("asus_fan", APPLY_DELAY)
         # If mode changes, only apply curve if set to manual
         # otherwise disable and reset tdp
         if conf["tdp.asus.fan.mode"].to(str) != self.old_conf["fan.mode"].to(str):
             if conf["tdp.asus.fan.mode"].to(str) == "manual":
-                self.queue_fan = curr + APPLY_DELAY
+                self._queue("asus_fan", APPLY_DELAY)
             else:
-                try:
-                    disable_fan_curve()
-                except Exception as e:
-                    logger.error(f"Could not disable fan curve. Error:\n{e}")
-                self.queue_tdp = curr + APPLY_DELAY
+                self.worker.submit("fan", [self._disable_fan_curve])
+                self._queue("asus_tdp", APPLY_DELAY)
 
-        apply_curve = self.queue_fan and self.queue_fan < curr
+        apply_curve = self.sched.pop("asus_fan")
         if apply_curve or tdp_set:
-            try:
-                if conf["tdp.asus.fan.mode"].to(str) == "manual":
-                    set_fan_curve(
-                        POINTS,
-                        [
-                            min(
-                                int(conf[f"tdp.asus.fan.manual.st{i}"].to(int) * 2.55),
-                                255,
-                            )
-                            for i in POINTS
-                        ],
+            if conf["tdp.asus.fan.mode"].to(str) == "manual":
+                curve = [
+                    min(
+                        int(conf[f"tdp.asus.fan.manual.st{i}"].to(int) * 2.55),
+                        255,
                     )
-            except Exception as e:
-                logger.error(f"Could not set fan curve. Error:\n{e}")
-            self.queue_fan = None
+                    for i in POINTS
+                ]
+                self.worker.submit(
+                    "fan",
+                    [
+                        self._step(
+                            "fan",
+                            curve,
+                            partial(self._set_fan_curve, curve),
+                            self._read_fan_curve,
+                        )
+                    ],
+                )
 
         # Show steam message
-        if self.sys_tdp:
+        with self.failed_lock:
+            failed = sorted(self.failed)
+        if failed:
+            conf["tdp.asus.sys_tdp"] = _("Failed to apply: ") + ", ".join(failed)
+        elif self.sys_tdp:
             conf["tdp.asus.sys_tdp"] = _("Steam is controlling TDP")
         else:
             conf["tdp.asus.sys_tdp"] = ""
@@ -471,12 +716,14 @@ class AsusDriverPlugin(HHDPlugin):
         # Extreme standby
         if self.extreme_supported:
             standby = conf["tdp.asus.extreme_standby"].to(bool)
-            if self.extreme_standby is not None and self.extreme_standby != standby:
-                self.queue_extreme = curr + EXTREME_DELAY
+            if self.extreme_standby is None:
+                # Only consumed here, so only queued when supported
+                self._queue("asus_extreme", EXTREME_STARTUP_DELAY)
+            elif self.extreme_standby != standby:
+                self._queue("asus_extreme", EXTREME_DELAY)
             self.extreme_standby = standby
 
-            if self.queue_extreme and self.queue_extreme < curr:
-                self.queue_extreme = None
+            if self.sched.pop("asus_extreme"):
                 try:
                     nval = standby == "enabled"
                     with open(EXTREME_FN, "r") as f:
@@ -504,10 +751,10 @@ class AsusDriverPlugin(HHDPlugin):
                     case "performance":
                         self.new_mode = "performance"
             elif ev["type"] == "special" and ev.get("event", None) == "wakeup":
-                logger.info(
-                    f"Waking up from sleep, resetting TDP after {SLEEP_DELAY} seconds."
-                )
-                self.queue_tdp = time.time() + SLEEP_DELAY
+                logger.info("Waking up from sleep, verifying TDP and fan curve.")
+                self.snapshot.wakeup(self.wake)
+                if self.fan:
+                    self.fan.invalidate()
             elif self.cycle_tdp and ev["type"] == "special" and ev["event"] == "xbox_y":
                 match self.mode:
                     case "quiet":
@@ -531,4 +778,9 @@ class AsusDriverPlugin(HHDPlugin):
                     self.emit({"type": "special", "event": event})
 
     def close(self):
-        pass
+        self.sched.cancel("asus_charge_limit", "asus_tdp", "asus_fan", "asus_extreme")
+        self.snapshot.close()
+        self.worker.close()
+        if self.fan:
+            self.fan.close()
+            self.fan = None
@@ -1,15 +1,18 @@
 import os
 import subprocess
 from typing import Literal
-import shutil
 
-import time
 import signal
 from hhd.plugins import Context, HHDPlugin, load_relative_yaml
 from hhd.plugins.conf import Config
 from threading import Event
 import logging
 
+from adjustor.core.bus import get_bus
+from adjustor.core.caps import get_caps
+
+from .profiles import PowerProfilesClient, TunedClient
+
 logger = logging.getLogger(__name__)
 
 
@@ -22,12 +25,13 @@ class GeneralPowerPlugin(HHDPlugin):
         self.name = f"adjustor_general"
         self.priority = 8
         self.log = "gpow"
-        self.last_check = None
         self.target = None
         self.old_sched = None
         self.sched_proc = None
         self.ppd_supported = None
         self.tuned_supported = None
+        self.ppd = None
+        self.tuned = None
         self.is_steamdeck = is_steamdeck
         self.ovr_enabled = False
         self.should_exit = Event()
@@ -40,41 +44,26 @@ class GeneralPowerPlugin(HHDPlugin):
         # PPD
         if self.ppd_supported is None:
             self.ppd_supported = False
-            if ppc := shutil.which('powerprofilesctl'):
-                try:
-                    if os.environ.get("HHD_PPD_MASK", None):
-                        logger.info("Unmasking Power Profiles Daemon in the case it was masked.")
-                        os.system('systemctl unmask power-profiles-daemon')
-                    subprocess.run(
-                        [ppc],
-                        check=True,
-                        stdin=subprocess.DEVNULL,
-                        stdout=subprocess.DEVNULL,
-                        stderr=subprocess.DEVNULL,
-                    )
-                    self.ppd_supported = True
-                except Exception as e:
-                    logger.warning(f"powerprofilectl returned with error:\n{e}")
+            if os.environ.get("HHD_PPD_MASK", None):
+                logger.info("Unmasking Power Profiles Daemon in the case it was masked.")
+                os.system('systemctl unmask power-profiles-daemon')
+            try:
+                self.ppd = PowerProfilesClient(get_bus())
+                self.ppd_supported = True
+            except Exception as e:
+                logger.warning(f"Could not connect to Power Profiles Daemon:\n{e}")
 
         # TuneD
         if self.tuned_supported is None:
             self.tuned_supported = False
-            if tuned := shutil.which('tuned-adm'):
-                try:
-                    if os.environ.get("HHD_PPD_MASK", None):
-                        logger.info("Unmasking TuneD in the case it was masked.")
-                        os.system('systemctl unmask tuned')
-                    subprocess.run(
-                        [tuned,'active'],
-                        check=True,
-                        stdin=subprocess.DEVNULL,
-                        stdout=subprocess.DEVNULL,
-                        stderr=subprocess.DEVNULL,
-                    )
-                    self.tuned_supported = True
-                except Exception as e:
-                    logger.warning(f"tuned-adm returned with error:\n{e}")
-
+            if os.environ.get("HHD_PPD_MASK", None):
+                logger.info("Unmasking TuneD in the case it was masked.")
+                os.system('systemctl unmask tuned')
+            try:
+                self.tuned = TunedClient(get_bus())
+                self.tuned_supported = True
+            except Exception as e:
+                logger.warning(f"Could not connect to TuneD:\n{e}")
 
         if not self.ppd_supported and not self.tuned_supported:
             del sets["children"]["profile"]
@@ -82,14 +71,19 @@ class GeneralPowerPlugin(HHDPlugin):
         # SchedExt
         self.avail_scheds = {}
         avail_pretty = {}
-        kernel_supports = os.path.isfile("/sys/kernel/sched_ext/state")
+        caps = get_caps()
+        kernel_supports = caps.get(
+            "sched_ext", lambda: os.path.isfile("/sys/kernel/sched_ext/state")
+        )
         if kernel_supports:
-            for sched, pretty in sets["children"]["sched"]["options"].items():
+            options = sets["children"]["sched"]["options"]
+            exes = caps.which([s for s in options if s != "disabled"])
+            for sched, pretty in options.items():
                 if sched == "disabled":
                     avail_pretty[sched] = pretty
                     continue
 
-                exe = shutil.which(sched)
+                exe = exes.get(sched, None)
                 if exe:
                     self.avail_scheds[sched] = exe
                     avail_pretty[sched] = pretty
@@ -109,90 +103,43 @@ class GeneralPowerPlugin(HHDPlugin):
 
     def update(self, conf: Config):
         # Handle ppd
-        if self.ppd_supported:
-            curr = time.time()
+        if self.ppd_supported and self.ppd:
             new_profile = conf.get("tdp.general.profile", self.target)
             if new_profile != self.target and new_profile and self.target:
                 logger.info(f"Setting power profile to '{new_profile}'")
                 self.target = new_profile
                 try:
-                    subprocess.run(
-                        [shutil.which('powerprofilesctl'), "set", new_profile],
-                        check=True,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                    )
-                except Exception as e:
-                    self.ppd_supported = False
-                    logger.warning(f"powerprofilesctl returned with error:\n{e}")
-                    self.ppd_supported = False
-            elif not self.last_check or curr - self.last_check > 2:
-                # Update profile every 2 seconds
-                self.last_check = curr
-                try:
-                    res = subprocess.run(
-                        [shutil.which('powerprofilesctl'), "get"],
-                        check=True,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                    )
-                    self.target = res.stdout.decode().strip()  # type: ignore
-                    if self.target != conf["tdp.general.profile"].to(str):
-                        conf["tdp.general.profile"] = self.target
+                    self.ppd.set_profile(new_profile)
                 except Exception as e:
-                    self.ppd_supported = False
-                    logger.warning(f"powerprofilectl returned with error:\n{e}")
-                    self.ppd_supported = False
+                    logger.warning(f"Power Profiles Daemon returned with error:\n{e}")
+                    self.close_ppd()
+            elif self.ppd.profile != self.target:
+                # Updated through PropertiesChanged
+                self.target = self.ppd.profile
+                if self.target != conf["tdp.general.profile"].to(str):
+                    conf["tdp.general.profile"] = self.target
 
         # Handle TuneD
-        if self.tuned_supported:
-            curr = time.time()
-            ppd_tuned_mapping = {
-                "power-saver": "powersave",
-                "balanced": "balanced",
-                "performance": "throughput-performance"
-            }
-
-            new_profile = ppd_tuned_mapping.get(conf.get("tdp.general.profile", self.target))
+        if self.tuned_supported and self.tuned:
+            new_profile = conf.get("tdp.general.profile", self.target)
             if new_profile != self.currentTarget and new_profile and self.currentTarget:
-                logger.info(f"Setting TuneD profile to '{new_profile}' from '{self.target}'")
-                self.currentTarget = new_profile
+                logger.info(f"Setting TuneD profile to '{new_profile}' from '{self.currentTarget}'")
                 try:
-                    subprocess.run(
-                        [shutil.which('tuned-adm'), "profile", new_profile],
-                        check=True,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                    )
-
+                    if self.tuned.set_profile(new_profile):
+                        self.currentTarget = new_profile
+                    else:
+                        # Keep showing the profile TuneD is still on
+                        conf["tdp.general.profile"] = self.currentTarget
                 except Exception as e:
-                    self.tuned_supported = False
-                    logger.warning(f"tuned-adm returned with error:\n{e}")
-                    self.tuned_supported = False
-            elif not self.last_check or curr - self.last_check > 2:
-                # Update profile every 2 seconds
-                self.last_check = curr
-                try:
-                    res = subprocess.run(
-                        [shutil.which('tuned-adm'), "active"],
-                        check=True,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                    )
-                    tuned_ppd_mapping = {
-                        "powersave": "power-saver",
-                        "balanced": "balanced",
-                        "throughput-performance": "performance"
-                    }
-                    self.currentTarget = res.stdout.decode().split(":")[1].strip()
-                    self.target = tuned_ppd_mapping.get(self.currentTarget)  # type: ignore
-
-                    if self.target != conf["tdp.general.profile"].to(str):
-                        conf["tdp.general.profile"] = self.target
-                except Exception as e:
-                    self.tuned_supported = False
-                    logger.warning(f"tuned-adm returned with error:\n{e}")
-                    self.tuned_supported = False
+                    logger.warning(f"TuneD returned with error:\n{e}")
+                    self.close_tuned()
+            elif self.tuned.profile != self.currentTarget:
+                # Updated through profile_changed
+                self.currentTarget = self.tuned.profile
+                self.target = self.currentTarget
+
+                if self.target != conf["tdp.general.profile"].to(str):
+                    conf["tdp.general.profile"] = self.target
 
         # Handle sched
         if self.avail_scheds:
@@ -241,8 +188,22 @@ class GeneralPowerPlugin(HHDPlugin):
             self.sched_proc.wait()
             self.sched_proc = None
 
+    def close_ppd(self):
+        self.ppd_supported = False
+        if self.ppd:
+            self.ppd.close()
+            self.ppd = None
+
+    def close_tuned(self):
+        self.tuned_supported = False
+        if self.tuned:
+            self.tuned.close()
+            self.tuned = None
+
     def close(self):
         self.close_sched()
+        self.close_ppd()
+        self.close_tuned()
         if self.t_sys:
             self.should_exit.set()
             self.t_sys.join()
@@ -0,0 +1,221 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+PPD_NAMES = [
+    ("org.freedesktop.UPower.PowerProfiles", "/org/freedesktop/UPower/PowerProfiles"),
+    ("net.hadess.PowerProfiles", "/net/hadess/PowerProfiles"),
+]
+TUNED_NAME = "com.redhat.tuned"
+TUNED_PATH = "/Tuned"
+TUNED_IFACE = "com.redhat.tuned.control"
+
+TUNED_PPD_MAPPING = {
+    "powersave": "power-saver",
+    "balanced": "balanced",
+    "throughput-performance": "performance",
+}
+PPD_TUNED_MAPPING = {v: k for k, v in TUNED_PPD_MAPPING.items()}
+
+
+class PowerProfilesClient:
+    """Tracks the active profile of Power Profiles Daemon through
+    PropertiesChanged, so reading it does not require a bus roundtrip."""
+
+    def __init__(self, bus) -> None:
+        import dbus
+
+        self.bus = bus
+        self.profile: str | None = None
+        self.match = None
+
+        err = None
+        for name, path in PPD_NAMES:
+            try:
+                proxy = bus.get_object(name, path)
+                self.profile = str(
+                    proxy.Get(name, "ActiveProfile", dbus_interface=dbus.PROPERTIES_IFACE)
+                )
+                self.name = name
+                self.proxy = proxy
+                break
+            except dbus.exceptions.DBusException as e:
+                err = e
+        else:
+            raise RuntimeError(f"Power Profiles Daemon is not available:\n{err}")
+
+        self.match = bus.add_signal_receiver(
+            self._on_changed,
+            signal_name="PropertiesChanged",
+            dbus_interface=dbus.PROPERTIES_IFACE,
+            bus_name=self.name,
+            path=self.proxy.object_path,
+        )
+
+    def _on_changed(self, iface, changed, invalidated):
+        if iface != self.name or "ActiveProfile" not in changed:
+            return
+        self.profile = str(changed["ActiveProfile"])
+
+    def set_profile(self, profile: str):
+        import dbus
+
+        self.proxy.Set(
+            self.name,
+            "ActiveProfile",
+            dbus.String(profile, variant_level=1),
+            dbus_interface=dbus.PROPERTIES_IFACE,
+        )
+        # Avoid reverting to the old value before the signal arrives
+        self.profile = profile
+
+    def close(self):
+        if self.match:
+            self.match.remove()
+            self.match = None
+
+
+class TunedClient:
+    """Tracks the active TuneD profile through its profile_changed signal.
+    Profiles are exposed with their PPD names."""
+
+    def __init__(self, bus) -> None:
+        self.bus = bus
+        self.match = None
+        self.proxy = bus.get_object(TUNED_NAME, TUNED_PATH)
+        self.active = str(self.proxy.active_profile(dbus_interface=TUNED_IFACE))
+
+        self.match = bus.add_signal_receiver(
+            self._on_changed,
+            signal_name="profile_changed",
+            dbus_interface=TUNED_IFACE,
+            bus_name=TUNED_NAME,
+            path=TUNED_PATH,
+        )
+
+    @property
+    def profile(self):
+        return TUNED_PPD_MAPPING.get(self.active)
+
+    def _on_changed(self, profile, result, message):
+        if result:
+            self.active = str(profile)
+
+    def set_profile(self, profile: str):
+        import dbus
+
+        tuned = PPD_TUNED_MAPPING.get(profile)
+        if not tuned:
+            logger.error(f"No TuneD profile for '{profile}'.")
+            return False
+
+        try:
+            ok, msg = self.proxy.switch_profile(tuned, dbus_interface=TUNED_IFACE)
+        except dbus.exceptions.DBusException as e:
+            logger.error(f"Could not switch TuneD to '{tuned}':\n{e}")
+            return False
+        if not ok:
+            logger.error(f"TuneD failed to switch to '{tuned}':\n{msg}")
+            return False
+        self.active = tuned
+        return True
+
+    def close(self):
+        if self.match:
+            self.match.remove()
+            self.match = None
+
+
+def _wait(cond, timeout: float = 2):
+    import time
+
+    end = time.perf_counter() + timeout
+    while not cond():
+        if time.perf_counter() > end:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def check_clients():
+    """Runs both clients against stand-in PPD and TuneD services on the
+    session bus. Run under `dbus-run-session`. Raises AssertionError on the
+    first mismatch."""
+    import dbus
+    import dbus.mainloop.glib
+    import dbus.service
+    from gi.repository import GLib
+
+    from adjustor.core.bus import get_bus
+    from adjustor.drivers.amd.ppd import create_interface, iface
+
+    class TunedStandIn(dbus.service.Object):
+        def __init__(self, conn) -> None:
+            super().__init__(conn, TUNED_PATH)
+            self.active = "balanced"
+            self.fail = False
+
+        @dbus.service.method(TUNED_IFACE, in_signature="", out_signature="s")
+        def active_profile(self):
+            return self.active
+
+        @dbus.service.method(TUNED_IFACE, in_signature="s", out_signature="(bs)")
+        def switch_profile(self, profile):
+            if self.fail:
+                raise dbus.exceptions.DBusException(
+                    "com.redhat.tuned.Error", "Stand-in failure."
+                )
+            self.active = str(profile)
+            self.profile_changed(profile, True, "OK")
+            return (True, "OK")
+
+        @dbus.service.signal(TUNED_IFACE, signature="sbs")
+        def profile_changed(self, profile, result, message):
+            pass
+
+    # Services get their own connection, serviced by the same loop thread
+    client_bus = get_bus(session=True)
+    bus = dbus.SessionBus(mainloop=dbus.mainloop.glib.DBusGMainLoop(), private=True)
+    names = [
+        dbus.service.BusName(iface(False), bus, do_not_queue=True),
+        dbus.service.BusName(TUNED_NAME, bus, do_not_queue=True),
+    ]
+    ppd = create_interface(False)(bus)
+    ppd.on_profile = ppd.set_profile
+    tuned = TunedStandIn(bus)
+
+    client = PowerProfilesClient(client_bus)
+    try:
+        assert client.name == iface(False), client.name
+        assert client.profile == "power-saver", client.profile
+        client.set_profile("performance")
+        assert _wait(lambda: ppd.profile == "performance"), ppd.profile
+        # Changes by other clients arrive through PropertiesChanged
+        GLib.idle_add(ppd.set_profile, "balanced")
+        assert _wait(lambda: client.profile == "balanced"), client.profile
+    finally:
+        client.close()
+
+    client = TunedClient(client_bus)
+    try:
+        assert client.profile == "balanced", client.profile
+        assert client.set_profile("power-saver")
+        assert tuned.active == "powersave", tuned.active
+        GLib.idle_add(tuned.profile_changed, "throughput-performance", True, "OK")
+        assert _wait(lambda: client.profile == "performance"), client.profile
+        tuned.fail = True
+        assert not client.set_profile("balanced")
+        assert client.profile == "performance", client.profile
+    finally:
+        client.close()
+
+    ppd.remove_from_connection()
+    tuned.remove_from_connection()
+    del names
+    bus.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    check_clients()
+    print("Power Profiles Daemon and TuneD clients match the stand-ins.")
@@ -1,35 +1,21 @@
 import logging
 import time
-from typing import Sequence, cast
+from typing import Sequence
 
 from hhd.plugins import Context, Event, HHDPlugin, load_relative_yaml
 from hhd.plugins.conf import Config
 
-from adjustor.core.lenovo import (
-    MIN_CURVE,
-    TdpMode,
-    get_bios_version,
-    get_charge_limit,
-    get_full_fan_speed,
-    get_power_light,
-    get_power_light_v1,
-    get_tdp_mode,
-    set_charge_limit,
-    set_fan_curve,
-    set_fast_tdp,
-    set_full_fan_speed,
-    set_power_light,
-    set_power_light_v1,
-    set_slow_tdp,
-    set_steady_tdp,
-    set_tdp_mode,
-)
+from adjustor.core.lenovo import MIN_CURVE, LenovoState, get_bios_version
+from adjustor.core.schedule import get_scheduler, wake_hhd
 from adjustor.i18n import _
 
 logger = logging.getLogger(__name__)
 
 APPLY_DELAY = 0.5
 TDP_DELAY = 0
+# Not every mode change raises the "tdp" ACPI event, so the mode is also read
+# back this often (one ACPI call)
+MODE_REFRESH = 5
 
 
 class LenovoDriverPlugin(HHDPlugin):
@@ -49,9 +35,10 @@ class LenovoDriverPlugin(HHDPlugin):
         bios_version = get_bios_version()
         logger.info(f"Lenovo BIOS version: {bios_version}")
         self.power_light_v2 = bios_version >= 35
+        self.state = LenovoState(self.power_light_v2)
 
-        self.queue_fan = None
-        self.queue_tdp = None
+        self.sched = get_scheduler()
+        self.wake = None
         self.new_tdp = None
         self.new_mode = None
         self.old_target = None
@@ -79,6 +66,10 @@ class LenovoDriverPlugin(HHDPlugin):
         context: Context,
     ):
         self.emit = emit
+        self.wake = wake_hhd(emit)
+
+    def _queue(self, key: str, delay: float):
+        self.sched.schedule(key, delay, self.wake)
 
     def update(self, conf: Config):
         self.enabled = conf["hhd.settings.tdp_enable"].to(bool)
@@ -99,50 +90,46 @@ class LenovoDriverPlugin(HHDPlugin):
         # Initialize values so we do not query them all the time
         tdp_reset = self.startup
         if self.startup:
-            conf["tdp.lenovo.ffss"] = get_full_fan_speed()
+            self.state.invalidate()
+            conf["tdp.lenovo.ffss"] = self.state.get("full_fan_speed")
+            conf["tdp.lenovo.power_light"] = self.state.get("power_light")
             if self.power_light_v2:
-                conf["tdp.lenovo.power_light"] = get_power_light(suspend=False)
-                conf["tdp.lenovo.power_light_sleep"] = get_power_light(suspend=True)
-            else:
-                conf["tdp.lenovo.power_light"] = get_power_light_v1()
+                conf["tdp.lenovo.power_light_sleep"] = self.state.get(
+                    "power_light_sleep"
+                )
 
-            conf["tdp.lenovo.charge_limit"] = get_charge_limit()
+            conf["tdp.lenovo.charge_limit"] = self.state.get("charge_limit")
 
         # If not old config, exit, as values can not be set
         if not self.old_conf:
             self.old_conf = conf["tdp.lenovo"]
             return
 
-        curr = time.time()
-
         #
         # Other options
         #
         ffss = conf["tdp.lenovo.ffss"].to(bool)
         if ffss is not None and ffss != self.old_conf["ffss"].to(bool):
-            set_full_fan_speed(ffss)
+            self.state.set("full_fan_speed", ffss)
 
         power_light = conf["tdp.lenovo.power_light"].to(bool)
         if power_light is not None and power_light != self.old_conf["power_light"].to(
             bool
         ):
-            if self.power_light_v2:
-                set_power_light(power_light, suspend=False)
-            else:
-                set_power_light_v1(power_light)
+            self.state.set("power_light", power_light)
         if self.power_light_v2:
             power_light_sleep = conf["tdp.lenovo.power_light_sleep"].to(bool)
             if (
                 power_light_sleep != self.old_conf["power_light_sleep"].to(bool)
                 and power_light_sleep is not None
             ):
-                set_power_light(power_light_sleep, suspend=True)
+                self.state.set("power_light_sleep", power_light_sleep)
 
         charge_limit = conf["tdp.lenovo.charge_limit"].to(bool)
         if charge_limit is not None and charge_limit != self.old_conf[
             "charge_limit"
         ].to(bool):
-            set_charge_limit(charge_limit)
+            self.state.set("charge_limit", charge_limit)
 
         #
         # TDP
@@ -172,11 +159,15 @@ class LenovoDriverPlugin(HHDPlugin):
         else:
             mode = conf["tdp.lenovo.tdp.mode"].to(str)
         if mode is not None and mode != self.old_conf["tdp.mode"].to(str):
-            set_tdp_mode(cast(TdpMode, mode))
+            self.state.set("tdp_mode", mode)
             tdp_reset = True
 
         # Grab from power button
-        new_mode = get_tdp_mode()
+        if self.sched.pop("lenovo_mode"):
+            self.state.invalidate("tdp_mode")
+        if not self.sched.pending("lenovo_mode"):
+            self._queue("lenovo_mode", MODE_REFRESH)
+        new_mode = self.state.get("tdp_mode")
         if new_mode != mode:
             if not new_tdp:
                 self.sys_tdp = False
@@ -188,11 +179,11 @@ class LenovoDriverPlugin(HHDPlugin):
         # we are in custom mode
         fan_mode = conf["tdp.lenovo.fan.mode"].to(str)
         if fan_mode != self.old_conf["fan.mode"].to(str) and fan_mode != "manual":
-            tdp_mode = get_tdp_mode()
+            tdp_mode = self.state.get("tdp_mode")
             if tdp_mode:
-                set_tdp_mode("performance")
+                self.state.set("tdp_mode", "performance")
                 time.sleep(TDP_DELAY)
-                set_tdp_mode(tdp_mode)
+                self.state.set("tdp_mode", tdp_mode)
                 tdp_reset = True
 
         # Handle EPP for presets
@@ -241,22 +232,21 @@ class LenovoDriverPlugin(HHDPlugin):
             # If yes, queue an update
             # Debounce
             if steady_updated or boost_updated or tdp_reset:
-                self.queue_tdp = curr + APPLY_DELAY
+                self._queue("lenovo_tdp", APPLY_DELAY)
 
-            if self.queue_tdp and self.queue_tdp < curr:
-                self.queue_tdp = None
+            if self.sched.pop("lenovo_tdp"):
                 if boost:
-                    set_steady_tdp(steady)
+                    self.state.set("steady_tdp", steady)
                     time.sleep(TDP_DELAY)
-                    set_slow_tdp(steady + 2)
+                    self.state.set("slow_tdp", steady + 2)
                     time.sleep(TDP_DELAY)
-                    set_fast_tdp(min(42, int(steady * 41 / 30)))
+                    self.state.set("fast_tdp", min(42, int(steady * 41 / 30)))
                 else:
-                    set_steady_tdp(steady)
+                    self.state.set("steady_tdp", steady)
                     time.sleep(TDP_DELAY)
-                    set_slow_tdp(steady)
+                    self.state.set("slow_tdp", steady)
                     time.sleep(TDP_DELAY)
-                    set_fast_tdp(steady)
+                    self.state.set("fast_tdp", steady)
 
                 # Handle EPP for custom mode
                 if steady < 12:
@@ -275,7 +265,7 @@ class LenovoDriverPlugin(HHDPlugin):
         # If tdp reset, so was the curve
         if tdp_reset:
             # 2x to apply after tdp
-            self.queue_fan = curr + 2 * APPLY_DELAY
+            self._queue("lenovo_fan", 2 * APPLY_DELAY)
 
         # Handle fan curve resets
         if conf["tdp.lenovo.fan.manual.reset"].to(bool):
@@ -300,14 +290,14 @@ class LenovoDriverPlugin(HHDPlugin):
             if conf[f"tdp.lenovo.fan.manual.st{i}"].to(int) != self.old_conf[
                 f"fan.manual.st{i}"
             ].to(int):
-                self.queue_fan = curr + APPLY_DELAY
+                self._queue("lenovo_fan", APPLY_DELAY)
 
-        apply_curve = (
-            self.queue_fan and self.queue_fan < curr
-        ) or not self.fan_curve_set
+        # Stays due until the fan is set to manual
+        apply_curve = self.sched.due("lenovo_fan") or not self.fan_curve_set
         if conf["tdp.lenovo.fan.mode"].to(str) == "manual" and apply_curve:
             try:
-                set_fan_curve(
+                self.state.set(
+                    "fan_curve",
                     [
                         conf[f"tdp.lenovo.fan.manual.st{i}"].to(int)
                         for i in (10, 20, 30, 40, 50, 60, 70, 80, 90, 100)
@@ -316,7 +306,7 @@ class LenovoDriverPlugin(HHDPlugin):
             except Exception as e:
                 logger.error(f"Could not set fan curve. Error:\n{e}")
             self.fan_curve_set = True
-            self.queue_fan = None
+            self.sched.pop("lenovo_fan")
 
         # Show steam message
         if self.sys_tdp:
@@ -351,7 +341,11 @@ class LenovoDriverPlugin(HHDPlugin):
                         self.new_mode = "performance"
             print(ev)
             if ev["type"] == "acpi" and ev.get("event", None) == "tdp":
+                self.state.on_event("tdp")
                 self.notify_tdp = True
+            if ev["type"] == "special" and ev.get("event", None) == "wakeup":
+                # Firmware may have reset values during sleep
+                self.state.invalidate()
 
     def close(self):
-        pass
+        self.sched.cancel("lenovo_tdp", "lenovo_fan", "lenovo_mode")
@@ -1,21 +1,35 @@
 import logging
+import os
 import time
+from functools import cache, partial
 from threading import Event as TEvent, Lock, Thread
-from typing import Sequence
+from typing import NamedTuple, Sequence
 
 from hhd.plugins import Context, Event, HHDPlugin, load_relative_yaml
 from hhd.plugins.conf import Config
 
 from adjustor.core.alib import AlibParams, DeviceParams, alib
 from adjustor.core.fan import fan_worker, get_fan_info
-from adjustor.core.platform import get_platform_choices, set_platform_profile
+from adjustor.core.caps import get_caps
+from adjustor.core.platform import (
+    get_platform_choices,
+    get_platform_profile,
+    set_platform_profile,
+)
+from adjustor.core.plan import Planner, execute
+from adjustor.core.power import PIGovernor, PowerSampler, find_power_source
+from adjustor.core.resume import Snapshot
+from adjustor.core.schedule import get_scheduler, wake_hhd
+from adjustor.core.trace import tracer
+from adjustor.core.watch import ConfigWatch
 from adjustor.i18n import _
 
 logger = logging.getLogger(__name__)
 
 PP_DELAY = 0.2
 APPLY_DELAY = 1
-SLEEP_DELAY = 4
+GOVERNOR_PERIOD = 5
+GOVERNOR_RATE = 2
 
 DEFAULT_EDGE = {
     40: 25,
@@ -39,6 +53,33 @@ DEFAULT_TCTL = {
 }
 
 
+class TdpPreset(NamedTuple):
+    tdp: int
+    platform_profile: str | None
+    energy_policy: str | None
+    # (slow, fast) limits
+    boost: tuple[int, int] | None
+    no_boost: tuple[int, int]
+
+
+@cache
+def _load_template(fn: str):
+    """Parsed once per process. Never modified, trees are built from it with
+    `_edit()`."""
+    return load_relative_yaml(fn)
+
+
+def _edit(tree: dict, *path: str) -> dict:
+    """Replaces the dicts along `path` with copies and returns the last one,
+    so it can be modified without touching the template it came from. Call it
+    once per path, references from earlier calls are not in the tree."""
+    node = tree
+    for k in path:
+        node[k] = dict(node[k])
+        node = node[k]
+    return node
+
+
 class SmuQamPlugin(HHDPlugin):
 
     def __init__(
@@ -49,6 +90,7 @@ class SmuQamPlugin(HHDPlugin):
         init_tdp: bool = True,
     ) -> None:
         self.name = f"adjustor_smu_qam"
+        self.trees = {}
         self.priority = 7
         self.log = "smuq"
         self.enabled = False
@@ -58,16 +100,24 @@ class SmuQamPlugin(HHDPlugin):
         self.emit = None
         self.old_conf = None
         self.startup = True
-        self.queued = None
+        self.sched = get_scheduler()
+        self.wake = None
         self.sys_tdp = False
 
         self.old_tdp = None
         self.old_boost = None
         self.new_tdp = None
         self.is_set = False
+        self.trace = None
+        self.trace_start = None
         self.lims = self.dev.get("skin_limit", self.dev.get("stapm_limit", None))
 
         self.fan_info = None
+        self.power_source = None
+        self.sampler = None
+        self.governor = None
+        self.gov_target = None
+        self.gov_limit = None
         self.fan_t = None
         self.fan_should_exit = TEvent()
         self.fan_junction = TEvent()
@@ -82,7 +132,7 @@ class SmuQamPlugin(HHDPlugin):
 
         self.energy_map = energy_map
         if pp_map:
-            self.pps = get_platform_choices() or []
+            self.pps = get_caps().get("platform_choices", get_platform_choices) or []
             if self.pps:
                 self.pp_map = pp_map
             else:
@@ -94,13 +144,62 @@ class SmuQamPlugin(HHDPlugin):
             self.pps = []
             self.pp_map = None
 
+        # The slider only moves within the device limits, so everything it
+        # sets is derived once
+        self.presets: dict[int, TdpPreset] = {}
+        if self.lims and self.lims.min is not None and self.lims.max is not None:
+            for tdp in range(self.lims.min, self.lims.max + 1):
+                self.presets[tdp] = self._derive_preset(tdp)
+
+    def _derive_preset(self, tdp: int):
+        pp = None
+        if self.pp_map:
+            pp = self.pp_map[0][0]
+            for npp, ptdp in self.pp_map:
+                if ptdp < tdp and npp in self.pps:
+                    pp = npp
+
+        ep = None
+        if self.energy_map:
+            ep = self.energy_map[0][0]
+            for nep, etdp in self.energy_map:
+                if etdp < tdp:
+                    ep = nep
+
+        boost = None
+        fmax = self.dev["fast_limit"].smax if "fast_limit" in self.dev else None
+        smax = self.dev["stapm_limit"].smax if "stapm_limit" in self.dev else None
+        if fmax and smax:
+            fast = int(tdp * (fmax / smax))
+            boost = (min(tdp + 2, fast), fast)
+
+        return TdpPreset(tdp, pp, ep, boost, (tdp, tdp))
+
+    def get_preset(self, tdp: int):
+        preset = self.presets.get(tdp, None)
+        if preset is None:
+            preset = self._derive_preset(tdp)
+        return preset
+
+    def export_presets(self):
+        return {tdp: p._asdict() for tdp, p in self.presets.items()}
+
     def settings(self):
         if not self.enabled:
             self.initialized = False
             return {}
 
         self.initialized = True
-        out = {"tdp": {"qam": load_relative_yaml("qam.yml")}}
+        key = (self.enforce_limits, bool(self.fan_info), bool(self.power_source))
+        tree = self.trees.get(key, None)
+        if tree is None:
+            # Shared between calls, so it is not modified after this
+            tree = self.trees[key] = self._build_settings()
+        return {"tdp": {"qam": tree}}
+
+    def _build_settings(self):
+        out = dict(_load_template("qam.yml"))
+        children = _edit(out, "children")
 
         # Set device limits based on stapm
         lims = self.lims
@@ -109,41 +208,32 @@ class SmuQamPlugin(HHDPlugin):
         ), f"Device params do not include skin limit or stapm limit to set tdp."
 
         dmin, smin, default, smax, dmax = lims
+        tdp = _edit(children, "tdp")
         if self.enforce_limits:
-            out["tdp"]["qam"]["children"]["tdp"].update(
-                {"min": smin, "max": smax, "default": default}
-            )
+            tdp.update({"min": smin, "max": smax, "default": default})
         else:
-            out["tdp"]["qam"]["children"]["tdp"].update(
-                {"min": dmin, "max": dmax, "default": default}
-            )
+            tdp.update({"min": dmin, "max": dmax, "default": default})
+
+        if not self.power_source:
+            del children["governor"]
+        else:
+            target = _edit(children, "governor", "modes", "enabled", "children", "target")
+            target.update({"min": smin, "max": smax, "default": default})
 
         if not self.fan_info:
-            del out["tdp"]["qam"]["children"]["fan"]
+            del children["fan"]
         else:
-            base = out["tdp"]["qam"]["children"]["fan"]["modes"]["manual_edge"][
-                "children"
-            ]["st40"]
-            reset = out["tdp"]["qam"]["children"]["fan"]["modes"]["manual_edge"][
-                "children"
-            ].pop("reset")
-            for k, v in DEFAULT_EDGE.items():
-                out["tdp"]["qam"]["children"]["fan"]["modes"]["manual_edge"][
-                    "children"
-                ][f"st{k}"] = {**base, "title": f"{k}C", "default": v}
-            out["tdp"]["qam"]["children"]["fan"]["modes"]["manual_edge"]["children"][
-                "reset"
-            ] = reset
-            reset = out["tdp"]["qam"]["children"]["fan"]["modes"]["manual_junction"][
-                "children"
-            ].pop("reset")
-            for k, v in DEFAULT_TCTL.items():
-                out["tdp"]["qam"]["children"]["fan"]["modes"]["manual_junction"][
-                    "children"
-                ][f"st{k}"] = {**base, "title": f"{k}C", "default": v}
-            out["tdp"]["qam"]["children"]["fan"]["modes"]["manual_junction"][
-                "children"
-            ]["reset"] = reset
+            modes = _edit(children, "fan", "modes")
+            base = modes["manual_edge"]["children"]["st40"]
+            for mode, curve in (
+                ("manual_edge", DEFAULT_EDGE),
+                ("manual_junction", DEFAULT_TCTL),
+            ):
+                mchildren = _edit(modes, mode, "children")
+                reset = mchildren.pop("reset")
+                for k, v in curve.items():
+                    mchildren[f"st{k}"] = {**base, "title": f"{k}C", "default": v}
+                mchildren["reset"] = reset
 
         return out
 
@@ -153,8 +243,16 @@ class SmuQamPlugin(HHDPlugin):
         context: Context,
     ):
         self.emit = emit
+        self.wake = wake_hhd(emit)
         self.fan_info = get_fan_info()
 
+        from adjustor.fuse.utils import find_igpu
+
+        try:
+            self.power_source = find_power_source(find_igpu())
+        except Exception as e:
+            logger.warning(f"Could not find power sensor:\n{e}")
+
     def update(self, conf: Config):
         self.enabled = conf["hhd.settings.tdp_enable"].to(bool)
         self.enforce_limits = conf["hhd.settings.enforce_limits"].to(bool)
@@ -162,7 +260,6 @@ class SmuQamPlugin(HHDPlugin):
             self.startup = self.init_tdp
             return
 
-        curr = time.time()
         sys_tdp = False
         if self.new_tdp:
             new_tdp = self.new_tdp
@@ -198,43 +295,35 @@ class SmuQamPlugin(HHDPlugin):
         if changed and not sys_tdp:
             self.sys_tdp = False
 
-        if self.startup or changed:
-            self.queued = curr + APPLY_DELAY
+        restore = self._update_governor(conf)
+        if self.startup or changed or restore:
+            self.sched.schedule("smu_apply", APPLY_DELAY, self.wake)
+            self.trace_start = time.perf_counter()
             self.is_set = False
 
+            preset = self.get_preset(new_tdp)
             conf["tdp.smu.std.skin_limit"] = new_tdp
             conf["tdp.smu.std.stapm_limit"] = new_tdp
 
-            if self.pp_map and conf["tdp.smu.platform_profile"].to(str) != "disabled":
-                pp = self.pp_map[0][0]
-                for npp, tdp in self.pp_map:
-                    if tdp < new_tdp and npp in self.pps:
-                        pp = npp
-                conf["tdp.smu.platform_profile"] = pp
-
-            if self.energy_map:
-                ep = self.energy_map[0][0]
-                for nep, tdp in self.energy_map:
-                    if tdp < new_tdp:
-                        ep = nep
-                conf["tdp.smu.energy_policy"] = ep
-
-            if new_boost:
-                try:
-                    fmax = self.dev["fast_limit"].smax
-                    smax = self.dev["stapm_limit"].smax
-                    assert fmax and smax
-
-                    conf["tdp.smu.std.fast_limit"] = int(new_tdp * (fmax / smax))
-                    conf["tdp.smu.std.slow_limit"] = min(
-                        new_tdp + 2, conf["tdp.smu.std.fast_limit"].to(int)
-                    )
-                except Exception as e:
-                    logger.error(f"Setting boost failed with error:\n{e}")
-                    conf["tdp.qam.boost"] = False
-            else:
-                conf["tdp.smu.std.slow_limit"] = new_tdp
-                conf["tdp.smu.std.fast_limit"] = new_tdp
+            if (
+                preset.platform_profile
+                and conf["tdp.smu.platform_profile"].to(str) != "disabled"
+            ):
+                conf["tdp.smu.platform_profile"] = preset.platform_profile
+
+            if preset.energy_policy:
+                conf["tdp.smu.energy_policy"] = preset.energy_policy
+
+            if new_boost and not preset.boost:
+                logger.error(f"Device does not have the limits required for boost.")
+                conf["tdp.qam.boost"] = False
+            slow, fast = preset.boost if new_boost and preset.boost else preset.no_boost
+            conf["tdp.smu.std.slow_limit"] = slow
+            conf["tdp.smu.std.fast_limit"] = fast
+
+            # Keep the sustained limits of the governor
+            if self.gov_limit:
+                self._set_sustained(conf, self.gov_limit)
 
         # Show steam message
         if self.sys_tdp:
@@ -242,11 +331,19 @@ class SmuQamPlugin(HHDPlugin):
         else:
             conf["tdp.qam.sys_tdp"] = ""
 
-        if self.startup or (self.queued and self.queued < curr):
+        queued = self.sched.pop("smu_apply")
+        if self.startup or queued:
             self.startup = False
-            self.queued = None
+            self.sched.cancel("smu_apply")
             conf["tdp.smu.apply"] = True
 
+            if self.trace and self.trace_start:
+                tracer.record(
+                    "qam.debounce", self.trace_start, time.perf_counter(), self.trace
+                )
+                tracer.handoff("smu_apply", self.trace)
+            self.trace = None
+
         self.old_tdp = new_tdp
         self.old_boost = new_boost
 
@@ -309,6 +406,15 @@ class SmuQamPlugin(HHDPlugin):
                 self.sys_tdp = True
                 self.new_tdp = ev["tdp"]
                 self.sys_tdp = ev["tdp"] is not None
+                self.trace = ev.get("trace", None)
+                if self.trace:
+                    # Time spent in the hhd event loop
+                    tracer.record(
+                        "hhd.dispatch",
+                        ev["trace_t"],  # type: ignore
+                        time.perf_counter(),
+                        self.trace,
+                    )
 
             if ev["type"] == "ppd":
                 # TODO: Make tunable per device
@@ -320,13 +426,90 @@ class SmuQamPlugin(HHDPlugin):
                     case "performance":
                         self.new_tdp = 25
 
-            if ev["type"] == "special" and ev.get("event", None) == "wakeup":
-                logger.info(
-                    f"Waking up from sleep, resetting TDP after {SLEEP_DELAY} seconds."
-                )
-                self.queued = time.time() + SLEEP_DELAY
+    def _set_sustained(self, conf: Config, limit: int):
+        conf["tdp.smu.std.skin_limit"] = limit
+        conf["tdp.smu.std.stapm_limit"] = limit
+        conf["tdp.smu.std.slow_limit"] = min(
+            limit + 2 if conf["tdp.qam.boost"].to(bool) else limit,
+            max(limit, conf["tdp.smu.std.fast_limit"].to(int)),
+        )
+
+    def _stop_governor(self):
+        if self.sampler:
+            self.sampler.close()
+            self.sampler = None
+        self.governor = None
+        self.gov_target = None
+        self.sched.cancel("smu_governor")
+
+    def _update_governor(self, conf: Config) -> bool:
+        """Steps the power target governor. Returns True when the governor
+        was disabled and the limits of the slider should be restored."""
+        enabled = (
+            self.power_source
+            and self.lims
+            and conf.get("tdp.qam.governor.mode", "disabled") == "enabled"
+        )
+        if not enabled:
+            if self.governor:
+                self._stop_governor()
+            if self.gov_limit:
+                # Return to the limits of the slider
+                self.gov_limit = None
+                return True
+            return False
+
+        assert self.lims and self.power_source
+        target = conf["tdp.qam.governor.enabled.target"].to(int)
+        # Follows hhd.settings.enforce_limits
+        if self.enforce_limits:
+            lo, hi = self.lims.smin or 0, self.lims.smax or target
+        else:
+            lo, hi = self.lims.min or 0, self.lims.max or target
+        if self.governor:
+            self.governor.set_bounds(lo, hi)
+            if self.gov_limit and not lo <= self.gov_limit <= hi:
+                # Do not wait for the next step to respect the new bounds
+                self.gov_limit = int(min(max(self.gov_limit, lo), hi))
+                self._set_sustained(conf, self.gov_limit)
+                conf["tdp.smu.apply"] = True
+        else:
+            self.governor = PIGovernor(lo, hi)
+            self.sampler = PowerSampler(
+                self.power_source, GOVERNOR_RATE, window=GOVERNOR_PERIOD
+            )
+            try:
+                self.sampler.start()
+            except Exception as e:
+                logger.error(f"Failed to start power sampler:\n{e}")
+                self._stop_governor()
+                return False
+            self.sched.schedule("smu_governor", GOVERNOR_PERIOD, self.wake)
+        if target != self.gov_target:
+            self.gov_target = target
+            self.governor.reset()
+
+        if not self.sched.pop("smu_governor"):
+            return False
+        self.sched.schedule("smu_governor", GOVERNOR_PERIOD, self.wake)
+
+        assert self.sampler
+        stats = self.sampler.stats()
+        if not stats:
+            return False
+        limit = int(round(self.governor.step(target, stats["mean"], GOVERNOR_PERIOD)))
+        conf["tdp.qam.governor.enabled.info"] = (
+            f"{stats['mean']:.1f}W (p95 {stats['p95']:.1f}W) @ {limit}W"
+        )
+        if limit != self.gov_limit:
+            self.gov_limit = limit
+            self._set_sustained(conf, limit)
+            conf["tdp.smu.apply"] = True
+        return False
 
     def close(self):
+        self.sched.cancel("smu_apply")
+        self._stop_governor()
         if self.fan_t:
             self.fan_should_exit.set()
             self.fan_t.join()
@@ -343,6 +526,7 @@ class SmuDriverPlugin(HHDPlugin):
         platform_profile: bool = True,
     ) -> None:
         self.name = f"adjustor_smu"
+        self.trees = {}
         self.priority = 9
         self.log = "asmu"
         self.enabled = False
@@ -358,6 +542,12 @@ class SmuDriverPlugin(HHDPlugin):
         self.old_pp = None
         self.old_vals = {}
         self.is_set = False
+        self.watch = ConfigWatch(("tdp.smu.std", "tdp.smu.adv"))
+        self.sampler = None
+        self.diverged = False
+        self.wake = None
+        self.snapshot = Snapshot("smu")
+        self.planner = Planner(cpu, dev, pp_delay=PP_DELAY)
 
         for k in dev:
             assert (
@@ -369,50 +559,40 @@ class SmuDriverPlugin(HHDPlugin):
             self.initialized = False
             return {}
         self.initialized = True
-        out = {
-            "tdp": {
-                "smu": load_relative_yaml("smu.yml"),
-            }
-        }
 
         # Limit platform profile choices or remove
-        choices = get_platform_choices()
-        if choices and self.check_pp:
-            options = out["tdp"]["smu"]["children"]["platform_profile"]["options"]
+        choices = get_caps().get("platform_choices", get_platform_choices)
+        self.has_pp = bool(choices and self.check_pp)
+        key = tuple(choices) if self.has_pp and choices else None
+        tree = self.trees.get(key, None)
+        if tree is None:
+            # Shared between calls, so it is not modified after this
+            tree = self.trees[key] = self._build_settings(choices)
+        return {"tdp": {"smu": tree}}
+
+    def _build_settings(self, choices: Sequence[str] | None):
+        out = dict(_load_template("smu.yml"))
+        children = _edit(out, "children")
+
+        if self.has_pp and choices:
+            options = _edit(children, "platform_profile", "options")
             for c in list(options):
                 if c not in choices and c != "disabled":
                     del options[c]
-            self.has_pp = True
         else:
-            del out["tdp"]["smu"]["children"]["platform_profile"]
-            self.has_pp = False
+            del children["platform_profile"]
 
         # Remove unsupported instructions
-        # Add absolute limits based on CPU
-        std = out["tdp"]["smu"]["children"]["std"]["children"]
+        # Add absolute limits based on CPU and sane defaults based on device
+        std = _edit(children, "std", "children")
         for k in list(std):
-            if k in self.cpu:
-                lims = self.cpu[k]
-                std[k].update({"min": lims.min, "max": lims.max})
-            else:
-                del std[k]
-        adv = out["tdp"]["smu"]["children"]["std"]["children"]
-        for k in list(adv):
             if k in self.cpu and k != "enable":
                 lims = self.cpu[k]
-                std[k].update({"min": lims.min, "max": lims.max})
+                std[k] = {**std[k], "min": lims.min, "max": lims.max}
+                if k in self.dev:
+                    std[k]["default"] = self.dev[k].default
             else:
-                del adv[k]
-
-        # Set sane defaults based on device
-        std = out["tdp"]["smu"]["children"]["std"]["children"]
-        for k in list(std):
-            if k in self.dev:
-                std[k]["default"] = self.dev[k].default
-        adv = out["tdp"]["smu"]["children"]["std"]["children"]
-        for k in list(adv):
-            if k in self.dev and k != "enable":
-                adv[k]["default"] = self.dev[k].default
+                del std[k]
 
         return out
 
@@ -422,39 +602,76 @@ class SmuDriverPlugin(HHDPlugin):
         context: Context,
     ):
         self.emit = emit
+        self.wake = wake_hhd(emit)
+
+        rate = os.environ.get("HHD_ADJ_POWER_RATE", None)
+        if rate:
+            from adjustor.fuse.utils import find_igpu
+
+            try:
+                source = find_power_source(find_igpu())
+                if source:
+                    self.sampler = PowerSampler(
+                        source, float(rate), on_diverge=self._on_diverge
+                    )
+                    self.sampler.start()
+                else:
+                    logger.warning("No power sensor found, not sampling power.")
+            except Exception as e:
+                logger.error(f"Failed to start power sampler:\n{e}")
+                self.sampler = None
+
+    def notify(self, events: Sequence[Event]):
+        for ev in events:
+            if ev["type"] == "special" and ev.get("event", None) == "wakeup":
+                logger.info("Waking up from sleep, verifying TDP.")
+                self.snapshot.wakeup(self.wake)
+
+    def _replay_pp(self, pp: str):
+        ok = set_platform_profile(pp)
+        time.sleep(PP_DELAY)
+        return ok
+
+    def _on_diverge(self, measured: float, limit: float):
+        # Runs on the sampler thread
+        self.diverged = True
+        if self.wake:
+            self.wake()
 
     def update(self, conf: Config):
         self.enabled = conf["hhd.settings.tdp_enable"].to(bool)
-        self.enforce_limits = conf["hhd.settings.enforce_limits"].to(bool)
+        enforce_limits = conf["hhd.settings.enforce_limits"].to(bool)
+        if enforce_limits != self.enforce_limits:
+            self.watch.reset()
+        self.enforce_limits = enforce_limits
         if not self.enabled or not self.initialized:
+            self.watch.reset()
             return
 
+        # Only changed keys are checked against the device limits
+        changed = self.watch.changed(conf)
         if self.enforce_limits:
-            for k, v in conf["tdp.smu.std"].to(dict).items():
-                if k in self.dev:
-                    mmin, mmax = self.dev[k].smin, self.dev[k].smax
-                    if v < mmin:
-                        conf["tdp.smu.std", k] = mmin
-                    if v > mmax:
-                        conf["tdp.smu.std", k] = mmax
-            for k, v in conf["tdp.smu.adv"].to(dict).items():
+            for (path, k), v in changed.items():
                 if k in self.dev and k != "enable":
                     mmin, mmax = self.dev[k].smin, self.dev[k].smax
                     if v < mmin:
-                        conf["tdp.smu.adv", k] = mmin
+                        conf[path, k] = mmin
                     if v > mmax:
-                        conf["tdp.smu.adv", k] = mmax
-
-        new_vals = {}
-        for k, v in conf["tdp.smu.std"].to(dict[str, int]).items():
-            new_vals[k] = v
-        if conf["tdp.smu.adv.enable"].to(bool):
-            for k, v in conf["tdp.smu.adv"].to(dict[str, int]).items():
-                if k != "enable":
-                    new_vals[k] = v
-
-        if set(new_vals.items()) != set(self.old_vals.items()):
-            self.is_set = False
+                        conf[path, k] = mmax
+
+        if changed:
+            new_vals = {}
+            for k, v in conf["tdp.smu.std"].to(dict[str, int]).items():
+                new_vals[k] = v
+            if conf["tdp.smu.adv.enable"].to(bool):
+                for k, v in conf["tdp.smu.adv"].to(dict[str, int]).items():
+                    if k != "enable":
+                        new_vals[k] = v
+
+            if new_vals != self.old_vals:
+                self.is_set = False
+        else:
+            new_vals = self.old_vals
 
         if self.has_pp:
             new_pp = conf["tdp.smu.platform_profile"].to(str)
@@ -462,27 +679,72 @@ class SmuDriverPlugin(HHDPlugin):
                 self.is_set = False
             self.old_pp = new_pp
 
+        if self.snapshot.due():
+            self.snapshot.restore()
+            if self.sampler:
+                # Start a new window, power before resume does not count
+                self.sampler.set_limit(self.sampler.limit)
+
+        if self.diverged:
+            self.diverged = False
+            if self.is_set:
+                logger.warning("Firmware may have reset the TDP limits, reapplying.")
+                conf["tdp.smu.apply"] = True
+
         if conf["tdp.smu.apply"].to(bool):
             conf["tdp.smu.apply"] = False
 
-            if self.has_pp:
-                cpp = conf["tdp.smu.platform_profile"].to(str)
+            with tracer.span("smu.apply", tracer.take("smu_apply")):
+                desired: dict = {"tdp": new_vals}
+                cpp = "disabled"
+                if self.has_pp:
+                    cpp = conf["tdp.smu.platform_profile"].to(str)
+                    if cpp != "disabled":
+                        desired["platform_profile"] = cpp
+
+                new_target = conf["tdp.smu.energy_policy"].to(str)
+                if new_target != self.old_target:
+                    self.old_target = new_target
+                    self.emit({"type": "energy", "status": new_target})  # type: ignore
+
+                self.planner.limit = "device" if self.enforce_limits else "cpu"
+                # The platform profile is only written if it changed, which
+                # skips its delay. ALIB can not be read, so it is always sent.
+                ret = "tdp" not in execute(self.planner.plan(desired))
+
                 if cpp != "disabled":
-                    set_platform_profile(cpp)
-                    time.sleep(PP_DELAY)
-
-            new_target = conf["tdp.smu.energy_policy"].to(str)
-            if new_target != self.old_target:
-                self.old_target = new_target
-                self.emit({"type": "energy", "status": new_target})  # type: ignore
-
-            alib(
-                new_vals,
-                self.cpu,
-                limit="device" if self.enforce_limits else "cpu",
-                dev=self.dev,
-            )
+                    # Firmware may reset the limits with the profile
+                    self.snapshot.record(
+                        "platform_profile",
+                        cpp,
+                        partial(self._replay_pp, cpp),
+                        get_platform_profile,
+                        resets=("alib",),
+                    )
+                else:
+                    # Left to the user or firmware, so not restored on resume
+                    self.snapshot.forget("platform_profile")
+            if ret:
+                # Limits can not be read back, so they are replayed on resume
+                self.snapshot.record(
+                    "alib",
+                    new_vals,
+                    partial(
+                        alib,
+                        new_vals,
+                        self.cpu,
+                        limit=self.planner.limit,
+                        dev=self.dev,
+                    ),
+                )
+            else:
+                # Do not replay stale limits on resume
+                self.snapshot.forget("alib")
             self.is_set = True
+            if self.sampler and ret:
+                self.sampler.set_limit(
+                    new_vals.get("stapm_limit", new_vals.get("skin_limit", None))
+                )
 
         self.old_vals = new_vals
         if self.is_set:
@@ -491,4 +753,7 @@ class SmuDriverPlugin(HHDPlugin):
             conf["tdp.smu.status"] = "Not Set"
 
     def close(self):
-        pass
+        self.snapshot.close()
+        if self.sampler:
+            self.sampler.close()
+            self.sampler = None
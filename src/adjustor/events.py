@@ -1,11 +1,14 @@
 import logging
 import select
+import time
 from threading import Event as TEvent
 from typing import Any, Sequence
 
 from hhd.plugins import Emitter, Event
 from pyroute2 import AcpiEventSocket  # type: ignore
 
+from .core.schedule import WAKE_EVENT
+
 logger = logging.getLogger(__name__)
 
 EVENT_MATCHES: Sequence[tuple[dict[str, Any], str]] = [
@@ -20,38 +23,99 @@ EVENT_MATCHES: Sequence[tuple[dict[str, Any], str]] = [
     # , 'type': 0xf100, 'data': 0x0100 ignore these attrs for now...
     ({"device_class": b"thermal_zone", "bus_id": b"LNXTHERM:00"}, "hibernate-thermal"),
 ]
+# Wake events of the scheduler must not be mistaken for real ones
+assert WAKE_EVENT not in (etype for _, etype in EVENT_MATCHES), WAKE_EVENT
+
+IGNORED_EVENTS = ("battery", "powerbutton")
+AC_EVENTS = ("ac", "dc")
 
+# Only used if no wakeup fd is provided
 GUARD_DELAY = 0.5
+# Chargers bounce when plugged in, only send the state they settle at
+AC_DEBOUNCE = 0.3
+
+MatchIndex = tuple[
+    dict[bytes, list[tuple[int, dict[str, Any], str]]],
+    dict[bytes, list[tuple[int, dict[str, Any], str]]],
+]
+
+
+def compile_matches(matches: Sequence[tuple[dict[str, Any], str]]) -> MatchIndex:
+    """Indexes matches by device class, or by bus id for the matches that do not
+    have one. The position of each match is kept so the first one still wins."""
+    by_class = {}
+    by_bus = {}
+    for i, (match, etype) in enumerate(matches):
+        rest = dict(match)
+        if "device_class" in rest:
+            by_class.setdefault(rest.pop("device_class"), []).append((i, rest, etype))
+        else:
+            by_bus.setdefault(rest.pop("bus_id"), []).append((i, rest, etype))
+    return by_class, by_bus
 
 
-def loop_process_events(emit: Emitter, should_exit: TEvent):
+def match_event(ev: dict[str, Any], index: MatchIndex) -> str | None:
+    by_class, by_bus = index
+    found = None
+    for candidates in (
+        by_class.get(ev.get("device_class", None), ()),  # type: ignore
+        by_bus.get(ev.get("bus_id", None), ()),  # type: ignore
+    ):
+        for i, rest, etype in candidates:
+            if found and found[0] < i:
+                break
+            if all(k in ev and ev[k] == v for k, v in rest.items()):
+                found = (i, etype)
+                break
+    return found[1] if found else None
+
+
+def loop_process_events(emit: Emitter, should_exit: TEvent, wake_fd: int | None = None):
     acpi = AcpiEventSocket()
+    index = compile_matches(EVENT_MATCHES)
     logger.info(f"Starting ACPI Event handler.")
 
+    # FIXME: Uses unofficial API, find the correct way.
+    fds = [acpi._sock.fileno()]
+    if wake_fd is not None:
+        fds.append(wake_fd)
+
+    ac_state = None
+    ac_pending = None
+    ac_deadline = None
+
     while not should_exit.is_set():
-        # FIXME: Uses unofficial API, find the correct way.
-        r, _, _ = select.select([acpi._sock.fileno()], [], [], GUARD_DELAY)
+        if ac_deadline is not None:
+            timeout = max(ac_deadline - time.perf_counter(), 0)
+        elif wake_fd is not None:
+            timeout = None
+        else:
+            timeout = GUARD_DELAY
+        r, _, _ = select.select(fds, [], [], timeout)
 
-        if r:
+        events: list[Event] = []
+        if fds[0] in r:
             for message in acpi.get():
                 ev = message.get("ACPI_GENL_ATTR_EVENT", None)
 
                 if not ev:
                     continue
 
-                found = False
-                for match, etype in EVENT_MATCHES:
-                    matches = True
-                    for k, v in match.items():
-                        if k not in ev or ev[k] != v:
-                            matches = False
-                            break
-
-                    if matches:
-                        if etype not in ("battery", "powerbutton"):
-                            emit({"type": "acpi", "event": etype})  # type: ignore
-                        found = True
-                        break
-
-                if not found:
+                etype = match_event(ev, index)
+                if not etype:
                     logger.info(f"ACPI event: {ev}")
+                elif etype in AC_EVENTS:
+                    ac_pending = etype
+                    ac_deadline = time.perf_counter() + AC_DEBOUNCE
+                elif etype not in IGNORED_EVENTS:
+                    events.append({"type": "acpi", "event": etype})  # type: ignore
+
+        if ac_deadline is not None and time.perf_counter() >= ac_deadline:
+            if ac_pending != ac_state:
+                ac_state = ac_pending
+                events.append({"type": "acpi", "event": ac_state})  # type: ignore
+            ac_pending = None
+            ac_deadline = None
+
+        if events:
+            emit(events)
@@ -17,10 +17,13 @@
 #
 # The following commands are supported:
 # "cmd:get:<name>\n"
-# "cmd:set:<name>:<val>\n"
+# "cmd:set:<name>:<val>:<write_id>:<write_t>\n"
 #
 # The get command will return the current value of the attribute ("ack:<value>\n").
 # The set command will set the value of the attribute and just ack ("ack\n").
+# For tracing, set commands carry a per-process write id and the time the write
+# was released (`time.perf_counter()`, which is CLOCK_MONOTONIC on Linux and
+# therefore shared with hhd).
 
 from __future__ import print_function
 
@@ -29,8 +32,10 @@ import io
 import os
 import socket
 import sys
+import time
 from errno import *  # type: ignore
 from stat import *  # type: ignore
+from itertools import count
 from threading import Lock
 
 import fuse
@@ -40,6 +45,7 @@ FUSE_MOUNT_DIR = "/run/hhd-tdp/"
 FUSE_MOUNT_SOCKET = "/run/hhd-tdp/socket"
 TIMEOUT = 1
 PACK_SIZE = 1024
+WRITE_IDS = count(1)
 fuse.fuse_python_api = (0, 2)
 
 
@@ -284,6 +290,7 @@ class XmpFile:
             return os.pwrite(self.fd, buf, offset)
 
     def release(self, flags):
+        start = time.perf_counter()
         try:
             if self.virtual and self.wrote:
                 # Send file contents to hhd
@@ -299,6 +306,8 @@ class XmpFile:
                 contents = self.file.read()
                 if b"\0" in contents:
                     contents = contents[: contents.index(b"\0")]
+                contents = contents.strip()
+                contents += f":{next(WRITE_IDS)}:{start}".encode()
                 if len(contents) + len(cmd) + 1 > PACK_SIZE:
                     raise ValueError(f"Contents too large to send:\n{contents}")
                 stcmd = (
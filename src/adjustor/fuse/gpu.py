@@ -3,9 +3,19 @@ import os
 from typing import Literal, NamedTuple
 from typing import Sequence
 
+from adjustor.core.metrics import counter, gauge, stateset
 from adjustor.fuse.utils import find_igpu
 
 logger = logging.getLogger(__name__)
+
+SYSFS_WRITES = counter("adjustor_sysfs_writes", "Writes to sysfs attributes.")
+GPU_MODE = stateset("adjustor_gpu_mode", "Applied GPU performance level.")
+GPU_CLOCK = gauge("adjustor_gpu_clock_mhz", "Applied GPU clock range.", "mhz")
+CPU_BOOST = gauge("adjustor_cpu_boost", "Whether CPU boost is enabled.")
+CPU_EPP = stateset(
+    "adjustor_cpu_epp", "Applied CPU energy performance preference."
+)
+CPU_GOVERNOR = stateset("adjustor_cpu_governor", "Applied CPU governor.")
 GPU_FREQUENCY_PATH = "device/pp_od_clk_voltage"
 GPU_LEVEL_PATH = "device/power_dpm_force_performance_level"
 CPU_BOOST_PATH = "/sys/devices/system/cpu/amd_pstate/cpb_boost"
@@ -103,6 +113,43 @@ def get_igpu_status():
     return None
 
 
+def get_gpu_freq_range():
+    """Returns the clock range the GPU supports, which is fixed for a device."""
+    status = get_igpu_status()
+    if not status:
+        return None
+    return status.freq_min, status.freq_max
+
+
+def get_epp_avail() -> Sequence[EppStatus] | None:
+    if not is_in_cpu0(EPP_AVAILABLE_FN):
+        return None
+    avail = read_from_cpu0(EPP_AVAILABLE_FN).split()
+    return [p for p in avail if p in EPP_MODES]  # type: ignore
+
+
+def get_gpu_clock():
+    """Returns the performance level and, in manual mode, the clock range
+    set through OD_SCLK."""
+    hwmon = find_igpu()
+    if not hwmon:
+        return None
+    with open(os.path.join(hwmon, GPU_LEVEL_PATH), "r") as f:
+        level = f.read().strip()
+    if level != "manual":
+        return level, None
+
+    freqs = {}
+    with open(os.path.join(hwmon, GPU_FREQUENCY_PATH), "r") as f:
+        in_sclk = False
+        for line in f.readlines():
+            if line.startswith("OD_"):
+                in_sclk = line.startswith("OD_SCLK")
+            elif in_sclk and line[:2] in ("0:", "1:"):
+                freqs[line[0]] = int(line.split()[1].lower().replace("mhz", ""))
+    return level, (freqs.get("0", None), freqs.get("1", None))
+
+
 def set_gpu_auto():
     logger.info("Setting GPU mode to 'auto'.")
     hwmon = find_igpu()
@@ -110,6 +157,9 @@ def set_gpu_auto():
         return None
     with open(os.path.join(hwmon, GPU_LEVEL_PATH), "w") as f:
         f.write("auto")
+    SYSFS_WRITES.inc(attr=GPU_LEVEL_PATH)
+    GPU_MODE.set("auto")
+    GPU_CLOCK.clear()
 
 
 def set_gpu_manual(min_freq: int, max_freq: int | None = None):
@@ -126,6 +176,11 @@ def set_gpu_manual(min_freq: int, max_freq: int | None = None):
     for cmd in [f"s 0 {min_freq}\n", f"s 1 {max_freq}\n", f"c\n"]:
         with open(os.path.join(hwmon, GPU_FREQUENCY_PATH), "w") as f:
             f.write(cmd)
+    SYSFS_WRITES.inc(attr=GPU_LEVEL_PATH)
+    SYSFS_WRITES.inc(3, attr=GPU_FREQUENCY_PATH)
+    GPU_MODE.set("manual")
+    GPU_CLOCK.set(min_freq, bound="min")
+    GPU_CLOCK.set(max_freq, bound="max")
 
 
 def read_from_cpu0(fn: str):
@@ -148,6 +203,16 @@ def set_per_cpu(fn: str, value: str):
             continue
         with open(os.path.join(CPU_PATH, dir, fn), "w") as f:
             f.write(value)
+        SYSFS_WRITES.inc(attr=fn)
+
+
+def get_cpu_boost():
+    if os.path.exists(CPU_BOOST_PATH):
+        with open(CPU_BOOST_PATH, "r") as f:
+            return f.read().strip() in ("1", "enabled")
+    elif is_in_cpu0(BOOST_FN):
+        return read_from_cpu0(BOOST_FN) == "1"
+    return None
 
 
 def set_cpu_boost(enable: bool):
@@ -161,22 +226,31 @@ def set_cpu_boost(enable: bool):
                 f.write("enabled" if enable else "disabled")
     elif is_in_cpu0(BOOST_FN):
         set_per_cpu(BOOST_FN, "1" if enable else "0")
+    else:
+        return
+    CPU_BOOST.set(int(enable))
 
 
 def set_epp_mode(mode: EppStatus):
     logger.info(f"Setting EPP mode to '{mode}'.")
     set_per_cpu(EPP_FN, mode)
+    CPU_EPP.set(mode)
 
 
 def set_powersave_governor():
     logger.info("Setting CPU governor to 'powersave'.")
     set_per_cpu(GOVERNOR_FN, "powersave")
+    CPU_GOVERNOR.set("powersave")
 
 
 def can_use_nonlinear():
     return is_in_cpu0(CPU_FREQ_NONLINEAR_MIN_FN)
 
 
+def get_frequency_scaling():
+    return read_from_cpu0(CPU_FREQ_MIN_FN), read_from_cpu0(CPU_FREQ_MAX_FN)
+
+
 def set_frequency_scaling(nonlinear: bool):
     if nonlinear:
         min_freq = read_from_cpu0(CPU_FREQ_NONLINEAR_MIN_FN)
@@ -4,8 +4,18 @@ import sys
 import time
 from threading import Event, Thread
 
+from adjustor.core.metrics import counter, histogram
+from adjustor.core.trace import tracer
+
 logger = logging.getLogger(__name__)
 
+FUSE_REQUESTS = counter("adjustor_fuse_requests", "Requests received from the FUSE mount.")
+FUSE_DURATION = histogram(
+    "adjustor_fuse_request_duration_seconds",
+    "Time spent handling FUSE mount requests.",
+    "seconds",
+)
+
 TDP_MOUNT = "/run/hhd-tdp/hwmon"
 FUSE_MOUNT_SOCKET = "/run/hhd-tdp/socket"
 
@@ -124,12 +134,27 @@ def _tdp_client(should_exit: Event, set_tdp, min_tdp, default_tdp, max_tdp):
             default_tdp = 0
             if not data or not data.startswith(b"cmd:"):
                 continue
+            start = time.perf_counter()
+            kind = "set" if b"set" in data else "get"
             if b"set" in data and b"power1_cap" in data:
                 try:
-                    tdp = int(int(data.split(b"\0")[0].split(b":")[-1]) / 1_000_000)
+                    # cmd:set:<name>:<val>:<write_id>:<write_t>
+                    args = data.split(b"\0")[0].strip().split(b":")
+                    tdp = int(int(args[3]) / 1_000_000)
                     if tdp:
                         logger.info(f"Received TDP value {tdp} from /sys.")
-                        set_tdp(tdp)
+                        trace = tracer.new_trace()
+                        if len(args) > 5:
+                            # Starts at the slider write, in the FUSE process
+                            tracer.record(
+                                "fuse.write",
+                                float(args[5]),
+                                start,
+                                trace,
+                                write=int(args[4]),
+                            )
+                        tracer.record("fuse.recv", start, time.perf_counter(), trace)
+                        set_tdp(tdp, trace)
                     else:
                         logger.info(
                             "Received TDP value 0 from /sys. Assuming its the default value and ignoring."
@@ -152,6 +177,8 @@ def _tdp_client(should_exit: Event, set_tdp, min_tdp, default_tdp, max_tdp):
                     send_cmd(b"ack:" + str(tdp).encode() + b"000000\n")
             else:
                 send_cmd(b"ack\n")
+            FUSE_REQUESTS.inc(cmd=kind)
+            FUSE_DURATION.observe(time.perf_counter() - start, cmd=kind)
             time.sleep(CLIENT_MAX_CMD_T)
     except Exception as e:
         logger.error(f"Error while communicating with FUSE server. Exiting.\n{e}")
@@ -163,7 +190,15 @@ def _tdp_client(should_exit: Event, set_tdp, min_tdp, default_tdp, max_tdp):
 def start_tdp_client(
     should_exit: Event, emit, min_tdp: int, default_tdp: int, max_tdp: int
 ):
-    set_tdp = lambda tdp: emit and emit({"type": "tdp", "tdp": tdp})
+    def set_tdp(tdp, trace=None):
+        if not emit:
+            return
+        ev = {"type": "tdp", "tdp": tdp}
+        if trace:
+            # Lets the plugins continue the trace of this value
+            ev["trace"] = trace
+            ev["trace_t"] = time.perf_counter()
+        emit(ev)
 
     logger.info(f"Starting TDP client on socket:\n'{FUSE_MOUNT_SOCKET}'")
     t = Thread(
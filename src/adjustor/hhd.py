@@ -10,12 +10,14 @@ from hhd.plugins.plugin import Emitter
 from hhd.utils import expanduser
 
 from adjustor.core.acpi import check_perms, initialize
-from adjustor.core.const import CPU_DATA, DEV_DATA, PLATFORM_PROFILE_MAP, ENERGY_MAP
+from adjustor.core.const import DEV_DATA, PLATFORM_PROFILE_MAP, ENERGY_MAP
 
 from .i18n import _
 
 logger = logging.getLogger(__name__)
 
+APP_PROFILES = "~/.config/hhd/adjustor/apps.yml"
+
 CONFLICTING_PLUGINS = {
     "SimpleDeckyTDP": "~/homebrew/plugins/SimpleDeckyTDP",
     "PowerControl": "~/homebrew/plugins/PowerControl",
@@ -151,7 +153,9 @@ class AdjustorPlugin(HHDPlugin):
 
         self.t = None
         self.t_sys = None
+        self.t_metrics = None
         self.should_exit = None
+        self.wake_fd = None
 
         self.min_tdp = min_tdp
         self.default_tdp = default_tdp
@@ -171,8 +175,10 @@ class AdjustorPlugin(HHDPlugin):
             try:
                 from .events import loop_process_events
 
+                self.wake_fd = os.eventfd(0)
                 self.t = Thread(
-                    target=loop_process_events, args=(self.emit, self.should_exit)
+                    target=loop_process_events,
+                    args=(self.emit, self.should_exit, self.wake_fd),
                 )
                 self.t.start()
             except Exception as e:
@@ -180,6 +186,14 @@ class AdjustorPlugin(HHDPlugin):
                     f"Could not init ACPI event handling. Is pyroute2 installed?"
                 )
 
+        metrics = os.environ.get("HHD_ADJ_METRICS", None)
+        if metrics and not self.t_metrics:
+            from .core.metrics import METRICS_SOCKET, start_metrics_server
+
+            self.t_metrics = start_metrics_server(
+                metrics if metrics.startswith("/") else METRICS_SOCKET
+            )
+
         if self.fuse_mount and not self.t_sys:
             logger.info("Starting FUSE mount for /sys.")
             from .fuse import prepare_tdp_mount, start_tdp_client
@@ -198,12 +212,20 @@ class AdjustorPlugin(HHDPlugin):
         if not self.should_exit:
             return
         self.should_exit.set()
+        if self.wake_fd is not None:
+            os.eventfd_write(self.wake_fd, 1)
         if self.t:
             self.t.join()
             self.t = None
+        if self.wake_fd is not None:
+            os.close(self.wake_fd)
+            self.wake_fd = None
         if self.t_sys:
             self.t_sys.join()
             self.t_sys = None
+        if self.t_metrics:
+            self.t_metrics.close()
+            self.t_metrics = None
         self.should_exit = None
 
     def open(
@@ -230,24 +252,107 @@ class AdjustorPlugin(HHDPlugin):
     def close(self):
         self._stop()
 
+        from .core.acpi import log_call_stats
+        from .core.trace import tracer
+
+        tracer.export()
+        log_call_stats()
+
+
+class AppProfilePlugin(HHDPlugin):
+    """Applies per-application profiles while a matching process runs, by
+    setting the config keys of the other plugins and restoring them when the
+    process exits. Profiles are read from APP_PROFILES (or HHD_ADJ_APPS)."""
+
+    def __init__(self, driver: str | None) -> None:
+        self.name = f"adjustor_apps"
+        # Run before the drivers, so they see the profile values
+        self.priority = 4
+        self.log = "aapp"
+        self.driver = driver
+        self.tracker = None
+        self.current = None
+        self.saved = {}
+
+    def settings(self):
+        return {}
+
+    def open(self, emit: Emitter, context: Context):
+        fn = os.environ.get("HHD_ADJ_APPS", None) or expanduser(APP_PROFILES, context)
+        if not os.path.exists(fn):
+            return
+
+        from .core.apps import AppTracker, load_profiles
+        from .core.schedule import wake_hhd
+
+        try:
+            profiles = load_profiles(fn, self.driver)
+            if not profiles:
+                return
+            logger.info(f"Loaded {len(profiles)} app profiles from:\n'{fn}'")
+            self.tracker = AppTracker(profiles, wake_hhd(emit))
+            self.tracker.start()
+        except Exception as e:
+            logger.error(f"Could not start app profiles:\n{e}")
+            self.tracker = None
+
+    def update(self, conf: Config):
+        if not self.tracker or not conf["hhd.settings.tdp_enable"].to(bool):
+            return
+
+        prof = self.tracker.active()
+        if prof is self.current:
+            return
+
+        # Keys changed by the user while the profile was active are kept
+        applied = self.current.values if self.current else {}
+        saved = {
+            k: v for k, v in self.saved.items() if conf.get(k, None) == applied.get(k)
+        }
+        # Restore the values the previous profile changed
+        for k, v in saved.items():
+            if not prof or k not in prof.values:
+                conf[k] = v
+        if prof:
+            logger.info(f"Applying app profile '{prof.name}'.")
+            saved = {
+                k: saved[k] if k in saved else conf.get(k, None) for k in prof.values
+            }
+            for k, v in prof.values.items():
+                conf[k] = v
+            self.saved = {k: v for k, v in saved.items() if v is not None}
+        else:
+            logger.info(f"Restoring settings of app profile '{self.current.name}'.")
+            self.saved = {}
+        self.current = prof
+
+    def close(self):
+        if self.tracker:
+            self.tracker.close()
+            self.tracker = None
+
 
 def autodetect(existing: Sequence[HHDPlugin]) -> Sequence[HHDPlugin]:
     if len(existing):
         return existing
 
-    from .drivers.asus import AsusDriverPlugin
-    from .drivers.lenovo import LenovoDriverPlugin
-    from .drivers.smu import SmuDriverPlugin, SmuQamPlugin
-    from .drivers.amd import AmdGPUPlugin
+    # Drivers are imported only if they match, as this runs during boot
+    from .core.detect import find_cpu, get_cpu_model, get_product_name
 
     drivers = []
-    with open("/sys/devices/virtual/dmi/id/product_name") as f:
-        prod = f.read().strip()
-    with open("/proc/cpuinfo") as f:
-        cpuinfo = f.read().strip()
+    prod = get_product_name()
+
+    if os.environ.get("HHD_ADJ_EMULATE"):
+        from .core.emulate import install_from_env
+
+        # Firmware emulator for testing, in place of acpi_call
+        if install_from_env() == "lenovo":
+            prod = "83E1"
 
     use_acpi_call = False
     drivers_matched = False
+    # Used to map the shorthands of app profiles
+    driver = None
 
     # FIXME: Switch to per device
     # But all devices use the same values
@@ -257,7 +362,10 @@ def autodetect(existing: Sequence[HHDPlugin]) -> Sequence[HHDPlugin]:
     max_tdp = 30
 
     if prod == "83E1" and not bool(os.environ.get("HHD_ADJ_ALLY")):
+        from .drivers.lenovo import LenovoDriverPlugin
+
         drivers.append(LenovoDriverPlugin())
+        driver = "lenovo"
         drivers_matched = True
         use_acpi_call = True
 
@@ -267,7 +375,10 @@ def autodetect(existing: Sequence[HHDPlugin]) -> Sequence[HHDPlugin]:
         or bool(os.environ.get("HHD_ADJ_DEBUG"))
         or bool(os.environ.get("HHD_ADJ_ALLY"))
     ):
+        from .drivers.asus import AsusDriverPlugin
+
         drivers.append(AsusDriverPlugin("RC72L" in prod))
+        driver = "asus"
         drivers_matched = True
         min_tdp = 7
 
@@ -275,6 +386,8 @@ def autodetect(existing: Sequence[HHDPlugin]) -> Sequence[HHDPlugin]:
         drivers_matched = False
 
     if not drivers_matched and prod in DEV_DATA:
+        from .drivers.smu import SmuDriverPlugin, SmuQamPlugin
+
         dev, cpu, pp_enable = DEV_DATA[prod]
 
         try:
@@ -304,24 +417,28 @@ def autodetect(existing: Sequence[HHDPlugin]) -> Sequence[HHDPlugin]:
                 init_tdp=not prod == "83E1",
             ),
         )
+        driver = "smu"
         drivers_matched = True
         use_acpi_call = True
 
-    if not drivers_matched:
-        for name, (dev, cpu) in CPU_DATA.items():
-            if name in cpuinfo:
-                drivers.append(
-                    SmuDriverPlugin(
-                        dev,
-                        cpu,
-                        platform_profile=True,
-                    )
-                )
-                drivers.append(
-                    SmuQamPlugin(dev, PLATFORM_PROFILE_MAP, ENERGY_MAP),
-                )
-                use_acpi_call = True
-                break
+    match = None if drivers_matched else find_cpu(get_cpu_model())
+    if match:
+        from .drivers.smu import SmuDriverPlugin, SmuQamPlugin
+
+        name, (dev, cpu) = match
+        logger.info(f"Found supported CPU '{name}'.")
+        drivers.append(
+            SmuDriverPlugin(
+                dev,
+                cpu,
+                platform_profile=True,
+            )
+        )
+        drivers.append(
+            SmuQamPlugin(dev, PLATFORM_PROFILE_MAP, ENERGY_MAP),
+        )
+        driver = "smu"
+        use_acpi_call = True
 
     if not drivers:
         from .drivers.general import GeneralPowerPlugin
@@ -331,9 +448,12 @@ def autodetect(existing: Sequence[HHDPlugin]) -> Sequence[HHDPlugin]:
         is_steamdeck = "Jupiter" in prod or "Galileo" in prod
         return [GeneralPowerPlugin(is_steamdeck=is_steamdeck)]
 
+    from .drivers.amd import AmdGPUPlugin
+
     return [
         *drivers,
         AdjustorInitPlugin(use_acpi_call=use_acpi_call),
         AdjustorPlugin(min_tdp, default_tdp, max_tdp),
         AmdGPUPlugin(),
+        AppProfilePlugin(driver),
     ]